@@ -32,6 +32,7 @@ class UserConfig(config.Config):
     sampler.cache_size = 1
     sampler.collect_idle_time = 0.01
     sampler.sample_idle_time = 0.1
+    sampler.hedge = None  # latency percentile to hedge reads at, see ReadHeadPool
 
     # runner
     runner = config.namespace()
@@ -3,6 +3,7 @@ import time
 import os
 
 import raylink
+from raylink.data.replay import ReadHeadPool
 from .policy import Policy
 
 
@@ -20,8 +21,10 @@ class Learner(raylink.OutlineNode):
         self.sampled_batch = [None]
 
         self.replay = self.find_alias('replay')
-        self.rheads = [self.find_path(path)
-                       for path in self.replay.get_read_heads_path()]
+        self.rheads = ReadHeadPool(
+            [self.find_path(path)
+             for path in self.replay.get_read_heads_path()],
+            hedge=self.config.sampler.get('hedge'))
         self.rkeys = self.replay.get_keys()
         self.queue = self.find_alias('queue')
 
@@ -43,10 +46,8 @@ class Learner(raylink.OutlineNode):
         indices, _ = self.replay.acquire_safe_area(
             self.nid_(), self.batch_size, self.rkeys)
         assert len(indices) == self.batch_size
-        # Only use the first readhead
-        samples = self.rheads[0].read_t_async(
+        self.sampled_batch = self.rheads.read(
             self.rkeys, cursors={k: indices for k in self.rkeys}, count=True)
-        self.sampled_batch = raylink.get(samples)
 
     def learn(self):
         """Update policy with the batch sampled"""
@@ -18,6 +18,9 @@ class Worker(raylink.OutlineNode):
         self.rhead = self.find_path(
             random.choice(self.replay.get_write_heads_path()))
         self.queue = self.find_alias('queue')
+        # samples are sent in batches, see `TunnelCoalescer`
+        self.rhead_writer = self.rhead.coalesce_t()
+        self.queue_writer = self.queue.coalesce_t()
         self.env = gym.make(self.config.env.name)
         self._logger.info('Worker setup complete')
 
@@ -62,7 +65,9 @@ class Worker(raylink.OutlineNode):
             # pre-set this structure in config.py
             sample = {'s': s, 'a': a, 'r': r, 't': t, 's_': s_}
             sample['ts'] = self.learn_step
-            self.rhead.write_inc_t(sample)
-            self.queue.put_t(sample)
+            self.rhead_writer.write_inc(sample)
+            self.queue_writer.put(sample)
             if done:
                 break
+        self.rhead_writer.flush()
+        self.queue_writer.flush()
@@ -9,6 +9,13 @@ from raylink.util.monitor import TM, ProcMem
 
 class PSOfficer(raylink.OutlineNode):
     TYPE = 'ps_officer'
+    # id and info lookups are not queued behind parameter transfers
+    _tunnel_lanes = {
+        'control': {'methods': ['get_id', 'get_ids', 'get_p_info',
+                                'get_p_infos', 'get_meta_info', 'list_tags',
+                                'tags_info'],
+                    'max_workers': 4},
+    }
 
     def setup(self):
         """Setup this ps officer."""
@@ -1,4 +1,5 @@
 from .shm_replay import ShmReplay, ReadHead, WriteHead
 from .queue import Queue
-# from raylink.data.replay.shm_replay import SafeArea, Area
+from .pool import ReadHeadPool
+from .interval import IntervalSet
 # from raylink.replay.bytes_replay import BytesReplay
@@ -0,0 +1,154 @@
+__all__ = ['IntervalSet']
+
+import numpy as np
+
+
+class IntervalSet(object):
+    """Set of slots of a replay as sorted, disjoint intervals.
+
+    Intervals are inclusive and kept in NumPy arrays of their starts and
+    ends, so membership is a binary search and the indices are built
+    without Python loops. As slots form a ring, the set is ordered from
+    `origin`, the oldest slot, e.g. `get_last` returns the newest slots.
+
+    Args:
+        starts (list): Starts of the intervals
+        ends (list): Ends of the intervals, empty intervals are dropped
+        origin (int): First slot of the ring order
+    """
+
+    def __init__(self, starts=(), ends=(), origin=0):
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1)
+        ends = np.asarray(ends, dtype=np.int64).reshape(-1)
+        keep = starts <= ends
+        starts, ends = starts[keep], ends[keep]
+        order = np.argsort(starts, kind='stable')
+        starts, ends = starts[order], ends[order]
+        if len(starts) > 1:
+            # merge overlapping and adjacent intervals
+            reach = np.maximum.accumulate(ends)
+            first = np.ones(len(starts), dtype=bool)
+            first[1:] = starts[1:] > reach[:-1] + 1
+            last = np.roll(first, -1)
+            starts, ends = starts[first], reach[last]
+        self.starts = starts
+        self.ends = ends
+        self.origin = origin
+
+    @property
+    def length(self):
+        return int((self.ends - self.starts + 1).sum())
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, item):
+        return bool(self.contains(item))
+
+    def __repr__(self):
+        return f'IntervalSet({self.intervals()}, origin={self.origin})'
+
+    def contains(self, items):
+        """Vectorized membership of an index or an array of indices."""
+        items = np.asarray(items)
+        if not len(self.starts):
+            return np.zeros(items.shape, dtype=bool)
+        i = np.searchsorted(self.starts, items, side='right') - 1
+        return (i >= 0) & (items <= self.ends[np.maximum(i, 0)])
+
+    def add_area(self, start, end):
+        """Add the interval from `start` to `end` in place."""
+        s = IntervalSet(np.append(self.starts, start),
+                        np.append(self.ends, end))
+        self.starts, self.ends = s.starts, s.ends
+
+    def _combine(self, other, op):
+        points = np.unique(np.concatenate(
+            [self.starts, self.ends + 1, other.starts, other.ends + 1]))
+        # every slot between two points is in a set or not
+        keep = op(self.contains(points), other.contains(points))[:-1]
+        return IntervalSet(points[:-1][keep], points[1:][keep] - 1,
+                           self.origin)
+
+    def union(self, other):
+        return self._combine(other, np.logical_or)
+
+    def difference(self, other):
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def intersection(self, other):
+        return self._combine(other, np.logical_and)
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
+    def _ring(self):
+        """Starts and ends in the ring order from `origin`."""
+        starts, ends, o = self.starts, self.ends, self.origin
+        if ((starts < o) & (o <= ends)).any():
+            starts = np.sort(np.append(starts, o))
+            ends = np.sort(np.append(ends, o - 1))
+        k = np.searchsorted(starts, o)
+        return (np.concatenate([starts[k:], starts[:k]]),
+                np.concatenate([ends[k:], ends[:k]]))
+
+    def intervals(self):
+        """List of (start, end) in the ring order."""
+        return [(int(s), int(e)) for s, e in zip(*self._ring())]
+
+    def get_last(self, size):
+        """Get the newest `size` slots.
+
+        Returns:
+            IntervalSet: The slots, None if there are fewer than `size`
+        """
+        starts, ends = self._ring()
+        lengths = ends - starts + 1
+        tail = np.cumsum(lengths[::-1])
+        if size <= 0:
+            return IntervalSet()
+        if not len(tail) or tail[-1] < size:
+            return
+        k = int(np.searchsorted(tail, size))
+        first = len(starts) - 1 - k
+        starts, ends = starts[first:].copy(), ends[first:]
+        starts[0] = ends[0] - (size - (tail[k] - lengths[first])) + 1
+        return IntervalSet(starts, ends, int(starts[0]))
+
+    def sample(self, size, rng=None):
+        """Draw `size` slots uniformly with replacement, without building
+        the indices of the set.
+
+        Args:
+            size (int): Number of slots
+            rng (np.random.Generator): Random generator
+
+        Returns:
+            np.ndarray: The slots
+
+        Raises:
+            ValueError: If slots are drawn from an empty set
+        """
+        if size == 0:
+            return np.empty(0, dtype=np.int64)
+        if not len(self.starts):
+            raise ValueError('cannot sample from an empty IntervalSet')
+        rng = np.random.default_rng() if rng is None else rng
+        lengths = self.ends - self.starts + 1
+        offsets = np.cumsum(lengths)
+        ranks = rng.integers(0, offsets[-1], size)
+        i = np.searchsorted(offsets, ranks, side='right')
+        return self.starts[i] + ranks - (offsets[i] - lengths[i])
+
+    def to_indices(self):
+        """Every slot in the ring order.
+
+        Returns:
+            np.ndarray: The slots
+        """
+        starts, ends = self._ring()
+        lengths = ends - starts + 1
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum(), dtype=np.int64) + \
+            np.repeat(starts - offsets, lengths)
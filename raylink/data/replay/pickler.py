@@ -1,64 +1,34 @@
-__all__ = ['WriteHeadPickler', 'ReadHeadPickler']
+__all__ = ['WriteHeadPickler']
 
-import pickle
-import marshal
 import numpy as np
-from raylink.data.tunnel.pickler import Pickler
+from raylink.data.tunnel.pickler import ArrayDictPickler
 
 
-class WriteHeadPickler(Pickler):
-    funcs = ['write', 'write_inc']
+class WriteHeadPickler(ArrayDictPickler):
+    """Pickler of `WriteHead`, whose samples are sent as raw arrays.
 
-    @classmethod
-    def _custom_c2s_dumps(cls, func, *args, **kwargs):
-        keys, cursors, samples = args
-        new_args = {b'keys': marshal.dumps(keys),
-                    b'cursors': pickle.dumps(cursors)}
-        for k in samples:
-            _k = k.encode()
-            array = samples[k]
-            new_args[_k + b'_bytes'] = array.tobytes()
-            array_info = array.shape, array.dtype
-            new_args[_k + b'_info'] = pickle.dumps(array_info)
-        return new_args
-
-    @classmethod
-    def _custom_c2s_loads(cls, func, args):
-        keys = marshal.loads(args[b'keys'])
-        cursors = marshal.loads(args[b'cursors'])
-        samples = {}
-        for k in keys:
-            _k = k.encode()
-            shape, dtype = pickle.loads(args[_k + b'_info'])
-            array = np.frombuffer(args[_k + b'_bytes'], dtype=dtype)
-            array = array.reshape(shape)
-            samples[k] = array
-        args = keys, cursors, samples
-        return args, {}
-
-
-class ReadHeadPickler(Pickler):
-    funcs = ['read']
-
-    @classmethod
-    def _custom_s2c_dumps(cls, func, returns):
-        new_returns = {b'keys': marshal.dumps(list(returns.keys()))}
-        for k in returns:
-            _k = k.encode()
-            array = returns[k]
-            new_returns[_k + b'_bytes'] = array.tobytes()
-            array_info = array.shape, array.dtype
-            new_returns[_k + b'_info'] = pickle.dumps(array_info)
-        return new_returns
+    Buffered `write_inc` calls are merged into one `write_multi_inc`
+    call with a contiguous array per key.
+    """
 
     @classmethod
-    def _custom_s2c_loads(cls, func, returns):
-        keys = marshal.loads(returns[b'keys'])
-        samples = {}
-        for k in keys:
-            _k = k.encode()
-            shape, dtype = pickle.loads(returns[_k + b'_info'])
-            array = np.frombuffer(returns[_k + b'_bytes'], dtype=dtype)
-            array = array.reshape(shape)
-            samples[k] = array
-        return samples
+    def coalesce(cls, calls):
+        merged, runs = [], {}
+        run = None
+        for func, args, kwargs in calls:
+            if func != 'write_inc' or kwargs or len(args) != 1:
+                run = None
+                merged.append((func, args, kwargs))
+                continue
+            samples = args[0]
+            if run is not None and run.keys() == samples.keys():
+                for k in samples:
+                    run[k].append(samples[k])
+                continue
+            run = {k: [v] for k, v in samples.items()}
+            runs[len(merged)] = run
+            merged.append(None)
+        for i, run in runs.items():
+            merged[i] = ('write_multi_inc',
+                         ({k: np.stack(v) for k, v in run.items()},), {})
+        return merged
@@ -0,0 +1,145 @@
+__all__ = ['ReadHeadPool']
+
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from threading import Lock
+import numpy as np
+import time
+
+from raylink.data.tunnel.stats import Histogram
+
+
+class ReadHeadPool(object):
+    """Client of the read heads of a replay.
+
+    Every `read` goes to the head with the fewest outstanding reads of this
+    pool. With `hedge`, a read still running after the `hedge` percentile
+    of the observed latencies is sent again to a second head, without
+    `count`, and the first result wins. `read_split` reads one large batch
+    from all the heads in parallel.
+
+    Args:
+        heads (list): Read head wrappers, e.g. by `OutlineNode.find_path`
+        hedge (float): Latency percentile to hedge reads at, None to disable
+        min_samples (int): Reads observed before hedging
+        window (int): Reads per latency window, so the percentile follows
+            the load of the replay host
+    """
+
+    def __init__(self, heads, hedge=None, min_samples=20, window=1000):
+        assert heads, 'no read heads'
+        self.heads = list(heads)
+        self.hedge = hedge
+        self.min_samples = min_samples
+        self.window = window
+        self.outstanding = [0] * len(self.heads)
+        self.hedged = 0
+        self._next = 0
+        self._hist = Histogram()
+        self._last_hist = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.heads)
+
+    def _pick(self, exclude=None):
+        with self._lock:
+            n = len(self.heads)
+            # round robin among the least loaded heads
+            order = [(self._next + i) % n for i in range(n)]
+            i = min((i for i in order if i != exclude),
+                    key=self.outstanding.__getitem__, default=None)
+            if i is not None:
+                self.outstanding[i] += 1
+                self._next = (i + 1) % n
+            return i
+
+    def _done(self, i, st, future):
+        rt = (time.perf_counter_ns() - st) // 1000
+        with self._lock:
+            self.outstanding[i] -= 1
+            if future.exception() is not None:
+                return
+            self._hist.record(rt)
+            if self._hist.count >= self.window:
+                self._last_hist, self._hist = self._hist, Histogram()
+
+    def _submit(self, i, keys, cursors, count):
+        st = time.perf_counter_ns()
+        try:
+            future = self.heads[i].read_t_async(keys, cursors, count=count)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        future.add_done_callback(lambda f: self._done(i, st, f))
+        return future
+
+    def hedge_delay(self):
+        """Seconds before a read is hedged, None if not hedging yet."""
+        if self.hedge is None or len(self.heads) < 2:
+            return
+        with self._lock:
+            hist = self._last_hist or self._hist
+            if hist.count < self.min_samples:
+                return
+            return hist.percentile(self.hedge) / 1e6
+
+    def read_async(self, keys, cursors, count=False):
+        """`ReadHead.read` on the least loaded head, not hedged.
+
+        Returns:
+            Future: The batch
+        """
+        return self._submit(self._pick(), keys, cursors, count)
+
+    def read(self, keys, cursors, count=False, timeout=None):
+        """`ReadHead.read` on the least loaded head, hedged if enabled.
+
+        Only the first read counts the access, so a hedged read still
+        counts it once if the first head eventually answers.
+        """
+        i = self._pick()
+        future = self._submit(i, keys, cursors, count)
+        delay = self.hedge_delay()
+        if delay is None or wait([future], delay).done:
+            return future.result(timeout)
+        j = self._pick(exclude=i)
+        hedge = self._submit(j, keys, cursors, False)
+        with self._lock:
+            self.hedged += 1
+        futures = {future, hedge}
+        while futures:
+            done, futures = wait(futures, timeout, FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f'read timed out after {timeout}s')
+            for f in done:
+                if f.exception() is None or not futures:
+                    return f.result()
+
+    def read_split(self, keys, cursors, count=False, min_size=1):
+        """Read a batch in parts from all the heads in parallel.
+
+        Args:
+            keys (list): Keys to read
+            cursors (dict): Cursors of each key, of the same length
+            count (bool): Count the access of the cursors
+            min_size (int): Min number of cursors of a part
+
+        Returns:
+            dict: `{key: array}` of the whole batch, in the cursor order
+        """
+        size = len(cursors[keys[0]])
+        parts = max(1, min(len(self.heads), size // max(min_size, 1)))
+        if parts == 1:
+            return self.read(keys, cursors, count)
+        bounds = np.linspace(0, size, parts + 1).astype(int)
+        futures = [
+            self.read_async(keys, {k: cursors[k][s:e] for k in keys}, count)
+            for s, e in zip(bounds[:-1], bounds[1:])]
+        results = [f.result() for f in futures]
+        return {k: np.concatenate([r[k] for r in results]) for k in keys}
+
+    def stats(self):
+        with self._lock:
+            return {'outstanding': list(self.outstanding),
+                    'hedged': self.hedged,
+                    'latency_us': (self._last_hist or self._hist).snapshot()}
@@ -1,5 +1,6 @@
 __all__ = ['Queue']
 
+from raylink.data.tunnel.pickler import array_dict
 import numpy as np
 import raylink
 import queue
@@ -7,11 +8,15 @@ import queue
 
 class Queue(raylink.OutlineNode):
     TYPE = 'queue'
+    # `get` waits for `put`s, a `put` to a full queue gives up after its
+    # `timeout`, so it runs in the executor
+    _tunnel_blocking = ('get',)
 
     def setup(self, size):
         self._buffer = queue.Queue(maxsize=size)
         self._batch_size = None
 
+    @array_dict('data')
     def put(self, data: dict, timeout=1):
         """Expect using tunnel proxy to put data"""
         try:
@@ -19,6 +24,7 @@ class Queue(raylink.OutlineNode):
         except queue.Full:
             pass
 
+    @array_dict(returns=True)
     def get(self, size):
         """Expect using tunnel proxy to get batch"""
         data = {}
@@ -2,10 +2,14 @@ __all__ = ['WriteHead', 'ReadHead', 'ShmReplay']
 
 from raylink.data.shm import ShM
 import numpy as np
+import threading
+import fcntl
 import time
 import sys
 import raylink
-from .pickler import ReadHeadPickler
+from .pickler import WriteHeadPickler
+from .interval import IntervalSet
+from raylink.data.tunnel.pickler import array_dict
 from tabulate import tabulate
 
 
@@ -17,78 +21,6 @@ def sizeof_fmt(num, suffix='B'):
     return "%.1f%s%s" % (num, 'Yi', suffix)
 
 
-class Area(object):
-    """Auxiliary class representing an area with a start and an end.
-    """
-
-    def __init__(self, start, end):
-        self.start = start
-        self.end = end
-        self.length = end - start + 1
-
-    def __len__(self):
-        return self.length
-
-
-class SafeArea(object):
-    def __init__(self):
-        self.areas = []
-        self.length = 0
-
-    def add_area(self, start, end):
-        """Add an available area.
-
-        Args:
-            start (int): The start of the area
-            end (int): The end of the area
-        """
-        if end < start:
-            return
-        a = Area(start, end)
-        self.areas.append(a)
-        self.length += a.length
-
-    def get_last(self, size):
-        """Get the newest added areas with total length as size.
-
-        Args:
-            size (int): Size of the areas
-
-        Returns:
-            SafeArea: A group of areas with the total length as `size`
-        """
-        _size = size
-        sa = SafeArea()
-        for a in self.areas[::-1]:
-            if a.length >= _size:
-                sa.add_area(a.end - _size + 1, a.end)
-                assert sa.length == size
-                return sa
-            else:
-                sa.add_area(a.start, a.end)
-                _size -= a.length
-
-    def to_list(self):
-        """Convert areas into a list
-
-        Returns:
-            list: A list contains every index in `self.areas`
-        """
-        _list = []
-        for a in self.areas:
-            _list.extend(list(range(a.start, a.end + 1)))
-        return _list
-
-    def __len__(self):
-        return self.length
-
-    def __contains__(self, item):
-        for a in self.areas:
-            if a.start <= item <= a.end:
-                return True
-        return False
-
-
 class NPSharedMemory(object):
     def __init__(self, arr, name=None):
         self.arr_shape = arr.shape
@@ -124,14 +56,216 @@ class NPSharedMemory(object):
         self.__dict__.update(state)
 
 
+class CursorBlock(object):
+    """Write cursor of a replay and its writes in flight in shared memory.
+
+    Write heads on the host of the replay reserve and release slots in the
+    block without calling the replay. It holds the number of reserved slots,
+    a table of the writes in flight and a table of the areas being read,
+    which writes must not overlap. The tables are guarded by a lock shared
+    by every process attaching the block, taken by `with block:`; only
+    `reserve` and `release` take it themselves.
+
+    Args:
+        capacity (int): Capacity of the replay
+        max_writes (int): Max number of writes in flight
+        max_areas (int): Max number of areas being read
+    """
+    # number of reserved slots and the next cid
+    HEADER = 2
+    # owners of the areas held by `sample`, beyond the ones of the replay
+    SAMPLE_OWNER = 1 << 40
+    MAX_WRITES = 256
+    MAX_AREAS = 256
+
+    def __init__(self, capacity, max_writes=MAX_WRITES, max_areas=MAX_AREAS):
+        self.capacity = capacity
+        self.max_writes = max_writes
+        self.max_areas = max_areas
+        block = np.full(self.HEADER + 3 * (max_writes + max_areas), -1,
+                        dtype=np.int64)
+        block[:self.HEADER] = 0
+        self.shm = NPSharedMemory(block)
+        self._setup()
+
+    def _setup(self):
+        array = self.shm.array
+        w = self.HEADER + 3 * self.max_writes
+        self._header = array[:self.HEADER]
+        # rows of (cid, position, size) and (owner, start, end), -1 if free
+        self._writes = array[self.HEADER:w].reshape(-1, 3)
+        self._areas = array[w:].reshape(-1, 3)
+        self._thread_lock = threading.Lock()
+
+    def attach(self):
+        self.shm.attach()
+        self._setup()
+
+    def __getstate__(self):
+        return {
+            'capacity': self.capacity,
+            'max_writes': self.max_writes,
+            'max_areas': self.max_areas,
+            'shm': self.shm
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        # the lock of an open file is shared by its threads
+        fcntl.flock(self.shm.shm._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.shm.shm._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    @property
+    def num(self):
+        """Number of slots reserved so far."""
+        return int(self._header[0])
+
+    def writes(self):
+        """Positions of the first slot of the oldest write in flight and the
+        last slot of the newest, None if no writes are in flight.
+        """
+        writes = self._writes[self._writes[:, 0] >= 0]
+        if not len(writes):
+            return
+        return (int(writes[:, 1].min()),
+                int((writes[:, 1] + writes[:, 2]).max()) - 1)
+
+    def valid(self):
+        """Slots written and not being written, from the oldest.
+
+        Returns:
+            IntervalSet: The slots
+        """
+        num, capacity = self.num, self.capacity
+        writes = self.writes()
+        if writes is None:
+            if num > capacity:
+                return IntervalSet([0], [capacity - 1], num % capacity)
+            return IntervalSet([0], [num - 1])
+        # slots from the oldest to the newest write in flight
+        _old_cursor = writes[0] % capacity
+        _new_cursor = writes[1] % capacity
+        if _old_cursor > _new_cursor:
+            return IntervalSet([_new_cursor + 1], [_old_cursor - 1])
+        return IntervalSet([0, _new_cursor + 1],
+                           [_old_cursor - 1, min(num, capacity) - 1],
+                           _new_cursor + 1 if num > capacity else 0)
+
+    def sample(self, shms, batch_size, keys, rng=None):
+        """Gather `batch_size` uniform slots of `keys` from `shms`, drawn
+        with replacement.
+
+        Slots being written are excluded. The span of the drawn slots is
+        held, as by `hold`, while they are gathered outside the lock, so
+        writes elsewhere go on meanwhile.
+
+        Returns:
+            tuple: The slots (np.ndarray) and `{key: array}`, or an empty
+                list and None if no slot is valid
+        """
+        with self:
+            valid = self.valid()
+            if not valid.length:
+                return [], None
+            indices = valid.sample(batch_size, rng)
+            # the span of the draws in each valid interval
+            areas = []
+            for start, end in valid.intervals():
+                inside = indices[(start <= indices) & (indices <= end)]
+                if len(inside):
+                    areas.append((int(inside.min()), int(inside.max())))
+            # unique among processes, as the cids
+            owner = self.SAMPLE_OWNER + int(self._header[1])
+            self._header[1] += 1
+            if not self.hold(owner, areas):
+                # no room to hold them, gather under the lock
+                return indices, {key: shms[key].array[indices]
+                                 for key in keys}
+        try:
+            return indices, {key: shms[key].array[indices] for key in keys}
+        finally:
+            with self:
+                self.free(owner)
+
+    def validate(self, num):
+        """Whether the next `num` slots can be written.
+
+        They must not be in an area being read, nor overrun the oldest
+        write in flight by one loop.
+        """
+        if num > self.capacity:
+            return False
+        pos = self.num
+        start = pos % self.capacity
+        end = (pos + num - 1) % self.capacity
+        if start <= end:
+            ranges = [(start, end)]
+        else:
+            ranges = [(start, self.capacity - 1), (0, end)]
+        areas = self._areas[self._areas[:, 0] >= 0]
+        for start, end in ranges:
+            if ((areas[:, 1] <= end) & (start <= areas[:, 2])).any():
+                return False
+        writes = self.writes()
+        return writes is None or pos + num <= writes[0] + self.capacity
+
+    def reserve(self, num=1):
+        """See `ShmReplay.reserve_cursors`."""
+        with self:
+            free = np.flatnonzero(self._writes[:, 0] < 0)
+            if not len(free):
+                raise RuntimeError(
+                    f'{self.max_writes} writes in flight, the cursor block '
+                    f'needs a larger max_writes')
+            if not self.validate(num):
+                return -1, None, np.empty(0, dtype=np.uint64)
+            pos, cid = (int(v) for v in self._header)
+            self._writes[free[0]] = cid, pos, num
+            self._header[:] = pos + num, cid + 1
+        cursors = np.arange(pos, pos + num, dtype=np.uint64)
+        return 0, cid, cursors % np.uint64(self.capacity)
+
+    def release(self, cids):
+        """Release the slots of a cid or a list of cids of `reserve`."""
+        with self:
+            self._writes[np.isin(self._writes[:, 0], cids)] = -1
+
+    def hold(self, owner, areas):
+        """Keep writes out of `areas`, a list of (start, end), until `free`.
+
+        Returns:
+            bool: False if there are too many areas being read
+        """
+        free = np.flatnonzero(self._areas[:, 0] < 0)
+        if len(free) < len(areas):
+            return False
+        for row, (start, end) in zip(free, areas):
+            self._areas[row] = owner, start, end
+        return True
+
+    def free(self, owner):
+        self._areas[self._areas[:, 0] == owner] = -1
+
+
 class WriteHead(raylink.OutlineNode):
     TYPE = 'head'
+    _pickler = WriteHeadPickler
 
-    def setup(self, shms: dict):
+    def setup(self, shms: dict, cursors: CursorBlock):
         self._shms = shms
         for shm in shms.values():
             shm.attach()
+        self._cursors = cursors
+        self._cursors.attach()
 
+    @array_dict('samples')
     def write(self, keys, cursors, samples):
         for key in keys:
             try:
@@ -140,55 +274,67 @@ class WriteHead(raylink.OutlineNode):
                 print(f'ERROR: Unable to write key, {key}', file=sys.stderr)
                 raise e
 
+    @array_dict('samples')
     def write_inc(self, samples):
         st = time.time()
-        res, cid, cursor = self._parent.register_cursor(1)
+        res, cid, cursor = self._cursors.reserve(1)
         if res == -1:
             print('WARN: Unable to increase cursor. Dropping.', file=sys.stderr)
             return cursor
-        for key in list(samples.keys()):
-            try:
-                array = self._shms[key].array
-                sample = np.array(samples.pop(key), array.dtype)
-                np.copyto(array[cursor[0], ...], sample)
-            except Exception as e:
-                print(f'Error: Unable to write key: {key}', file=sys.stderr)
-                raise e
-        self._shms['access_count'].array[cursor[0]] = 0
-        self._parent.unregister_cursor(cid)
+        try:
+            for key in list(samples.keys()):
+                try:
+                    array = self._shms[key].array
+                    sample = np.array(samples.pop(key), array.dtype)
+                    np.copyto(array[cursor[0], ...], sample)
+                except Exception as e:
+                    print(f'Error: Unable to write key: {key}',
+                          file=sys.stderr)
+                    raise e
+            self._shms['access_count'].array[cursor[0]] = 0
+        finally:
+            self._cursors.release(cid)
         self._llogger.debug(f'write_inc takes {time.time() - st}')
         return cursor
 
+    @array_dict('samples')
     def write_multi_inc(self, samples):
         st = time.time()
         num = len(list(samples.values())[0])
-        res, cid, cursor = self._parent.register_cursor(num)
+        res, cid, cursor = self._cursors.reserve(num)
         if res == -1:
             print('WARN: Unable to increase cursor. Dropping.', file=sys.stderr)
             return cursor
-        for key in list(samples.keys()):
-            try:
-                array = self._shms[key].array
-                sample = np.array(samples.pop(key), array.dtype)
-                array[cursor, ...] = sample
-            except Exception as e:
-                print(f'Error: Unable to write key: {key}', file=sys.stderr)
-                raise e
-        self._shms['access_count'].array[cursor] = 0
-        self._parent.unregister_cursor(cid)
+        try:
+            for key in list(samples.keys()):
+                try:
+                    array = self._shms[key].array
+                    sample = np.array(samples.pop(key), array.dtype)
+                    array[cursor, ...] = sample
+                except Exception as e:
+                    print(f'Error: Unable to write key: {key}',
+                          file=sys.stderr)
+                    raise e
+            self._shms['access_count'].array[cursor] = 0
+        finally:
+            self._cursors.release(cid)
         self._llogger.debug(f'write_multi_inc takes {time.time() - st}')
         return cursor
 
 
 class ReadHead(raylink.OutlineNode):
     TYPE = 'head'
+    _tunnel_codec = 'zlib'
 
-    def setup(self, shms: dict):
+    def setup(self, shms: dict, cursors: CursorBlock):
         self._shms = shms
         for shm in shms.values():
             shm.attach()
-        self._pickler = ReadHeadPickler
+        self._cursors = cursors
+        self._cursors.attach()
+        self._rng = np.random.default_rng()
 
+    @array_dict(returns=True)
     def read(self, keys, cursors, count=False):
         st = time.time()
         batch_sample = {}
@@ -203,22 +349,72 @@ class ReadHead(raylink.OutlineNode):
         self._llogger.debug(f'read takes {time.time() - st}')
         return batch_sample
 
+    @array_dict(returns=True)
+    def read_iter(self, keys, cursors, slice_size=None, count=False):
+        """Read like `read`, but yield the batch in chunks.
+
+        Through a tunnel this is a stream, so the reader can use the first
+        chunks while the rest are being read and sent.
+
+        Args:
+            keys (list): Keys to read
+            cursors (dict): Cursors of each key
+            slice_size (int): Yield `{key: array}` per key if None,
+                otherwise `{key: array}` of every key per `slice_size` rows
+
+        Yields:
+            dict: A chunk of the batch
+        """
+        if count:
+            for cursor in cursors[keys[0]]:
+                self._shms['access_count'].array[cursor] += 1
+        if slice_size is None:
+            for key in keys:
+                yield {key: self._shms[key].array[cursors[key]]}
+            return
+        for i in range(0, len(cursors[keys[0]]), slice_size):
+            yield {key: self._shms[key].array[cursors[key][i:i + slice_size]]
+                   for key in keys}
+
+    def sample(self, batch_size, keys, rng_seed=None, count=False):
+        """Sample uniformly from the written slots, see `ShmReplay.sample`.
+
+        Args:
+            count (bool): Count the access of the sampled slots
+        """
+        rng = self._rng if rng_seed is None else \
+            np.random.default_rng(rng_seed)
+        indices, batch_sample = self._cursors.sample(
+            self._shms, batch_size, keys, rng)
+        if count and batch_sample is not None:
+            np.add.at(self._shms['access_count'].array, indices, 1)
+        return indices, batch_sample
+
 
 class ShmReplay(raylink.OutlineNode):
     TYPE = 'replay'
+    # reads of learners go before cursor updates of workers
+    _tunnel_priorities = {'acquire_safe_area': 0, 'acquire_safe_area_iter': 0,
+                          'release_safe_area': 0}
+    # fixed once set up
+    _tunnel_cache = {'get_read_heads_path': {}, 'get_write_heads_path': {},
+                     'get_keys': {}}
+    # threads writing at a time per tunnel, `max_workers` of `TunnelServer`
+    WRITE_WORKERS = 32
 
     def setup(self, cfg):
         self._config = cfg
         self._capacity = self._config.capacity
         self.create_storage()
         self.create_head()
-        self._wh_cursors = {}
-        self._time_wh = {}
-        self._wh_time = {}
         self._nid_safe_area = {}
+        # owners of the areas held in the cursor block
+        self._nid_owner = {}
         self._safe_area_left = self._capacity
         self._safe_area_right = 0
         self._log_delta = 1000
+        self._stat_num = 0
+        self._rng = np.random.default_rng()
         self._ma_sp = 0
         self._ma_sp_lambda = 0.5
         self._actions = []
@@ -228,9 +424,12 @@ class ShmReplay(raylink.OutlineNode):
             f'ip: {self.ip_()}, node cfg {self.node_cfg_()}')
 
     def create_storage(self):
-        self._num = 0
-        self._loop_num = 0
-        self._next_cap = self._capacity
+        # a write in flight per tunnel thread of every write head and of the
+        # replay, unless `max_writes` is configured
+        max_writes = self._config.get('max_writes') or max(
+            CursorBlock.MAX_WRITES,
+            (self._config.get('num_write_head', 1) + 1) * self.WRITE_WORKERS)
+        self._cursor_block = CursorBlock(self._capacity, max_writes)
         self._keys = []
         self._shms = {}
 
@@ -266,7 +465,8 @@ class ShmReplay(raylink.OutlineNode):
     def create_head(self):
         self.write_heads = raylink.batch_create(
             WriteHead, self, bind=True, async_=True,
-            num=self._config.num_write_head, shms=self._shms)
+            num=self._config.num_write_head, shms=self._shms,
+            cursors=self._cursor_block)
         self.write_heads = raylink.get(self.write_heads)
         self.write_heads_path = []
         for head in self.write_heads:
@@ -274,7 +474,8 @@ class ShmReplay(raylink.OutlineNode):
         self.read_heads = []
         self.read_heads = raylink.batch_create(
             ReadHead, self, bind=True, async_=True,
-            num=self._config.num_read_head, shms=self._shms)
+            num=self._config.num_read_head, shms=self._shms,
+            cursors=self._cursor_block)
         self.read_heads = raylink.get(self.read_heads)
         self.read_heads_path = []
         for head in self.read_heads:
@@ -289,74 +490,86 @@ class ShmReplay(raylink.OutlineNode):
     def get_keys(self):
         return self._keys
 
+    @property
+    def _num(self):
+        return self._cursor_block.num
+
     def cursor(self):
         return self._num % self._capacity
 
     def loop_num(self):
-        return self._loop_num
+        return self._num // self._capacity
 
     def _validate_safe_area(self):
-        valid_safe_area = SafeArea()
-        if not self._wh_time:
-            if self.is_full():
-                if self.cursor() > 0:
-                    valid_safe_area.add_area(self.cursor(), self._capacity - 1)
-                    valid_safe_area.add_area(0, self.cursor() - 1)
-                else:
-                    valid_safe_area.add_area(self.cursor(), self._capacity - 1)
-            else:
-                valid_safe_area.add_area(0, self.cur_size() - 1)
-            return valid_safe_area
-        if len(self._wh_cursors) == 1:
-            cursor = list(self._wh_cursors.values())[0][0]
-            if self.is_full():
-                if cursor < self.cursor():
-                    valid_safe_area.add_area(self.cursor(), self._capacity - 1)
-                    valid_safe_area.add_area(0, cursor - 1)
-                    valid_safe_area.add_area(cursor + 1, self.cursor() - 1)
-                else:
-                    valid_safe_area.add_area(cursor + 1, self._capacity - 1)
-                    valid_safe_area.add_area(0, self.cursor())
-                    valid_safe_area.add_area(self.cursor() + 1, cursor - 1)
-            else:
-                valid_safe_area.add_area(0, cursor - 1)
-                valid_safe_area.add_area(cursor + 1, self.cur_size() - 1)
-            return valid_safe_area
-        _old_t = min(self._time_wh.keys())
-        _old_cursor, _old_loop_num = self._wh_cursors[self._time_wh[_old_t]]
-        _new_t = max(self._time_wh.keys())
-        _new_cursor, _new_loop_num = self._wh_cursors[self._time_wh[_new_t]]
-        if _old_cursor > _new_cursor:
-            valid_safe_area.add_area(_new_cursor + 1, _old_cursor - 1)
-            return valid_safe_area
-        if self.is_full():
-            valid_safe_area.add_area(_new_cursor + 1, self._capacity - 1)
-            valid_safe_area.add_area(0, _old_cursor - 1)
-            return valid_safe_area
-        valid_safe_area.add_area(0, _old_cursor - 1)
-        return valid_safe_area
+        return self._cursor_block.valid()
 
     def acquire_safe_area(self, nid, size, keys):
         self._lock()
         self._actions.append(f'acquire_safe_area({repr(nid)}, {repr(size)}, {repr(keys)}')
-        valid_safe_area = self._validate_safe_area()
-        if valid_safe_area.length < size:
-            self._unlock()
-            return [], None
-
-        valid_safe_area = valid_safe_area.get_last(size)
+        owner = self._nid_owner.setdefault(nid, len(self._nid_owner))
+        # writes of the heads are kept out until it is released
+        with self._cursor_block as block:
+            block.free(owner)
+            self._nid_safe_area.pop(nid, None)
+            valid_safe_area = self._validate_safe_area()
+            if valid_safe_area.length < size:
+                self._unlock()
+                return [], None
+            valid_safe_area = valid_safe_area.get_last(size)
+            if not block.hold(owner, valid_safe_area.intervals()):
+                self._unlock()
+                return [], None
         self._nid_safe_area[nid] = valid_safe_area
         self._unlock()
-        area_list = valid_safe_area.to_list()
+        self.update_stat()
+        area_list = valid_safe_area.to_indices()
         batch_sample = {}
         for key in keys:
             batch_sample[key] = self._shms[key].array[area_list]
         return area_list, batch_sample
 
+    def sample(self, batch_size, keys, rng_seed=None):
+        """Sample uniformly, with replacement, from the written slots.
+
+        Unlike `acquire_safe_area`, which returns the newest slots, any
+        valid slot may be drawn. Slots being written are excluded, and the
+        drawn slots are only held from writes while they are gathered, so
+        no safe area is kept, see `CursorBlock.sample`.
+
+        Args:
+            batch_size (int): Number of slots
+            keys (list): Keys to gather
+            rng_seed (int): Seed of the draw, random if None
+
+        Returns:
+            tuple: The slots (np.ndarray) and `{key: array}`, or an empty
+                list and None if no slot is valid
+        """
+        rng = self._rng if rng_seed is None else \
+            np.random.default_rng(rng_seed)
+        return self._cursor_block.sample(self._shms, batch_size, keys, rng)
+
+    def acquire_safe_area_iter(self, nid, size, keys):
+        """Acquire like `acquire_safe_area`, but stream the batch.
+
+        Yields:
+            The cursors of the area first (empty if the safe area is too
+            small), then `{key: array}` per key
+        """
+        area_list, _ = self.acquire_safe_area(nid, size, [])
+        yield area_list
+        if not len(area_list):
+            return
+        for key in keys:
+            yield {key: self._shms[key].array[area_list]}
+
     def release_safe_area(self, nid):
         self._lock()
         self._actions.append(f'release_safe_area({repr(nid)})')
         self._nid_safe_area.pop(nid, None)
+        if nid in self._nid_owner:
+            with self._cursor_block as block:
+                block.free(self._nid_owner[nid])
         self._unlock()
 
     def is_full(self):
@@ -368,11 +581,11 @@ class ShmReplay(raylink.OutlineNode):
         return self._num
 
     def update_stat(self):
-        if self._num % self._log_delta != 0:
+        if self._num - self._stat_num < self._log_delta:
             return
         if hasattr(self, '_tick_time'):
             delta_time = time.time() - self._tick_time
-            sp = self._log_delta / delta_time
+            sp = (self._num - self._stat_num) / delta_time
             if self._ma_sp == 0:
                 self._ma_sp = sp
             else:
@@ -384,6 +597,7 @@ class ShmReplay(raylink.OutlineNode):
             if self._ma_sp < self._log_delta // 10:
                 self._log_delta = self._log_delta // 10
         self._tick_time = time.time()
+        self._stat_num = self._num
         if 'version' in self._shms:
             a = self._shms['version'].array
             unique, counts = np.unique(a, return_counts=True)
@@ -392,67 +606,56 @@ class ShmReplay(raylink.OutlineNode):
         self._llogger.debug('\n' + '\n'.join(self._actions))
         self._actions = []
 
-    def validate_cursor(self):
-        _cursor = self.cursor()
-        for safe_area in self._nid_safe_area.values():
-            if _cursor in safe_area:
-                return False
-        if len(self._wh_cursors) == 0:
-            return True
-        _old_t = min(self._time_wh.keys())
-        _old_cursor, _old_loop_num = self._wh_cursors[self._time_wh[_old_t]]
-        # loop for one capacity
-        if self.loop_num() > _old_loop_num and _old_cursor <= _cursor:
-            return False
-        return True
+    def validate_cursor(self, num=1):
+        """Whether the next `num` slots can be written, see
+        `CursorBlock.validate`.
+        """
+        with self._cursor_block as block:
+            return block.validate(num)
 
-    def _register_cursor(self):
-        self._lock()
-        if self._actions and '_register_cursor()' in self._actions[-1]:
+    def _log_action(self, action):
+        if self._actions and action in self._actions[-1]:
             self._last_action_count += 1
-            self._actions[-1] = f'_register_cursor() +{self._last_action_count}'
         else:
             self._last_action_count = 1
-            self._actions.append(f'_register_cursor() +{self._last_action_count}')
-        cid = str(time.time()) + '-' + self._nid
-        if not self.validate_cursor():
-            return -1, 0, 0
-        _cursor = self.cursor()
-        self._wh_cursors[cid] = _cursor, self.loop_num()
-        c_time = time.time()
-        self._time_wh[c_time] = cid
-        self._wh_time[cid] = c_time
-        self._num += 1
-        if self._num == self._next_cap:
-            self._loop_num += 1
-            self._next_cap += self._capacity
+            self._actions.append('')
+        self._actions[-1] = f'{action} +{self._last_action_count}'
+
+    def reserve_cursors(self, num=1):
+        """Reserve the next `num` slots for a write.
+
+        The slots are contiguous from the cursor, wrapping around the
+        capacity, and share one cid to release them by `unregister_cursor`.
+        Write heads reserve them in the `CursorBlock` without this call.
+
+        Args:
+            num (int): Number of slots
+
+        Returns:
+            tuple: 0, the cid and the cursors (np.ndarray) of the slots, or
+                -1, None and no cursors if the slots can not be written
+
+        Raises:
+            RuntimeError: If the table of writes in flight is full
+        """
+        self._lock()
+        self._log_action('reserve_cursors()')
         self._unlock()
         self.update_stat()
-        return 0, cid, _cursor
+        return self._cursor_block.reserve(num)
 
     def register_cursor(self, num=1):
-        cids, cursors = [], []
-        for _ in range(num):
-            res, cid, cursor = self._register_cursor()
-            if res == -1:
-                return -1, cids, np.array(cursors, dtype=np.uint64)
-            cids.append(cid)
-            cursors.append(cursor)
-        return 0, cids, np.array(cursors, dtype=np.uint64)
-
-    def _unregister_cursor(self, cid):
-        self._lock()
-        if self._actions and '_unregister_cursor()' in self._actions[-1]:
-            self._last_action_count += 1
-            self._actions[-1] = f'_unregister_cursor() +{self._last_action_count}'
-        else:
-            self._last_action_count = 1
-            self._actions.append(f'_unregister_cursor() +{self._last_action_count}')
-        self._wh_cursors.pop(cid)
-        c_time = self._wh_time.pop(cid)
-        self._time_wh.pop(c_time)
-        self._unlock()
+        """`reserve_cursors` with the cid in a list."""
+        res, cid, cursors = self.reserve_cursors(num)
+        return res, [] if res == -1 else [cid], cursors
 
     def unregister_cursor(self, cids):
-        for cid in cids:
-            self._unregister_cursor(cid)
+        """Release the slots of the cid(s) of `reserve_cursors`.
+
+        Args:
+            cids (int or list): A cid or a list of cids
+        """
+        self._lock()
+        self._log_action('unregister_cursor()')
+        self._unlock()
+        self._cursor_block.release(cids)
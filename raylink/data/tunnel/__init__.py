@@ -1,2 +1,8 @@
 from .client import *
 from .server import *
+from .aio import *
+from .codec import *
+from .executor import *
+from .stats import *
+from .lane import *
+from .cache import *
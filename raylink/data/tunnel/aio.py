@@ -0,0 +1,356 @@
+__all__ = ['AsyncTunnelProxy', 'AsyncTunnelStream']
+
+from thrift.Thrift import TType, TMessageType, TApplicationException
+from thrift.transport.TTransport import TMemoryBuffer
+from thrift.protocol import TBinaryProtocol
+from .transport import get_protocol
+from .codec import Codec, REMOTE
+from .executor import TunnelOverloaded
+from .cache import BYPASS
+from .pickler import STREAM_KEY, STREAM_END, STREAM_NEXT, STREAM_CLOSE
+from .rpc.rpc import tunnel
+from raylink.util.util import get_ip
+import asyncio
+import struct
+import raylink
+import sys
+
+_FIXED_SIZE = {TType.BOOL: 1, TType.BYTE: 1, TType.I16: 2, TType.I32: 4,
+               TType.I64: 8, TType.DOUBLE: 8}
+
+
+async def _read_value(reader, ttype, chunks):
+    if ttype in _FIXED_SIZE:
+        chunks.append(await reader.readexactly(_FIXED_SIZE[ttype]))
+    elif ttype == TType.STRING:
+        head = await reader.readexactly(4)
+        chunks.append(head)
+        chunks.append(await reader.readexactly(struct.unpack('!i', head)[0]))
+    elif ttype == TType.STRUCT:
+        while True:
+            head = await reader.readexactly(1)
+            chunks.append(head)
+            if head[0] == TType.STOP:
+                break
+            chunks.append(await reader.readexactly(2))
+            await _read_value(reader, head[0], chunks)
+    elif ttype == TType.MAP:
+        head = await reader.readexactly(6)
+        chunks.append(head)
+        ktype, vtype, size = struct.unpack('!bbi', head)
+        for _ in range(size):
+            await _read_value(reader, ktype, chunks)
+            await _read_value(reader, vtype, chunks)
+    elif ttype in (TType.SET, TType.LIST):
+        head = await reader.readexactly(5)
+        chunks.append(head)
+        etype, size = struct.unpack('!bi', head)
+        for _ in range(size):
+            await _read_value(reader, etype, chunks)
+    else:
+        raise TApplicationException(
+            TApplicationException.PROTOCOL_ERROR, f'Unknown type {ttype}')
+
+
+async def read_message(reader):
+    """Read the raw bytes of one `TBinaryProtocol` message from a stream.
+
+    The binary protocol is not framed, so the message is walked field by
+    field to know where it ends. Decode the bytes with `decode_message`.
+
+    Args:
+        reader (asyncio.StreamReader): Stream of messages
+
+    Returns:
+        bytes: The whole message
+    """
+    chunks = []
+    head = await reader.readexactly(4)
+    chunks.append(head)
+    size = struct.unpack('!i', head)[0]
+    if size < 0:
+        # strict: version and type, name, seqid
+        head = await reader.readexactly(4)
+        chunks.append(head)
+        chunks.append(await reader.readexactly(
+            struct.unpack('!i', head)[0] + 4))
+    else:
+        # name, type, seqid
+        chunks.append(await reader.readexactly(size + 5))
+    await _read_value(reader, TType.STRUCT, chunks)
+    return b''.join(chunks)
+
+
+async def read_frame(reader):
+    """Read the message of one frame sent by `TFramedTransport`."""
+    head = await reader.readexactly(4)
+    return await reader.readexactly(struct.unpack('!i', head)[0])
+
+
+def frame(data):
+    """Prefix a message with its length, like `TFramedTransport`."""
+    return struct.pack('!i', len(data)) + data
+
+
+def encode_message(name, mtype, seqid, obj,
+                   protocol=TBinaryProtocol.TBinaryProtocol):
+    """Encode a thrift struct as a message.
+
+    Args:
+        name (str): Method name
+        mtype (int): `TMessageType`
+        seqid (int): Sequence id
+        obj: Thrift struct, e.g. `task_args`
+        protocol: Class of the thrift protocol
+
+    Returns:
+        bytes: The whole message
+    """
+    trans = TMemoryBuffer()
+    oprot = protocol(trans)
+    oprot.writeMessageBegin(name, mtype, seqid)
+    obj.write(oprot)
+    oprot.writeMessageEnd()
+    return trans.getvalue()
+
+
+def decode_message(data, protocol=TBinaryProtocol.TBinaryProtocol):
+    """Decode the head of a message read by `read_message`.
+
+    Returns:
+        tuple: name, message type, sequence id and the protocol
+            positioned at the message body
+    """
+    iprot = protocol(TMemoryBuffer(data))
+    name, mtype, seqid = iprot.readMessageBegin()
+    return name, mtype, seqid, iprot
+
+
+class AsyncTunnelStream(object):
+    """asyncio version of `TunnelStream`, use it with `async for`."""
+
+    def __init__(self, proxy, func, sid):
+        self._proxy = proxy
+        self.func = func
+        self.sid = sid
+        self._next = None
+        self._done = False
+
+    def _request(self, func):
+        return asyncio.ensure_future(self._proxy._call(
+            'task', func, self._proxy._encode({STREAM_KEY: self.sid})))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        if self._next is None:
+            self._next = self._request(STREAM_NEXT)
+        try:
+            result = self._proxy._decode(await self._next)
+        except Exception as e:
+            self._done = True
+            raise e
+        if STREAM_END in result:
+            self._done = True
+            raise StopAsyncIteration
+        self._next = self._request(STREAM_NEXT)
+        return self._proxy.p.s2c_loads(self.func, result)
+
+    async def close(self):
+        if self._done:
+            return
+        self._done = True
+        if self._next is not None:
+            try:
+                await self._next
+            except Exception:
+                return
+        await self._request(STREAM_CLOSE)
+
+
+class AsyncTunnelProxy(object):
+    """asyncio version of `TunnelProxy`.
+
+    Every method of the node is a coroutine function here, e.g.
+    `await proxy.echo(a)`, and `await proxy.echo_oneway(a)` only sends the
+    call. Calls are multiplexed on one connection by
+    sequence id, so a single event loop can keep thousands of calls
+    outstanding without a thread per call. It speaks the same wire format
+    as `TunnelProxy` and uses the pickler in `TunnelInfo`, so custom
+    picklers such as `WriteHeadPickler` keep working.
+    """
+
+    def __init__(self, tunnel_info, local=True, logger=None, unix=True):
+        self._args = {
+            'tunnel_info': tunnel_info,
+            'local': local,
+            'logger': logger,
+            'unix': unix
+        }
+        self.__dict__.update(self._args)
+        self._is_setup = False
+        self._setup_lock = None
+        self._pending = {}
+        self._seqid = 0
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+        if self.logger is None:
+            self.logger = raylink.get_llogger()
+
+    def __getstate__(self):
+        import copy
+        return copy.deepcopy(self._args)
+
+    async def _setup(self):
+        if self._is_setup:
+            return
+        if self._setup_lock is None:
+            self._setup_lock = asyncio.Lock()
+        async with self._setup_lock:
+            if self._is_setup:
+                return
+            if self.local and get_ip() == self.tunnel_info.ip:
+                host = '127.0.0.1'
+            else:
+                host = self.tunnel_info.ip
+            self.p = self.tunnel_info.pickler
+            self._framed = self.tunnel_info.framed
+            self._protocol = get_protocol(self.tunnel_info.protocol)
+            if not self._framed and self.tunnel_info.protocol != 'binary':
+                raise ValueError('AsyncTunnelProxy reads unframed messages '
+                                 'of the binary protocol only')
+            self.codec = Codec(self.tunnel_info.codec)
+            self._remote = self.codec.enabled and \
+                get_ip() != self.tunnel_info.ip
+            self._reader, self._writer = await self._open(host)
+            self._recv_task = asyncio.ensure_future(self._recv_loop())
+            self._is_setup = True
+            await self._call('incr_client_num')
+
+    async def _open(self, host):
+        path = self.tunnel_info.unix_path
+        if self.unix and host == '127.0.0.1' and path is not None:
+            try:
+                return await asyncio.open_unix_connection(path)
+            except OSError as e:
+                self.logger.debug(f'unix socket unavailable, use tcp: {e}')
+        return await asyncio.open_connection(host, self.tunnel_info.port)
+
+    async def _recv_loop(self):
+        try:
+            while True:
+                if self._framed:
+                    data = await read_frame(self._reader)
+                else:
+                    data = await read_message(self._reader)
+                fname, mtype, rseqid, iprot = decode_message(
+                    data, self._protocol)
+                method, future = self._pending.pop(rseqid)
+                if future.cancelled():
+                    continue
+                if mtype == TMessageType.EXCEPTION:
+                    x = TApplicationException()
+                    x.read(iprot)
+                    if x.type == TunnelOverloaded.OVERLOADED:
+                        x = TunnelOverloaded(x.message)
+                    future.set_exception(x)
+                    continue
+                result = getattr(tunnel, method + '_result')()
+                result.read(iprot)
+                future.set_result(getattr(result, 'success', None))
+        except Exception as e:
+            self._is_setup = False
+            # the socket of the lost connection
+            self._writer.close()
+            pending, self._pending = self._pending, {}
+            for method, future in pending.values():
+                if not future.done():
+                    future.set_exception(
+                        EOFError(f'tunnel connection lost: {e}'))
+
+    def _write(self, method, mtype, seqid, args):
+        data = encode_message(method, mtype, seqid,
+                              getattr(tunnel, method + '_args')(*args),
+                              self._protocol)
+        self._writer.write(frame(data) if self._framed else data)
+
+    async def _call(self, method, *args):
+        self._seqid += 1
+        seqid = self._seqid
+        future = asyncio.get_running_loop().create_future()
+        self._pending[seqid] = method, future
+        self._write(method, TMessageType.CALL, seqid, args)
+        await self._writer.drain()
+        return await future
+
+    async def _send(self, method, *args):
+        self._seqid += 1
+        self._write(method, TMessageType.ONEWAY, self._seqid, args)
+        await self._writer.drain()
+
+    def _encode(self, data):
+        if self._remote:
+            data = self.codec.encode(data)
+            data[REMOTE] = b''
+        return data
+
+    def _decode(self, result):
+        if self._remote:
+            return self.codec.decode(result)
+        return result
+
+    async def submit_task_oneway(self, func, args, kwargs):
+        await self._setup()
+        # no cache here, see `TunnelProxy`
+        kwargs.pop(BYPASS, None)
+        try:
+            _kwargs = self._encode(self.p.c2s_dumps(func, *args, **kwargs))
+            await self._send('task_oneway', func, _kwargs)
+        except Exception as e:
+            print(f'Error while running {func}', file=sys.stderr)
+            raise e
+
+    async def submit_task(self, func, args, kwargs):
+        await self._setup()
+        kwargs.pop(BYPASS, None)
+        try:
+            _kwargs = self._encode(self.p.c2s_dumps(func, *args, **kwargs))
+            result = self._decode(await self._call('task', func, _kwargs))
+            if STREAM_KEY in result:
+                result = AsyncTunnelStream(self, func, result[STREAM_KEY])
+            else:
+                result = self.p.s2c_loads(func, result)
+        except Exception as e:
+            print(f'Error while running {func}', file=sys.stderr)
+            raise e
+        return result
+
+    def __getattr__(self, func):
+        if func.startswith('_'):
+            raise AttributeError(func)
+
+        async def tunnel_aio_api(*args, **kwargs):
+            return await self.submit_task(func, args, kwargs)
+
+        async def tunnel_aio_oneway_api(*args, **kwargs):
+            return await self.submit_task_oneway(func[:-7], args, kwargs)
+
+        if func.endswith('_oneway'):
+            return tunnel_aio_oneway_api
+        return tunnel_aio_api
+
+    async def get_client_num(self):
+        await self._setup()
+        return await self._call('get_client_num')
+
+    async def close(self):
+        if not self._is_setup:
+            return
+        await self._call('decr_client_num')
+        self._is_setup = False
+        self._recv_task.cancel()
+        self._writer.close()
@@ -0,0 +1,197 @@
+"""Micro-benchmark of tunnel calls.
+
+Echo calls of a `{'x': uint8 array}` payload are sent to a `TunnelServer`
+of an in-process node, sweeping payload sizes, concurrency, transports,
+sync or `_async` calls and picklers. Every configuration is reported as
+one JSON line, e.g.
+
+    python -m raylink.data.tunnel.benchmark --sizes 1000 1000000 \
+        --concurrency 1 8 --output tunnel.jsonl
+
+Transports are 'shm', 'unix' and 'tcp' on the loopback interface, and
+picklers are 'default' (`Pickler`) and 'array' (`ArrayDictPickler`).
+"""
+__all__ = ['run_benchmark']
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Semaphore, Lock
+import numpy as np
+import argparse
+import logging
+import json
+import time
+import sys
+
+from .client import TunnelProxy
+from .pickler import ArrayDictPickler, array_dict
+from .server import TunnelServer
+from .stats import Histogram
+
+SIZES = (100, 10000, 1000000)
+CONCURRENCY = (1, 8)
+TRANSPORTS = ('shm', 'unix', 'tcp')
+MODES = ('sync', 'async')
+PICKLERS = ('default', 'array')
+
+_logger = logging.getLogger(__name__)
+
+
+class BenchNode(object):
+    _logger = _logger
+    _llogger = _logger
+
+    @array_dict('data', returns=True)
+    def echo(self, data):
+        return data
+
+    def ip_(self):
+        return '127.0.0.1'
+
+
+_PICKLERS = {'default': None, 'array': ArrayDictPickler.of(BenchNode)}
+
+
+def _start_server(pickler, **kwargs):
+    server = TunnelServer(BenchNode(), _PICKLERS[pickler], **kwargs)
+    server.start()
+    # wait for server, usually unlocked by `OutlineNode._setup_tunnel`
+    time.sleep(0.1)
+    server._unlock()
+    return server
+
+
+def _proxy(server, transport):
+    return TunnelProxy(server.get_tunnel(), local=True, logger=_logger,
+                       shm=transport == 'shm',
+                       unix=transport in ('shm', 'unix'))
+
+
+def _run_sync(proxy, payload, calls, concurrency, hist, lock):
+    def run(n):
+        for _ in range(n):
+            st = time.perf_counter_ns()
+            proxy.echo(payload)
+            rt = (time.perf_counter_ns() - st) // 1000
+            with lock:
+                hist.record(rt)
+
+    counts = [calls // concurrency + (i < calls % concurrency)
+              for i in range(concurrency)]
+    with ThreadPoolExecutor(concurrency) as pool:
+        [f.result() for f in [pool.submit(run, n) for n in counts]]
+
+
+def _run_async(proxy, payload, calls, concurrency, hist, lock):
+    """Keep `concurrency` calls outstanding from a single thread."""
+    window = Semaphore(concurrency)
+    errors = []
+
+    def done(st, f):
+        rt = (time.perf_counter_ns() - st) // 1000
+        with lock:
+            hist.record(rt)
+            if f.exception() is not None:
+                errors.append(f.exception())
+        window.release()
+
+    for _ in range(calls):
+        window.acquire()
+        st = time.perf_counter_ns()
+        proxy.echo_async(payload).add_done_callback(
+            lambda f, st=st: done(st, f))
+    for _ in range(concurrency):
+        window.acquire()
+    if errors:
+        raise errors[0]
+
+
+def bench(proxy, size, concurrency, mode, calls, warmup=10):
+    """Measure `calls` echo calls of `size` bytes.
+
+    Returns:
+        dict: Latency percentiles (us), calls/s and MB/s of the payload,
+            counting both the request and the response
+    """
+    payload = {'x': np.zeros(size, np.uint8)}
+    run = _run_sync if mode == 'sync' else _run_async
+    run(proxy, payload, warmup, 1, Histogram(), Lock())
+    hist = Histogram()
+    st = time.perf_counter()
+    run(proxy, payload, calls, concurrency, hist, Lock())
+    elapsed = time.perf_counter() - st
+    return {
+        'p50_us': hist.percentile(50),
+        'p99_us': hist.percentile(99),
+        'mean_us': hist.snapshot()['mean'],
+        'calls_per_s': calls / elapsed,
+        'mb_per_s': 2 * size * calls / elapsed / 1e6,
+    }
+
+
+def run_benchmark(sizes=SIZES, concurrency=CONCURRENCY, transports=TRANSPORTS,
+                  modes=MODES, picklers=PICKLERS, calls=200, max_bytes=1 << 30,
+                  server_kwargs=None):
+    """Run every combination of the given parameters.
+
+    Args:
+        sizes (list): Payload sizes in bytes
+        concurrency (list): Numbers of calls in flight
+        transports (list): 'shm', 'unix' or 'tcp'
+        modes (list): 'sync' calls from threads or 'async' calls
+        picklers (list): 'default' or 'array'
+        calls (int): Calls per configuration, fewer for large payloads so
+            at most `max_bytes` are sent
+        max_bytes (int): Max payload bytes per configuration
+        server_kwargs (dict): Extra arguments of `TunnelServer`
+
+    Yields:
+        dict: Parameters and results of a configuration
+    """
+    for pickler in picklers:
+        server = _start_server(pickler, **(server_kwargs or {}))
+        for transport in transports:
+            proxy = _proxy(server, transport)
+            for size in sizes:
+                n = max(1, min(calls, max_bytes // max(size, 1)))
+                for mode in modes:
+                    for c in concurrency:
+                        result = {'pickler': pickler, 'transport': transport,
+                                  'size': size, 'mode': mode,
+                                  'concurrency': c, 'calls': n}
+                        result.update(bench(proxy, size, c, mode, n))
+                        yield result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=CONCURRENCY)
+    parser.add_argument('--transports', nargs='+', default=TRANSPORTS,
+                        choices=TRANSPORTS)
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--picklers', nargs='+', default=PICKLERS,
+                        choices=PICKLERS)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--mode', dest='server_mode', default='threaded',
+                        choices=TunnelServer.MODES,
+                        help='serving mode of the tunnel server')
+    parser.add_argument('--framed', action='store_true')
+    parser.add_argument('--output', help='JSON lines file, stdout if None')
+    args = parser.parse_args(argv)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for result in run_benchmark(
+                args.sizes, args.concurrency, args.transports, args.modes,
+                args.picklers, args.calls,
+                server_kwargs={'mode': args.server_mode,
+                               'framed': args.framed}):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+__all__ = ['TunnelCache']
+
+from collections import OrderedDict
+from threading import Lock
+import marshal
+import pickle
+import time
+
+# response entry of the versions of a node, see `TunnelCache`
+VERSIONS = b'~versions'
+# call keyword skipping the cache
+BYPASS = '_bypass_cache'
+
+
+def dump_versions(versions):
+    return marshal.dumps(versions)
+
+
+def load_versions(data):
+    return marshal.loads(data)
+
+
+class TunnelCache(object):
+    """Client-side cache of the results of idempotent tunnel methods.
+
+    `spec` maps method names to a dict of `ttl`, the seconds a result
+    stays valid (None for no expiry), and `version`, a version key of the
+    node. Tunnel servers piggyback the versions of their node on every
+    response, see `OutlineNode.bump_tunnel_version`, and a cached result
+    is dropped once a newer version of its key is seen. As versions only
+    come with responses, a result with a `version` is only used within
+    `check` seconds (`DEFAULT_CHECK` by default) of the last response,
+    after that it is fetched again, which brings the versions up to date.
+    Results are keyed by the pickled arguments and at most `max_size` are
+    kept. A cached result is returned as is, so callers should not modify
+    it.
+
+    Args:
+        spec (dict): Method name to its `ttl`, `version` and `check`
+        max_size (int): Max number of cached results
+    """
+    DEFAULT_MAX_SIZE = 1024
+    DEFAULT_CHECK = 1.
+
+    def __init__(self, spec, max_size=DEFAULT_MAX_SIZE):
+        self.spec = dict(spec or {})
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.versions = {}
+        # when the versions were last received
+        self._checked = None
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, func):
+        return func in self.spec
+
+    @staticmethod
+    def _key(func, args, kwargs):
+        return func, pickle.dumps((args, sorted(kwargs.items())))
+
+    def get(self, func, args, kwargs):
+        """Look up a result.
+
+        Returns:
+            tuple: Whether it is found, and the result
+        """
+        key = self._key(func, args, kwargs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, expiry, version = entry
+                spec = self.spec[func]
+                vkey = spec.get('version')
+                now = time.monotonic()
+                if (expiry is None or now < expiry) and \
+                        (vkey is None or
+                         self.versions.get(vkey) == version and
+                         self._checked is not None and
+                         now - self._checked <
+                         spec.get('check', self.DEFAULT_CHECK)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, result
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, func, args, kwargs, result):
+        spec = self.spec[func]
+        ttl = spec.get('ttl')
+        expiry = None if ttl is None else time.monotonic() + ttl
+        key = self._key(func, args, kwargs)
+        with self._lock:
+            self._entries[key] = \
+                result, expiry, self.versions.get(spec.get('version'))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def update(self, versions):
+        """Keep the latest versions piggybacked on a response, empty if
+        the node has none."""
+        with self._lock:
+            self._checked = time.monotonic()
+            for k, v in versions.items():
+                # responses of pipelined calls may come out of order
+                if v > self.versions.get(k, v - 1):
+                    self.versions[k] = v
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries)}
@@ -1,34 +1,611 @@
-__all__ = ['TunnelProxy']
+__all__ = ['TunnelProxy', 'TunnelBatch', 'TunnelCoalescer', 'TunnelStream',
+           'TunnelRegistry']
 
 from raylink.util.task import ThreadPoolExecutorWithLimit as ThreadPoolExecutor
+from thrift.Thrift import TMessageType, TApplicationException
 from thrift.protocol import TBinaryProtocol
-from .transport import TBufferedTransport
+from .transport import get_transport, get_protocol
 from thrift.transport import TSocket
-from .rpc.rpc.tunnel import Client
+from concurrent.futures import Future
+from .pickler import BATCH_FUNC, batch_pack, batch_unpack, \
+    STREAM_KEY, STREAM_END, STREAM_NEXT, STREAM_CLOSE
+from .codec import Codec, REMOTE
+from .executor import TunnelOverloaded
+from .cache import TunnelCache, VERSIONS, BYPASS, load_versions
+from .rpc.rpc import tunnel
 from raylink.util.util import get_ip
-from threading import Lock
+from threading import Thread, Lock, Condition
+from collections import deque
+from weakref import WeakSet
 import raylink
 import uuid
 import time
 import sys
+import os
+
+
+class TunnelConnection(object):
+    """A single connection to a tunnel server.
+
+    Every call is tagged with its own sequence id, so many calls can be
+    in flight on the same socket. A reader thread receives the responses
+    and matches them to the waiting futures in any order.
+    """
+
+    def __init__(self, transport, logger=None,
+                 protocol=TBinaryProtocol.TBinaryProtocol):
+        self.transport = transport
+        self.protocol = protocol(transport)
+        self.logger = logger
+        self._send_lock = Lock()
+        self._pending = {}
+        self._seqid = 0
+        self._closed = False
+        self._reader = None
+
+    def open(self):
+        self.transport.open()
+        self._reader = Thread(target=self._recv_loop, daemon=True)
+        self._reader.start()
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def _write(self, method, mtype, seqid, args):
+        oprot = self.protocol
+        oprot.writeMessageBegin(method, mtype, seqid)
+        getattr(tunnel, method + '_args')(*args).write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+
+    def submit(self, method, *args):
+        """Send a call of the thrift `method` without waiting.
+
+        Args:
+            method (str): Name of the thrift method, e.g. 'task'
+            *args: Arguments of the thrift method
+
+        Returns:
+            concurrent.futures.Future: Future of the method result
+        """
+        future = Future()
+        with self._send_lock:
+            if self._closed:
+                raise EOFError('tunnel connection is closed')
+            self._seqid += 1
+            seqid = self._seqid
+            self._pending[seqid] = method, future
+            try:
+                self._write(method, TMessageType.CALL, seqid, args)
+            except Exception as e:
+                self._pending.pop(seqid, None)
+                raise e
+        return future
+
+    def send(self, method, *args):
+        """Send a call of the oneway thrift `method`, no response comes back.
+
+        Args:
+            method (str): Name of the thrift method, e.g. 'task_oneway'
+            *args: Arguments of the thrift method
+        """
+        with self._send_lock:
+            if self._closed:
+                raise EOFError('tunnel connection is closed')
+            self._seqid += 1
+            self._write(method, TMessageType.ONEWAY, self._seqid, args)
+
+    def call(self, method, *args):
+        return self.submit(method, *args).result()
+
+    def _recv_loop(self):
+        iprot = self.protocol
+        try:
+            while True:
+                (fname, mtype, rseqid) = iprot.readMessageBegin()
+                method, future = self._pending.pop(rseqid)
+                if mtype == TMessageType.EXCEPTION:
+                    x = TApplicationException()
+                    x.read(iprot)
+                    iprot.readMessageEnd()
+                    if x.type == TunnelOverloaded.OVERLOADED:
+                        x = TunnelOverloaded(x.message)
+                    future.set_exception(x)
+                else:
+                    result = getattr(tunnel, method + '_result')()
+                    result.read(iprot)
+                    iprot.readMessageEnd()
+                    future.set_result(getattr(result, 'success', None))
+                # don't keep the callbacks, and their proxy, alive while
+                # waiting for the next response
+                future = result = x = None
+        except Exception as e:
+            self._fail_pending(e)
+
+    def _fail_pending(self, e):
+        with self._send_lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        if pending and self.logger is not None:
+            self.logger.debug(f'tunnel connection lost with '
+                              f'{len(pending)} pending calls: {e}')
+        try:
+            # the socket or shm channel of the lost connection
+            self.transport.close()
+        except Exception:
+            pass
+        for method, future in pending.values():
+            future.set_exception(EOFError(f'tunnel connection lost: {e}'))
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        with self._send_lock:
+            self._closed = True
+        self.transport.close()
+
+
+class TunnelConnectionPool(object):
+    """Connections of one proxy to the same tunnel server.
+
+    Connections are opened lazily. `get` returns the least busy connection,
+    and opens a new one while every connection has calls in flight and
+    the pool has less than `max_size` connections. Connections are opened
+    outside the lock, so the other callers keep using the open ones
+    meanwhile.
+    """
+
+    def __init__(self, connect, max_size=4):
+        self._connect = connect
+        self.max_size = max(1, max_size)
+        self.conns = []
+        self._connecting = 0
+        self._cond = Condition()
+
+    def get(self):
+        with self._cond:
+            while True:
+                self.conns = [c for c in self.conns if not c.closed]
+                conn = min(self.conns, key=lambda c: c.in_flight, default=None)
+                full = len(self.conns) + self._connecting >= self.max_size
+                if conn is not None and (conn.in_flight == 0 or full):
+                    return conn
+                if conn is None and full:
+                    # wait for the connections being opened
+                    self._cond.wait()
+                    continue
+                self._connecting += 1
+                break
+        try:
+            new = self._connect()
+        except Exception as e:
+            with self._cond:
+                self._connecting -= 1
+                self._cond.notify_all()
+            # a busy connection is better than none
+            if conn is not None and not conn.closed:
+                return conn
+            raise e
+        with self._cond:
+            self._connecting -= 1
+            self.conns.append(new)
+            self._cond.notify_all()
+        return new
+
+    def __len__(self):
+        return len(self.conns)
+
+    def close(self):
+        """Close the connections without waiting for the server."""
+        with self._cond:
+            conns, self.conns = self.conns, []
+        for conn in conns:
+            if conn.closed:
+                continue
+            try:
+                future = conn.submit('decr_client_num')
+            except Exception:
+                conn.close()
+                continue
+            # closed by its reader thread once the server counted it out
+            future.add_done_callback(lambda f, conn=conn: conn.close())
+
+
+class TunnelBatch(object):
+    """Calls recorded by `TunnelProxy.batch`.
+
+    `batch.func(*args, **kwargs)` records a call and returns a future of
+    its result, which is set once the batch is sent at the end of the
+    `with` block.
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self.calls = []
+        self.futures = []
+
+    def __getattr__(self, func):
+        if func.startswith('_'):
+            raise AttributeError(func)
+
+        def record(*args, **kwargs):
+            future = Future()
+            self.calls.append((func, args, kwargs))
+            self.futures.append(future)
+            return future
+
+        return record
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None or not self.calls:
+            return
+        try:
+            results = self._proxy.call_many(self.calls)
+        except Exception as e:
+            for future in self.futures:
+                future.set_exception(e)
+            raise e
+        for future, result in zip(self.futures, results):
+            future.set_result(result)
+
+
+def _nbytes(obj):
+    """Rough size of the arguments of a call."""
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    if isinstance(obj, (list, tuple)):
+        return sum(map(_nbytes, obj))
+    if isinstance(obj, dict):
+        return sum(map(_nbytes, obj.values()))
+    return getattr(obj, 'nbytes', 8)
+
+
+def _snapshot(obj):
+    """Copy the buffers of the arguments of a call, e.g. numpy arrays the
+    caller may overwrite before they are sent."""
+    if isinstance(obj, bytearray):
+        return bytearray(obj)
+    if isinstance(obj, list):
+        return list(map(_snapshot, obj))
+    if isinstance(obj, tuple):
+        return tuple(map(_snapshot, obj))
+    if isinstance(obj, dict):
+        return {k: _snapshot(v) for k, v in obj.items()}
+    if hasattr(obj, 'nbytes') and hasattr(obj, 'copy'):
+        return obj.copy()
+    return obj
+
+
+class TunnelCoalescer(object):
+    """Buffer fire-and-forget calls of a proxy and send them in batches.
+
+    `coalescer.func(*args, **kwargs)` only buffers the call, with a copy of
+    its arrays. The buffered calls are merged by `Pickler.coalesce` and
+    sent as one batch when `max_calls` calls or `max_bytes` bytes of
+    arguments are buffered, when the oldest call has waited `max_delay`
+    seconds, or on `flush`. At most `max_batches` batches are in flight, a
+    call sending a batch beyond that blocks until the oldest batch is
+    done, which keeps a fast producer from piling up calls. Results are
+    discarded. An error of a batch is logged and raised by the next call
+    or `flush`.
+
+    With the default `max_batches=1` the calls run in order. Batches in
+    flight run concurrently on the server, use a larger `max_batches`
+    only if the order of the calls doesn't matter.
+    The timer thread of `max_delay` stops after `TIMER_IDLE` seconds
+    without calls, or on `close`.
+    """
+    TIMER_IDLE = 1.
+
+    def __init__(self, proxy, max_calls=64, max_bytes=1 << 20,
+                 max_delay=0.01, max_batches=1):
+        self._proxy = proxy
+        self.max_calls = max_calls
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.max_batches = max(1, max_batches)
+        self._calls = []
+        self._nbytes = 0
+        self._first = None
+        # batches taken from `_calls`, sent in order under `_send_lock`
+        self._outbox = deque()
+        self._in_flight = deque()
+        self._error = None
+        self._cond = Condition()
+        self._send_lock = Lock()
+        self._closed = False
+        self._timer = None
+        self._timer_idle = False
+
+    def __getattr__(self, func):
+        if func.startswith('_'):
+            raise AttributeError(func)
+
+        def coalesced(*args, **kwargs):
+            self.call(func, args, kwargs)
+
+        return coalesced
+
+    def call(self, func, args, kwargs):
+        """Buffer a call, may send the buffered calls."""
+        args, kwargs = _snapshot(args), _snapshot(kwargs)
+        with self._cond:
+            self._raise_error()
+            if self._closed:
+                raise EOFError('tunnel coalescer is closed')
+            if self._first is None:
+                self._first = time.time()
+                self._start_timer()
+            self._calls.append((func, args, kwargs))
+            self._nbytes += _nbytes(args) + _nbytes(kwargs)
+            if len(self._calls) < self.max_calls and \
+                    self._nbytes < self.max_bytes:
+                return
+            self._take()
+        self._send()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def _raise_error(self):
+        if self._error is not None:
+            e, self._error = self._error, None
+            raise e
+
+    def _start_timer(self):
+        if self._timer is None:
+            self._timer = Thread(target=self._timer_loop, daemon=True)
+            self._timer.start()
+        elif self._timer_idle:
+            self._cond.notify_all()
+
+    def _timer_loop(self):
+        with self._cond:
+            while not self._closed:
+                if self._first is None:
+                    self._timer_idle = True
+                    self._cond.wait(self.TIMER_IDLE)
+                    self._timer_idle = False
+                    if self._first is None:
+                        break
+                    continue
+                delay = self._first + self.max_delay - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                self._take()
+                self._cond.release()
+                try:
+                    self._send()
+                finally:
+                    self._cond.acquire()
+            self._timer = None
+
+    def _take(self):
+        # called with `_cond` held, so the batches are taken in call order
+        calls, self._calls = self._calls, []
+        self._nbytes = 0
+        self._first = None
+        if calls:
+            self._outbox.append(calls)
+
+    def _send(self):
+        # waits for batches in flight without holding `_cond`, so other
+        # callers keep buffering calls meanwhile
+        with self._send_lock:
+            while True:
+                with self._cond:
+                    if not self._outbox:
+                        return
+                    calls = self._outbox.popleft()
+                while len(self._in_flight) >= self.max_batches:
+                    self._wait(self._in_flight.popleft())
+                proxy = self._proxy
+                proxy._setup()
+                try:
+                    f = proxy._conns.get().submit(
+                        'task', BATCH_FUNC,
+                        proxy._batch_dumps(proxy.p.coalesce(calls)))
+                except Exception as e:
+                    self._fail(e)
+                    continue
+                self._in_flight.append(f)
+
+    def _wait(self, f):
+        try:
+            f.result()
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, e):
+        self._proxy.logger.error(f'Error while running coalesced calls: {e}')
+        with self._cond:
+            self._error = e
+
+    def flush(self):
+        """Send the buffered calls and wait for every batch in flight."""
+        with self._cond:
+            self._take()
+        self._send()
+        with self._send_lock:
+            while self._in_flight:
+                self._wait(self._in_flight.popleft())
+        with self._cond:
+            self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+
+
+class TunnelStream(object):
+    """Iterator over the chunks yielded by a generator method of a node.
+
+    The server keeps the generator and the chunks are pulled one by one,
+    each pickled on its own by the pickler of the method. The request of
+    the next chunk is sent as soon as a chunk is returned, so the server
+    produces it while the caller consumes the current one. `close` (or
+    dropping the iterator) closes the generator on the server without
+    waiting for it, and the server closes streams idle for
+    `Handler.STREAM_TTL` seconds, e.g. of a client gone.
+    """
+
+    def __init__(self, proxy, func, sid):
+        self._proxy = proxy
+        self.func = func
+        self.sid = sid
+        self._next = None
+        self._done = False
+
+    def _request(self, func):
+        return self._proxy._conns.get().submit(
+            'task', func, self._proxy._encode({STREAM_KEY: self.sid}))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        if self._next is None:
+            self._next = self._request(STREAM_NEXT)
+        try:
+            result = self._proxy._decode(self._next.result())
+        except Exception as e:
+            self._done = True
+            raise e
+        if STREAM_END in result:
+            self._done = True
+            raise StopIteration
+        self._next = self._request(STREAM_NEXT)
+        return self._proxy.p.s2c_loads(self.func, result)
+
+    def close(self):
+        if self._done:
+            return
+        self._done = True
+        # the server closes the generator after the prefetched chunk
+        self._proxy._conns.get().send(
+            'task_oneway', STREAM_CLOSE,
+            self._proxy._encode({STREAM_KEY: self.sid}))
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class _SharedTunnel(object):
+    """Connections, executor and cache shared by the proxies of a key."""
+
+    def __init__(self, pool_size, cache):
+        self.refs = 0
+        self.proxies = WeakSet()
+        self.conns = TunnelConnectionPool(self._connect, pool_size)
+        self.pool = ThreadPoolExecutor(max_workers=5)
+        self.cache = TunnelCache(cache)
+
+    def _connect(self):
+        # the proxies of a key connect the same way, any of them will do
+        return next(iter(self.proxies))._try_connect()
+
+    def close(self):
+        self.conns.close()
+        self.pool.shutdown(wait=False)
+
+
+class TunnelRegistry(object):
+    """Per-process registry of the connections of tunnel proxies.
+
+    Proxies of the same tunnel, keyed by `(ip, port, tag)` and the options
+    changing how they connect, share one connection pool, one executor
+    and one result cache, so looking up the same node many times (e.g.
+    unpickling its proxy) does not open more sockets and threads. The
+    shared entry is reference counted and closed with its last proxy.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = Lock()
+
+    def acquire(self, key, proxy):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _SharedTunnel(proxy.pool_size, proxy.tunnel_info.cache)
+                self._entries[key] = entry
+            entry.refs += 1
+            entry.proxies.add(proxy)
+            return entry
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            del self._entries[key]
+        entry.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def refs(self, key):
+        entry = self._entries.get(key)
+        return 0 if entry is None else entry.refs
 
 
 class TunnelProxy(object):
-    def __init__(self, tunnel_info, local=True, debug=False, logger=None):
+    """Proxy of the tunnel of a node, calling its methods by name.
+
+    Local servers are reached through their unix socket with `unix` on,
+    and through shared memory channels with `shm` on, which take 8MB of
+    shared memory per connection. With `shared` on, the proxy uses the
+    connections, executor and cache of the other proxies of the same
+    tunnel in this process, see `TunnelRegistry`.
+    """
+    registry = TunnelRegistry()
+    CONNECT_RETRIES = 10
+    RETRY_DELAY = 0.1
+
+    def __init__(self, tunnel_info, local=True, debug=False, logger=None,
+                 pool_size=4, shm=False, unix=True, shared=True):
         self._args = {
             'tunnel_info': tunnel_info,
             'local': local,
             'debug': debug,
-            'logger': logger
+            'logger': logger,
+            'pool_size': pool_size,
+            'shm': shm,
+            'unix': unix,
+            'shared': shared
         }
         self.__dict__.update(self._args)
         self._is_setup = False
+        self._key = None
         self.uid = ''
-        self.lock = None
         self.setup_lock = Lock()
 
     def __setstate__(self, state):
         self.__dict__.update(state)
+        self._args = {k: v for k, v in state.items() if k != '_is_setup'}
+        self._key = None
         self.setup_lock = Lock()
         if self.logger is None:
             self.logger = raylink.get_llogger()
@@ -49,80 +626,304 @@ class TunnelProxy(object):
             return
         self.logger.debug(f'setup {id(self)}')
         self._is_setup = True
-        self.lock = Lock()
         if self.local and get_ip() == self.tunnel_info.ip:
             self.host = '127.0.0.1'
         else:
             self.host = self.tunnel_info.ip
         self.port = self.tunnel_info.port
+        if self.unix and self.host == '127.0.0.1':
+            self.unix_path = self.tunnel_info.unix_path
+        else:
+            self.unix_path = None
         self.p = self.tunnel_info.pickler
-        self._try_connect()
-        self._pool = ThreadPoolExecutor(max_workers=5)
+        self._transport = get_transport(self.tunnel_info.framed)
+        self._protocol = get_protocol(self.tunnel_info.protocol)
+        # compress only between hosts, see `Codec`
+        self.codec = Codec(self.tunnel_info.codec)
+        self._remote = self.codec.enabled and get_ip() != self.tunnel_info.ip
+        if self._key is not None:
+            self.registry.release(self._key)
+        info = self.tunnel_info
+        self._key = (info.ip, info.port, info.tag, self.host, self.unix_path,
+                     self.shm, self.pool_size,
+                     None if self.shared else uuid.uuid4())
+        shared = self.registry.acquire(self._key, self)
+        self._conns, self._pool, self.cache = \
+            shared.conns, shared.pool, shared.cache
         self.uid = uuid.uuid4()
         self.logger.debug(f'setup {id(self)} end')
         self.setup_lock.release()
 
     def _try_connect(self):
-        flag = False
-        while not flag:
+        """Connect, retrying `CONNECT_RETRIES` times with a growing delay,
+        e.g. while the server is starting."""
+        for i in range(self.CONNECT_RETRIES + 1):
             try:
-                self._connect_to_server()
-                flag = True
+                return self._connect_to_server()
             except Exception as e:
-                import traceback
-                traceback.print_exc()
-                print('retry...')
+                if i == self.CONNECT_RETRIES:
+                    raise e
+                delay = min(self.RETRY_DELAY * 2 ** i, 2.)
+                self.logger.warning(
+                    f'Unable to connect to {self.host}:{self.port}, '
+                    f'retry in {delay:.1f}s: {e}')
+                time.sleep(delay)
 
     def _connect_to_server(self):
-        tsocket = TSocket.TSocket(self.host, self.port)
-        transport = TBufferedTransport(tsocket)
-        protocol = TBinaryProtocol.TBinaryProtocol(transport)
-        self._client = Client(protocol)
-        self.transport = transport
-        self.transport.open()
-        self._client.incr_client_num()
+        conn = None
+        if self.shm and self.host == '127.0.0.1':
+            conn = self._connect_shm()
+        if conn is None:
+            conn = self._connect_socket()
+        conn.call('incr_client_num')
+        return conn
+
+    def _connect_socket(self):
+        """Connect through the unix socket of a local server if it has one,
+        which skips the TCP stack, otherwise through TCP.
+        """
+        if self.unix_path is not None:
+            try:
+                return self._open(TSocket.TSocket(unix_socket=self.unix_path))
+            except Exception as e:
+                self.logger.debug(f'unix socket unavailable, use tcp: {e}')
+        return self._open(TSocket.TSocket(self.host, self.port))
+
+    def _open(self, tsocket):
+        conn = TunnelConnection(self._transport(tsocket), self.logger,
+                                self._protocol)
+        conn.open()
+        return conn
+
+    def _connect_shm(self):
+        """Connect through a shared memory channel if the server is local.
+
+        The channel is announced to the server on a socket connection, which
+        is closed afterwards. Return None to fall back to the socket.
+        """
+        from .shm_transport import ShmChannel, TShmTransport
+        channel = None
+        ctrl = self._connect_socket()
+        try:
+            channel = ShmChannel()
+            if not ctrl.call('open_shm', channel.name, os.getpid()):
+                raise EOFError('not served by the server')
+        except Exception as e:
+            self.logger.debug(f'shm channel unavailable, use socket: {e}')
+            if channel is not None:
+                channel.close()
+            return
+        finally:
+            ctrl.close()
+        conn = TunnelConnection(self._transport(TShmTransport(channel)),
+                                self.logger, self._protocol)
+        conn.open()
+        return conn
 
     def _submit_task(self, func, args, kwargs):
         st = time.time()
-        _kwargs = self.p.c2s_dumps(func, *args, **kwargs)
-        self.lock.acquire()
-        result = self._client.task(func, _kwargs)
-        self.lock.release()
-        result = self.p.s2c_loads(func, result)
+        _kwargs = self._dumps(func, args, kwargs)
+        result = self._conns.get().call('task', func, _kwargs)
+        result = self._loads(func, result)
         self.logger.debug(f'{func} takes {time.time() - st}')
         return result
 
+    def _lookup(self, func, args, kwargs):
+        """Look up the cached result of an idempotent method, see
+        `TunnelCache`. `_bypass_cache=True` skips the lookup, the result
+        is still cached.
+        """
+        if kwargs.pop(BYPASS, False) or func not in self.cache:
+            return False, None
+        return self.cache.get(func, args, kwargs)
+
+    def _store(self, func, args, kwargs, result):
+        if func in self.cache and not isinstance(result, TunnelStream):
+            self.cache.put(func, args, kwargs, result)
+
     def submit_task(self, func, args, kwargs):
+        hit, result = self._lookup(func, args, kwargs)
+        if hit:
+            return result
         try:
             result = self._submit_task(func, args, kwargs)
-            return result
         except Exception as e:
             print(f'Error while running {func}', file=sys.stderr)
             raise e
+        self._store(func, args, kwargs, result)
+        return result
+
+    def _send_task(self, func, args, kwargs, future):
+        try:
+            _kwargs = self._dumps(func, args, kwargs)
+            f = self._conns.get().submit('task', func, _kwargs)
+        except Exception as e:
+            print(f'Error while running {func}', file=sys.stderr)
+            future.set_exception(e)
+            return
+
+        def done(f):
+            try:
+                result = self._loads(func, f.result())
+                self._store(func, args, kwargs, result)
+                future.set_result(result)
+            except Exception as e:
+                print(f'Error while running {func}', file=sys.stderr)
+                future.set_exception(e)
+
+        f.add_done_callback(done)
+
+    def submit_task_oneway(self, func, args, kwargs):
+        """Send a task without a response.
+
+        Returns as soon as the call is written. Errors on the server are
+        written to the node log instead of being raised here.
+        """
+        kwargs.pop(BYPASS, None)
+        try:
+            _kwargs = self._dumps(func, args, kwargs)
+            self._conns.get().send('task_oneway', func, _kwargs)
+        except Exception as e:
+            print(f'Error while running {func}', file=sys.stderr)
+            raise e
+
+    def submit_task_async(self, func, args, kwargs):
+        """Submit a task without waiting for the response.
+
+        The pool thread only pickles and sends the call, it does not
+        wait for the response, so many calls can be in flight at a time.
+
+        Returns:
+            concurrent.futures.Future: Future of the unpickled result
+        """
+        future = Future()
+        hit, result = self._lookup(func, args, kwargs)
+        if hit:
+            future.set_result(result)
+            return future
+        self._pool.submit(self._send_task, func, args, kwargs, future)
+        return future
+
+    def _encode(self, data):
+        if self._remote:
+            data = self.codec.encode(data)
+            data[REMOTE] = b''
+        return data
+
+    def _decode(self, result):
+        if self._remote:
+            return self.codec.decode(result)
+        return result
+
+    def _dumps(self, func, args, kwargs):
+        return self._encode(self.p.c2s_dumps(func, *args, **kwargs))
+
+    def _loads(self, func, result):
+        result = self._decode(result)
+        versions = result.pop(VERSIONS, None)
+        if self.cache.spec:
+            self.cache.update(
+                {} if versions is None else load_versions(versions))
+        return self._load(func, result)
+
+    def _load(self, func, data):
+        if STREAM_KEY in data:
+            return TunnelStream(self, func, data[STREAM_KEY])
+        return self.p.s2c_loads(func, data)
+
+    def _batch_dumps(self, calls):
+        funcs = [func for func, _, _ in calls]
+        # batches are never cached
+        items = [self.p.c2s_dumps(func, *args, **{
+                     k: v for k, v in kwargs.items() if k != BYPASS})
+                 for func, args, kwargs in calls]
+        return self._encode(batch_pack(funcs, items))
+
+    def _batch_loads(self, result):
+        funcs, items = batch_unpack(self._decode(result))
+        return [self._load(func, item) for func, item in zip(funcs, items)]
+
+    def call_many(self, calls):
+        """Run many calls in one round trip.
+
+        The calls are packed into a single `task` frame and run by the
+        server in order. The batch stops at the first error, which is
+        raised here.
+
+        Args:
+            calls (list): Tuples of (func, args, kwargs)
+
+        Returns:
+            list: Results of the calls
+        """
+        self._setup()
+        if not calls:
+            return []
+        try:
+            st = time.time()
+            result = self._conns.get().call(
+                'task', BATCH_FUNC, self._batch_dumps(calls))
+            result = self._batch_loads(result)
+            self.logger.debug(f'batch of {len(calls)} takes {time.time() - st}')
+            return result
+        except Exception as e:
+            print(f'Error while running a batch of {len(calls)}',
+                  file=sys.stderr)
+            raise e
+
+    def call_many_async(self, calls):
+        """Asynchronous `call_many`.
+
+        Returns:
+            concurrent.futures.Future: Future of the list of results
+        """
+        self._setup()
+        return self._pool.submit(self.call_many, calls)
+
+    def batch(self):
+        """Record calls and send them as one batch at the end of the block,
+        e.g.
+
+            with proxy.batch() as batch:
+                futures = [batch.put(s) for s in samples]
+
+        Returns:
+            TunnelBatch: Recorder of the calls
+        """
+        return TunnelBatch(self)
+
+    def coalesce(self, **kwargs):
+        """Create a `TunnelCoalescer` of this proxy for fire-and-forget
+        calls, e.g. `proxy.coalesce().put(sample)`.
+
+        Args:
+            **kwargs: Thresholds of `TunnelCoalescer`
+
+        Returns:
+            TunnelCoalescer: The coalescer
+        """
+        return TunnelCoalescer(self, **kwargs)
 
     def _submit_task_d(self, func, args, kwargs):
         self.logger.debug(f'enter {func}')
         import time
         st = time.time()
-        _kwargs = self.p.c2s_dumps(func, *args, **kwargs)
+        _kwargs = self._dumps(func, args, kwargs)
         rt = time.time() - st
         self.logger.debug(f'{func} c2s_dumps end in {rt}')
-        self.logger.debug(f'acquire {id(self.lock)}')
-        self.lock.acquire()
         st = time.time()
-        result = self._client.task(func, _kwargs)
+        result = self._conns.get().call('task', func, _kwargs)
         rt = time.time() - st
-        self.logger.debug(f'release {id(self.lock)}')
-        self.lock.release()
         self.logger.debug(f'{func} client end in {rt}, {args} {kwargs}')
         st = time.time()
-        result = self.p.s2c_loads(func, result)
+        result = self._loads(func, result)
         rt = time.time() - st
         self.logger.debug(f'{func} s2c_loads end in {rt}')
         self.logger.debug(f'exit {func}')
         return result
 
     def submit_task_d(self, func, args, kwargs):
+        kwargs.pop(BYPASS, None)
         try:
             return self._submit_task_d(func, args, kwargs)
         except Exception as e:
@@ -142,7 +943,7 @@ class TunnelProxy(object):
 
         def tunnel_async_api(*args, **kwargs):
             _func = func[:-6]
-            return self._pool.submit(self.submit_task, _func, args, kwargs)
+            return self.submit_task_async(_func, args, kwargs)
 
         def tunnel_api_d(*args, **kwargs):
             _func = func
@@ -152,6 +953,12 @@ class TunnelProxy(object):
             _func = func[:-6]
             return self._pool.submit(self.submit_task_d, _func, args, kwargs)
 
+        def tunnel_oneway_api(*args, **kwargs):
+            _func = func[:-7]
+            return self.submit_task_oneway(_func, args, kwargs)
+
+        if func.endswith('_oneway'):
+            return tunnel_oneway_api
         if self.debug:
             if func.endswith('_async'):
                 return tunnel_async_api_d
@@ -161,10 +968,14 @@ class TunnelProxy(object):
         return tunnel_api
 
     def __del__(self):
-        if self._is_setup:
-            self._client.decr_client_num()
-            self.transport.close()
+        if self._is_setup and self._key is not None:
+            self.registry.release(self._key)
 
     def get_client_num(self):
         self._setup()
-        return self._client.get_client_num()
+        return self._conns.get().call('get_client_num')
+
+    def cache_stats(self):
+        """Hits, misses and size of the cache of idempotent methods."""
+        self._setup()
+        return self.cache.stats()
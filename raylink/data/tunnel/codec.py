@@ -0,0 +1,98 @@
+__all__ = ['Codec']
+
+from threading import Lock
+import functools
+import zlib
+
+CODEC_SEP = b'@'
+# entry of a request from another host, the response is encoded as well
+REMOTE = CODEC_SEP
+
+CODECS = {
+    'zlib': (functools.partial(zlib.compress, level=1), zlib.decompress),
+}
+
+
+def _size(v):
+    return v.nbytes if isinstance(v, memoryview) else len(v)
+
+
+class Codec(object):
+    """Compression of the entries of tunnel calls.
+
+    Entries of `map<binary, binary>` larger than `threshold` bytes are
+    compressed and their keys are suffixed by `@`. The spec of a codec is
+    None or 'none' for no compression, a name in `CODECS` (e.g. 'zlib'),
+    or a pair of picklable callables `(compress, decompress)` on bytes.
+    The spec is advertised in `TunnelInfo.codec` so both sides agree on
+    it. Bytes saved by this side are counted in `saved`.
+
+    Args:
+        spec: Codec spec
+        threshold (int): Entries not larger than it are sent as is
+    """
+    DEFAULT_THRESHOLD = 4096
+
+    def __init__(self, spec=None, threshold=DEFAULT_THRESHOLD):
+        if spec is None or spec == 'none':
+            self.name = 'none'
+            self._compress = self._decompress = None
+        elif isinstance(spec, str):
+            assert spec in CODECS, f'Unknown codec {spec}'
+            self.name = spec
+            self._compress, self._decompress = CODECS[spec]
+        else:
+            self._compress, self._decompress = spec
+            self.name = getattr(self._compress, '__name__', 'custom')
+        self.threshold = threshold
+        self.saved = 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return self._compress is not None
+
+    def _count(self, n):
+        with self._lock:
+            self.saved += n
+
+    def encode(self, data):
+        """Compress the large entries of `data`.
+
+        Args:
+            data (dict): Entries of `map<binary, binary>`
+
+        Returns:
+            dict: Encoded entries
+        """
+        if not self.enabled:
+            return data
+        encoded = {}
+        saved = 0
+        for k, v in data.items():
+            n = _size(v)
+            if n > self.threshold:
+                z = self._compress(v)
+                if len(z) < n:
+                    encoded[k + CODEC_SEP] = z
+                    saved += n - len(z)
+                    continue
+            encoded[k] = v
+        if saved:
+            self._count(saved)
+        return encoded
+
+    def decode(self, data):
+        """Decompress the entries compressed by `encode`."""
+        if not any(k.endswith(CODEC_SEP) for k in data):
+            return data
+        decoded = {}
+        for k, v in data.items():
+            if k.endswith(CODEC_SEP) and k != REMOTE:
+                decoded[k[:-1]] = self._decompress(v)
+            else:
+                decoded[k] = v
+        return decoded
+
+    def stats(self):
+        return {'codec': self.name, 'codec_bytes_saved': self.saved}
@@ -0,0 +1,210 @@
+__all__ = ['TunnelExecutor', 'TunnelOverloaded']
+
+from raylink.util.task import PriorityQueue, EMPTY_QUEUE
+from concurrent.futures import Executor, Future
+from thrift.Thrift import TApplicationException
+from collections import defaultdict, deque
+from threading import Thread, Condition, get_native_id
+from queue import SimpleQueue
+import logging
+import os
+
+
+class TunnelOverloaded(TApplicationException):
+    """The tunnel server has too many pending tasks, retry later."""
+    # `TApplicationException.type` on the wire, beyond the thrift ones
+    OVERLOADED = 100
+
+    def __init__(self, message='tunnel overloaded'):
+        super(TunnelOverloaded, self).__init__(self.OVERLOADED, message)
+
+
+class TunnelExecutor(Executor):
+    """Executor of tunnel tasks with priorities and per-method limits.
+
+    `max_workers` threads run tasks by priority, smaller numbers first as
+    in `raylink.util.task.TaskQueue`. `priorities` maps method names to
+    priorities, other methods have `default_priority`. `limits` caps the
+    number of running tasks of a method, the tasks beyond the cap wait
+    without holding a worker, so other methods keep running. When
+    `max_pending` tasks are waiting, `submit_task` raises
+    `TunnelOverloaded`, which is sent back to the client. With `nice`,
+    the threads are scheduled by the OS with this niceness (Linux only),
+    e.g. a positive one for bulk transfers. Tasks of the `blocking`
+    methods, which may wait on other tasks (e.g. `Queue.get` waiting for
+    a `put`), run in a second pool of `blocking_workers` threads outside
+    the limits and priorities, so they can not starve the workers. They
+    count toward `max_pending` until they start.
+
+    Args:
+        max_workers (int): Number of threads
+        limits (dict): Method name to the max number of running tasks
+        priorities (dict): Method name to its priority
+        default_priority (int): Priority of other methods
+        max_pending (int): Max number of waiting tasks, None for no limit
+        nice (int): Niceness of the threads, None to inherit it
+        blocking (list): Names of the methods run in the blocking pool
+        blocking_workers (int): Number of threads of the blocking pool,
+            `max_workers` if None
+    """
+
+    def __init__(self, max_workers=32, limits=None, priorities=None,
+                 default_priority=1, max_pending=None, nice=None,
+                 blocking=None, blocking_workers=None):
+        self.max_workers = max_workers
+        self.blocking = frozenset(blocking or ())
+        self.blocking_workers = blocking_workers or max_workers
+        self.nice = nice
+        self.limits = dict(limits or {})
+        self.priorities = dict(priorities or {})
+        self.default_priority = default_priority
+        self.max_pending = max_pending
+        self._queue = PriorityQueue()
+        self._cond = Condition()
+        self._pending = 0
+        self._running = defaultdict(int)
+        self._deferred = defaultdict(deque)
+        self._shutdown = False
+        self._blocking_queue = SimpleQueue()
+        self._workers = []
+        self._blocking_workers = []
+        for i in range(max_workers):
+            t = Thread(target=self._work, daemon=True,
+                       name=f'TunnelExecutor-{i}')
+            t.start()
+            self._workers.append(t)
+        for i in range(self.blocking_workers if self.blocking else 0):
+            t = Thread(target=self._work_blocking, daemon=True,
+                       name=f'TunnelExecutor-blocking-{i}')
+            t.start()
+            self._blocking_workers.append(t)
+
+    def submit_task(self, name, fn, *args, **kwargs):
+        """Run `fn` as a task of the method `name`.
+
+        Returns:
+            concurrent.futures.Future: Future of the result of `fn`
+
+        Raises:
+            TunnelOverloaded: If `max_pending` tasks are waiting
+        """
+        future = Future()
+        priority = self.priorities.get(name, self.default_priority)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new tasks after shutdown')
+            if self.max_pending is not None and \
+                    self._pending >= self.max_pending:
+                raise TunnelOverloaded(
+                    f'tunnel overloaded with {self._pending} pending tasks')
+            self._pending += 1
+            if name in self.blocking:
+                self._blocking_queue.put((name, (future, fn, args, kwargs)))
+                return future
+            self._queue.put(priority, (name, (future, fn, args, kwargs)))
+            self._cond.notify()
+        return future
+
+    def strictest(self, names):
+        """The method among `names` which bounds a task running all of
+        them, e.g. a batch: a blocking one, else the one with the smallest
+        limit, else the one with the least urgent priority.
+        """
+        names = list(names)
+        if not names:
+            return None
+        for name in names:
+            if name in self.blocking:
+                return name
+        inf = float('inf')
+        return min(names, key=lambda n: (
+            self.limits.get(n, inf),
+            -self.priorities.get(n, self.default_priority)))
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_task(None, fn, *args, **kwargs)
+
+    def _take(self):
+        with self._cond:
+            while True:
+                item = self._queue.get()
+                if item == EMPTY_QUEUE:
+                    if self._shutdown:
+                        return None
+                    self._cond.wait()
+                    continue
+                name, task = item
+                limit = self.limits.get(name)
+                if limit is not None and self._running[name] >= limit:
+                    self._deferred[name].append(task)
+                    continue
+                self._running[name] += 1
+                self._pending -= 1
+                return name, task
+
+    def _done(self, name):
+        with self._cond:
+            self._running[name] -= 1
+            if self._deferred[name]:
+                task = self._deferred[name].popleft()
+                priority = self.priorities.get(name, self.default_priority)
+                self._queue.put(priority, (name, task))
+                self._cond.notify()
+
+    def _set_nice(self):
+        try:
+            # a thread id works as a pid for `setpriority` on Linux
+            os.setpriority(os.PRIO_PROCESS, get_native_id(), self.nice)
+        except (AttributeError, OSError) as e:
+            logging.warning(f'Unable to set tunnel executor nice: {e}')
+
+    def _take_blocking(self):
+        item = self._blocking_queue.get()
+        if item is not None:
+            with self._cond:
+                self._running[item[0]] += 1
+                self._pending -= 1
+        return item
+
+    def _work(self, take=None):
+        if self.nice is not None:
+            self._set_nice()
+        take = take or self._take
+        while True:
+            item = take()
+            if item is None:
+                return
+            name, (future, fn, args, kwargs) = item
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            except Exception:
+                logging.exception('Unexpected exception in tunnel executor')
+            finally:
+                self._done(name)
+
+    def _work_blocking(self):
+        self._work(self._take_blocking)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': self._pending,
+                'running': {k: v for k, v in self._running.items() if v},
+                'deferred': {k: len(v) for k, v in self._deferred.items()
+                             if v},
+            }
+
+    def shutdown(self, wait=True, **kwargs):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        for _ in self._blocking_workers:
+            self._blocking_queue.put(None)
+        # the blocking tasks may wait forever, so only the pool is joined
+        if wait:
+            for t in self._workers:
+                t.join()
@@ -0,0 +1,86 @@
+__all__ = ['TunnelLaneProxy']
+
+DEFAULT_LANE = 'common'
+
+
+def _method(func):
+    """Method name of a proxy attribute, without the call suffix."""
+    for suffix in ('_oneway', '_async'):
+        if func.endswith(suffix):
+            return func[:-len(suffix)]
+    return func
+
+
+class TunnelLaneProxy(object):
+    """Proxy of a node with tunnel lanes.
+
+    A lane is a tunnel of the node with its own server threads, limits
+    and scheduling priority, declared by `OutlineNode._tunnel_lanes`, so
+    bulk transfers in one lane do not delay the calls of another. Calls
+    are routed to the lane of their method in `routes`, other methods go
+    to the default lane. Batches and coalescers use the default lane
+    unless a `lane` is given.
+
+    Args:
+        proxies (dict): Lane name to its `TunnelProxy`
+        routes (dict): Method name to its lane name
+        default (str): Lane of the methods not in `routes`
+    """
+
+    def __init__(self, proxies, routes, default=DEFAULT_LANE):
+        self.proxies = proxies
+        self.routes = routes
+        self.default = default
+
+    def lane(self, name=None):
+        """`TunnelProxy` of the lane `name`, the default lane if None."""
+        return self.proxies[self.default if name is None else name]
+
+    def route(self, func):
+        """`TunnelProxy` of the lane of the method `func`."""
+        return self.proxies[self.routes.get(_method(func), self.default)]
+
+    def submit_task(self, func, args, kwargs):
+        return self.route(func).submit_task(func, args, kwargs)
+
+    def submit_task_async(self, func, args, kwargs):
+        return self.route(func).submit_task_async(func, args, kwargs)
+
+    def submit_task_oneway(self, func, args, kwargs):
+        return self.route(func).submit_task_oneway(func, args, kwargs)
+
+    def _route_many(self, calls):
+        lanes = {self.routes.get(func, self.default) for func, _, _ in calls}
+        return self.proxies[lanes.pop() if len(lanes) == 1 else self.default]
+
+    def call_many(self, calls):
+        """`TunnelProxy.call_many` in the lane of the calls, or in the
+        default lane if they are in different lanes.
+        """
+        return self._route_many(calls).call_many(calls)
+
+    def call_many_async(self, calls):
+        return self._route_many(calls).call_many_async(calls)
+
+    def batch(self, lane=None):
+        return self.lane(lane).batch()
+
+    def coalesce(self, lane=None, **kwargs):
+        return self.lane(lane).coalesce(**kwargs)
+
+    def get_client_num(self):
+        return self.lane().get_client_num()
+
+    def cache_stats(self):
+        """`TunnelProxy.cache_stats` summed over the lanes."""
+        stats = {'hits': 0, 'misses': 0, 'size': 0}
+        for proxy in self.proxies.values():
+            for k, v in proxy.cache_stats().items():
+                stats[k] += v
+        return stats
+
+    def __getattr__(self, func):
+        # not set up yet, e.g. while unpickling
+        if func.startswith('__') or 'routes' not in self.__dict__:
+            raise AttributeError(func)
+        return getattr(self.route(func), func)
@@ -1,10 +1,154 @@
-__all__ = ['Pickler']
+__all__ = ['Pickler', 'ArrayDictPickler', 'ArraySpec', 'array_dict']
 
+from collections import namedtuple
+import numpy as np
+import functools
+import inspect
+import marshal
 import pickle
+import struct
+
+OOB_SEP = b'#'
+BATCH_FUNC = '__batch__'
+BATCH_SEP = b'/'
+BATCH_FUNCS = b'__funcs__'
+# responses of generator methods, see `TunnelStream`
+STREAM_KEY = b'__stream__'
+STREAM_END = b'__end__'
+STREAM_NEXT = '__stream_next__'
+STREAM_CLOSE = '__stream_close__'
+
+
+def oob_dumps(key, obj, threshold=0):
+    """Pickle `obj` with protocol 5 and keep large buffers out-of-band.
+
+    Every `PickleBuffer` (e.g. the memory of a contiguous numpy array)
+    larger than `threshold` bytes is not copied into the pickle stream,
+    but returned as an extra entry `key#i` holding a raw memoryview,
+    so it is written to the transport without an intermediate copy.
+
+    Args:
+        key (bytes): Key of the pickle stream
+        obj: Object to be pickled
+        threshold (int): Buffers not larger than it are kept in-band
+
+    Returns:
+        dict: Entries of `map<binary, binary>`
+    """
+    buffers = []
+
+    def buffer_callback(buf):
+        raw = buf.raw()
+        if raw.nbytes <= threshold:
+            return True
+        buffers.append(raw)
+        return False
+
+    data = {key: pickle.dumps(obj, protocol=5,
+                              buffer_callback=buffer_callback)}
+    for i, raw in enumerate(buffers):
+        data[key + OOB_SEP + str(i).encode()] = raw
+    return data
+
+
+def _writable(buf):
+    """`buf`, or a writable copy of it if it is read-only, e.g. bytes."""
+    if memoryview(buf).readonly:
+        return bytearray(buf)
+    return buf
+
+
+def oob_loads(key, data, writable=True):
+    """Load an object pickled by `oob_dumps`.
+
+    Out-of-band buffers are handed back to `pickle.loads`, so numpy
+    arrays are rebuilt with `np.frombuffer` on them. Received entries are
+    read-only bytes, with `writable` on they are copied once so the arrays
+    can be modified as with in-band pickles. Without it the arrays share
+    the received bytes and are read-only.
+
+    Args:
+        key (bytes): Key of the pickle stream
+        data (dict): Entries of `map<binary, binary>`
+        writable (bool): Make the arrays writable
+
+    Returns:
+        The unpickled object
+    """
+    buffers = []
+    prefix = key + OOB_SEP
+    i = 0
+    while prefix + str(i).encode() in data:
+        buf = data[prefix + str(i).encode()]
+        buffers.append(_writable(buf) if writable else buf)
+        i += 1
+    return pickle.loads(data[key], buffers=buffers)
+
+
+def batch_pack(funcs, items):
+    """Pack the pickled data of many calls into one `map<binary, binary>`.
+
+    The entries of the i-th call are prefixed by `i/`, and the method names
+    are kept in the `__funcs__` entry.
+
+    Args:
+        funcs (list): Method names
+        items (list): Pickled data of each call, e.g. from `c2s_dumps`
+
+    Returns:
+        dict: Entries of `map<binary, binary>`
+    """
+    data = {BATCH_FUNCS: marshal.dumps(list(funcs))}
+    for i, item in enumerate(items):
+        prefix = str(i).encode() + BATCH_SEP
+        for k, v in item.items():
+            data[prefix + k] = v
+    return data
+
+
+def batch_unpack(data):
+    """Unpack the data packed by `batch_pack`.
+
+    Returns:
+        tuple: Method names and the pickled data of each call
+    """
+    funcs = marshal.loads(data[BATCH_FUNCS])
+    items = [{} for _ in funcs]
+    for k, v in data.items():
+        if k == BATCH_FUNCS:
+            continue
+        i, key = k.split(BATCH_SEP, 1)
+        items[int(i)][key] = v
+    return funcs, items
 
 
 class Pickler(object):
+    """Serializer of tunnel calls.
+
+    `funcs` lists the methods using `_custom_*` methods, others use
+    `_default_*` methods. When `out_of_band` is on, the default methods
+    use pickle protocol 5 and send buffers larger than `oob_threshold`
+    bytes as separate entries, see `oob_dumps`. Received arrays are
+    writable unless `writable` is off, which saves a copy of each
+    out-of-band buffer but makes the arrays read-only. `coalesce` may
+    merge calls buffered by a `TunnelCoalescer` before they are sent.
+    """
     funcs = []
+    out_of_band = True
+    oob_threshold = 1024
+    writable = True
+
+    @classmethod
+    def coalesce(cls, calls):
+        """Merge buffered fire-and-forget calls, keep them by default.
+
+        Args:
+            calls (list): Tuples of (func, args, kwargs) in call order
+
+        Returns:
+            list: Tuples of (func, args, kwargs) to be sent in order
+        """
+        return calls
 
     @classmethod
     def s2c_dumps(cls, func, returns):
@@ -30,25 +174,36 @@ class Pickler(object):
             return cls._custom_c2s_loads(func, args)
         return cls._default_c2s_loads(func, args)
 
-    @staticmethod
-    def _default_s2c_dumps(func, returns):
+    @classmethod
+    def _default_s2c_dumps(cls, func, returns):
+        if cls.out_of_band:
+            return oob_dumps(b'returns', returns, cls.oob_threshold)
         return {
             b'returns': pickle.dumps(returns)
         }
 
-    @staticmethod
-    def _default_s2c_loads(func, returns):
+    @classmethod
+    def _default_s2c_loads(cls, func, returns):
+        if cls.out_of_band:
+            return oob_loads(b'returns', returns, cls.writable)
         return pickle.loads(returns[b'returns'])
 
-    @staticmethod
-    def _default_c2s_dumps(func, *args, **kwargs):
+    @classmethod
+    def _default_c2s_dumps(cls, func, *args, **kwargs):
+        if cls.out_of_band:
+            data = oob_dumps(b'args', args, cls.oob_threshold)
+            data.update(oob_dumps(b'kwargs', kwargs, cls.oob_threshold))
+            return data
         return {
             b'args': pickle.dumps(args),
             b'kwargs': pickle.dumps(kwargs)
         }
 
-    @staticmethod
-    def _default_c2s_loads(func, args):
+    @classmethod
+    def _default_c2s_loads(cls, func, args):
+        if cls.out_of_band:
+            return oob_loads(b'args', args, cls.writable), \
+                oob_loads(b'kwargs', args, cls.writable)
         args, kwargs = \
             pickle.loads(args[b'args']), pickle.loads(args[b'kwargs'])
         return args, kwargs
@@ -75,3 +230,257 @@ class Pickler(object):
         args, kwargs = \
             pickle.loads(args[b'args']), pickle.loads(args[b'kwargs'])
         return args, kwargs
+
+
+# array methods of `ArrayDictPickler`, `args` holds (position, name) pairs
+ArraySpec = namedtuple('ArraySpec', ['args', 'returns'], defaults=((), False))
+
+
+def array_dict(*names, returns=False):
+    """Declare the array arguments or the returns of a node method.
+
+    The named arguments and, with `returns` on, the returned value are
+    dicts, tuples or lists of ndarrays sent by `ArrayDictPickler`, e.g.
+
+        @array_dict('samples')
+        def write_inc(self, samples): ...
+
+        @array_dict(returns=True)
+        def read(self, keys, cursors): ...
+
+    The node class gets a pickler of its declared methods as `_pickler`.
+    """
+    def decorator(fn):
+        params = list(inspect.signature(fn).parameters)[1:]
+        fn._array_spec = ArraySpec(
+            tuple((params.index(n), n) for n in names), returns)
+        return fn
+    return decorator
+
+
+ARRAY_HEADER = b'h'
+ARRAY_PICKLED = b'p'
+_DICT, _TUPLE, _LIST, _OBJECT = range(4)
+_VALUE = struct.Struct('<BI')
+# number of schemas parsed from headers kept by each process
+SCHEMA_CACHE_SIZE = 256
+
+
+def _is_array(v):
+    return isinstance(v, np.ndarray) and not v.dtype.hasobject and \
+        v.dtype.fields is None
+
+
+def _raw(array):
+    return memoryview(np.ascontiguousarray(array).reshape(-1).view(np.uint8))
+
+
+def _pack_value(value, parts, buffers, objects):
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        kind, items = _DICT, value.items()
+    elif isinstance(value, (tuple, list)):
+        kind = _TUPLE if isinstance(value, tuple) else _LIST
+        items = (('', v) for v in value)
+    else:
+        parts.append(_VALUE.pack(_OBJECT, 0))
+        objects.append(value)
+        return
+    parts.append(_VALUE.pack(kind, len(value)))
+    for k, v in items:
+        key = k.encode()
+        if _is_array(v):
+            d = v.dtype.str.encode()
+            parts.append(struct.pack(f'<H{len(key)}sB{len(d)}sB{v.ndim}q',
+                                     len(key), key, len(d), d, v.ndim,
+                                     *v.shape))
+            buffers.append(_raw(v))
+        else:
+            # not an array, pickled with the other objects
+            parts.append(struct.pack(f'<H{len(key)}sB', len(key), key, 0))
+            objects.append(v)
+
+
+@functools.lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def _parse_header(header):
+    """Layout of the values described by a header, see `_pack_value`."""
+    layout, off = [], 0
+    while off < len(header):
+        kind, n = _VALUE.unpack_from(header, off)
+        off += _VALUE.size
+        entries = []
+        for _ in range(n):
+            (klen,) = struct.unpack_from('<H', header, off)
+            key = header[off + 2:off + 2 + klen].decode()
+            off += 2 + klen
+            dlen = header[off]
+            off += 1
+            if dlen == 0:
+                entries.append((key, None, None))
+                continue
+            dtype = np.dtype(header[off:off + dlen].decode())
+            ndim = header[off + dlen]
+            off += dlen + 1
+            shape = struct.unpack_from(f'<{ndim}q', header, off)
+            off += 8 * ndim
+            entries.append((key, dtype, shape))
+        layout.append((kind, tuple(entries)))
+    return tuple(layout)
+
+
+def array_dumps(values, extra=None):
+    """Send dicts, tuples or lists of ndarrays as raw buffers.
+
+    A compact binary header holds the kind of each value and the key, dtype
+    and shape of every array, and the i-th array is sent as is in the
+    entry `i`. Values which are not arrays, and `extra`, are pickled
+    together in one entry.
+
+    Args:
+        values (list): Values to be sent
+        extra: Other picklable data, None for nothing
+
+    Returns:
+        dict: Entries of `map<binary, binary>`
+    """
+    parts, buffers, objects = [], [], []
+    for value in values:
+        _pack_value(value, parts, buffers, objects)
+    data = {ARRAY_HEADER: b''.join(parts)}
+    for i, buf in enumerate(buffers):
+        data[str(i).encode()] = buf
+    if objects or extra is not None:
+        data[ARRAY_PICKLED] = pickle.dumps((objects, extra), protocol=5)
+    return data
+
+
+def array_loads(data, writable=True):
+    """Load the values sent by `array_dumps`.
+
+    The header is parsed once and its layout is kept in an LRU cache, so
+    repeated calls with the same keys, dtypes and shapes only wrap the
+    received buffers with `np.frombuffer`. As in `oob_loads`, read-only
+    buffers are copied once if `writable` is on, otherwise the arrays are
+    read-only.
+
+    Returns:
+        tuple: The values and `extra`
+    """
+    header = data[ARRAY_HEADER]
+    if not isinstance(header, bytes):
+        header = bytes(header)
+    layout = _parse_header(header)
+    objects, extra = pickle.loads(data[ARRAY_PICKLED]) \
+        if ARRAY_PICKLED in data else ((), None)
+    objects = iter(objects)
+    values, i = [], 0
+    for kind, entries in layout:
+        if kind == _OBJECT:
+            values.append(next(objects))
+            continue
+        items = []
+        for key, dtype, shape in entries:
+            if dtype is None:
+                items.append((key, next(objects)))
+                continue
+            buf = data[str(i).encode()]
+            array = np.frombuffer(_writable(buf) if writable else buf,
+                                  dtype=dtype)
+            items.append((key, array.reshape(shape)))
+            i += 1
+        if kind == _DICT:
+            values.append(dict(items))
+        elif kind == _TUPLE:
+            values.append(tuple(v for _, v in items))
+        else:
+            values.append([v for _, v in items])
+    return values, extra
+
+
+class ArrayDictPickler(Pickler):
+    """Pickler sending dicts, tuples or lists of ndarrays as raw buffers.
+
+    `arrays` maps method names to their `ArraySpec`, usually collected
+    from the methods decorated by `array_dict`, see `of`. The declared
+    arguments and returns are sent by `array_dumps`, other arguments are
+    pickled along, and other methods use the default pickling.
+    """
+    arrays = {}
+
+    @classmethod
+    def of(cls, node_cls):
+        """Pickler of the `array_dict` methods of `node_cls`.
+
+        It extends `node_cls._pickler` if that is an `ArrayDictPickler`.
+        Its qualified name is `<node_cls>._pickler`, so it is pickled by
+        reference once set there.
+        """
+        base = getattr(node_cls, '_pickler', None) or cls
+        assert issubclass(base, cls), \
+            f'array_dict methods need an {cls.__name__}, not {base}'
+        arrays = dict(base.arrays)
+        for name in dir(node_cls):
+            spec = getattr(getattr(node_cls, name, None), '_array_spec', None)
+            if spec is not None:
+                arrays[name] = spec
+        funcs = list(arrays) + [f for f in base.funcs if f not in arrays]
+        pickler = type(f'{node_cls.__name__}Pickler', (base,),
+                       {'arrays': arrays, 'funcs': funcs})
+        pickler.__module__ = node_cls.__module__
+        pickler.__qualname__ = f'{node_cls.__qualname__}._pickler'
+        return pickler
+
+    @classmethod
+    def _custom_c2s_dumps(cls, func, *args, **kwargs):
+        spec = cls.arrays.get(func)
+        if spec is None or not spec.args:
+            return cls._default_c2s_dumps(func, *args, **kwargs)
+        values, where = [], []
+        rest = list(args)
+        kwargs = dict(kwargs)
+        for pos, name in spec.args:
+            if pos < len(rest):
+                values.append(rest[pos])
+                rest[pos] = None
+                where.append('a')
+            elif name in kwargs:
+                values.append(kwargs.pop(name))
+                where.append('k')
+            else:
+                where.append('')
+        # only the arrays in order, nothing else to pickle
+        if kwargs or len(rest) != len(spec.args) or \
+                any(pos != i for i, (pos, _) in enumerate(spec.args)) or \
+                any(w != 'a' for w in where):
+            return array_dumps(values, (rest, kwargs, where))
+        return array_dumps(values)
+
+    @classmethod
+    def _custom_c2s_loads(cls, func, args):
+        spec = cls.arrays.get(func)
+        if spec is None or not spec.args:
+            return cls._default_c2s_loads(func, args)
+        values, extra = array_loads(args, cls.writable)
+        if extra is None:
+            return tuple(values), {}
+        rest, kwargs, where = extra
+        values = iter(values)
+        for (pos, name), w in zip(spec.args, where):
+            if w == 'a':
+                rest[pos] = next(values)
+            elif w == 'k':
+                kwargs[name] = next(values)
+        return tuple(rest), kwargs
+
+    @classmethod
+    def _custom_s2c_dumps(cls, func, returns):
+        spec = cls.arrays.get(func)
+        if spec is None or not spec.returns:
+            return cls._default_s2c_dumps(func, returns)
+        return array_dumps([returns])
+
+    @classmethod
+    def _custom_s2c_loads(cls, func, returns):
+        spec = cls.arrays.get(func)
+        if spec is None or not spec.returns:
+            return cls._default_s2c_loads(func, returns)
+        return array_loads(returns, cls.writable)[0][0]
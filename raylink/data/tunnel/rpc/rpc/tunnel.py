@@ -38,6 +38,24 @@ class Iface(object):
     def get_client_num(self):
         pass
 
+    def open_shm(self, name, pid):
+        """
+        Parameters:
+         - name
+         - pid
+
+        """
+        pass
+
+    def task_oneway(self, func, kwargs):
+        """
+        Parameters:
+         - func
+         - kwargs
+
+        """
+        pass
+
 
 class Client(Iface):
     def __init__(self, iprot, oprot=None):
@@ -154,6 +172,58 @@ class Client(Iface):
             return result.success
         raise TApplicationException(TApplicationException.MISSING_RESULT, "get_client_num failed: unknown result")
 
+    def open_shm(self, name, pid):
+        """
+        Parameters:
+         - name
+         - pid
+
+        """
+        self.send_open_shm(name, pid)
+        return self.recv_open_shm()
+
+    def send_open_shm(self, name, pid):
+        self._oprot.writeMessageBegin('open_shm', TMessageType.CALL, self._seqid)
+        args = open_shm_args()
+        args.name = name
+        args.pid = pid
+        args.write(self._oprot)
+        self._oprot.writeMessageEnd()
+        self._oprot.trans.flush()
+
+    def recv_open_shm(self):
+        iprot = self._iprot
+        (fname, mtype, rseqid) = iprot.readMessageBegin()
+        if mtype == TMessageType.EXCEPTION:
+            x = TApplicationException()
+            x.read(iprot)
+            iprot.readMessageEnd()
+            raise x
+        result = open_shm_result()
+        result.read(iprot)
+        iprot.readMessageEnd()
+        if result.success is not None:
+            return result.success
+        raise TApplicationException(TApplicationException.MISSING_RESULT, "open_shm failed: unknown result")
+
+    def task_oneway(self, func, kwargs):
+        """
+        Parameters:
+         - func
+         - kwargs
+
+        """
+        self.send_task_oneway(func, kwargs)
+
+    def send_task_oneway(self, func, kwargs):
+        self._oprot.writeMessageBegin('task_oneway', TMessageType.ONEWAY, self._seqid)
+        args = task_oneway_args()
+        args.func = func
+        args.kwargs = kwargs
+        args.write(self._oprot)
+        self._oprot.writeMessageEnd()
+        self._oprot.trans.flush()
+
 
 class Processor(Iface, TProcessor):
     def __init__(self, handler):
@@ -163,6 +233,8 @@ class Processor(Iface, TProcessor):
         self._processMap["incr_client_num"] = Processor.process_incr_client_num
         self._processMap["decr_client_num"] = Processor.process_decr_client_num
         self._processMap["get_client_num"] = Processor.process_get_client_num
+        self._processMap["open_shm"] = Processor.process_open_shm
+        self._processMap["task_oneway"] = Processor.process_task_oneway
         self._on_message_begin = None
 
     def on_message_begin(self, func):
@@ -277,6 +349,40 @@ class Processor(Iface, TProcessor):
         oprot.writeMessageEnd()
         oprot.trans.flush()
 
+    def process_open_shm(self, seqid, iprot, oprot):
+        args = open_shm_args()
+        args.read(iprot)
+        iprot.readMessageEnd()
+        result = open_shm_result()
+        try:
+            result.success = self._handler.open_shm(args.name, args.pid)
+            msg_type = TMessageType.REPLY
+        except TTransport.TTransportException:
+            raise
+        except TApplicationException as ex:
+            logging.exception('TApplication exception in handler')
+            msg_type = TMessageType.EXCEPTION
+            result = ex
+        except Exception:
+            logging.exception('Unexpected exception in handler')
+            msg_type = TMessageType.EXCEPTION
+            result = TApplicationException(TApplicationException.INTERNAL_ERROR, 'Internal error')
+        oprot.writeMessageBegin("open_shm", msg_type, seqid)
+        result.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+
+    def process_task_oneway(self, seqid, iprot, oprot):
+        args = task_oneway_args()
+        args.read(iprot)
+        iprot.readMessageEnd()
+        try:
+            self._handler.task_oneway(args.func, args.kwargs)
+        except TTransport.TTransportException:
+            raise
+        except Exception:
+            logging.exception('Exception in oneway handler')
+
 
 # HELPER FUNCTIONS AND STRUCTURES
 
@@ -726,5 +832,230 @@ all_structs.append(get_client_num_result)
 get_client_num_result.thrift_spec = (
     (0, TType.I64, 'success', None, None,),  # 0
 )
+
+
+class open_shm_args(object):
+    """
+    Attributes:
+     - name
+     - pid
+
+    """
+
+    def __init__(self, name=None, pid=None, ):
+        self.name = name
+        self.pid = pid
+
+    def read(self, iprot):
+        if iprot._fast_decode is not None and isinstance(iprot.trans,
+                                                         TTransport.CReadableTransport) and self.thrift_spec is not None:
+            iprot._fast_decode(self, iprot, [self.__class__, self.thrift_spec])
+            return
+        iprot.readStructBegin()
+        while True:
+            (fname, ftype, fid) = iprot.readFieldBegin()
+            if ftype == TType.STOP:
+                break
+            if fid == 1:
+                if ftype == TType.STRING:
+                    self.name = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
+                else:
+                    iprot.skip(ftype)
+            elif fid == 2:
+                if ftype == TType.I64:
+                    self.pid = iprot.readI64()
+                else:
+                    iprot.skip(ftype)
+            else:
+                iprot.skip(ftype)
+            iprot.readFieldEnd()
+        iprot.readStructEnd()
+
+    def write(self, oprot):
+        if oprot._fast_encode is not None and self.thrift_spec is not None:
+            oprot.trans.write(oprot._fast_encode(self, [self.__class__, self.thrift_spec]))
+            return
+        oprot.writeStructBegin('open_shm_args')
+        if self.name is not None:
+            oprot.writeFieldBegin('name', TType.STRING, 1)
+            oprot.writeString(self.name.encode('utf-8') if sys.version_info[0] == 2 else self.name)
+            oprot.writeFieldEnd()
+        if self.pid is not None:
+            oprot.writeFieldBegin('pid', TType.I64, 2)
+            oprot.writeI64(self.pid)
+            oprot.writeFieldEnd()
+        oprot.writeFieldStop()
+        oprot.writeStructEnd()
+
+    def validate(self):
+        return
+
+    def __repr__(self):
+        L = ['%s=%r' % (key, value)
+             for key, value in self.__dict__.items()]
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(L))
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not (self == other)
+
+
+all_structs.append(open_shm_args)
+open_shm_args.thrift_spec = (
+    None,  # 0
+    (1, TType.STRING, 'name', 'UTF8', None,),  # 1
+    (2, TType.I64, 'pid', None, None,),  # 2
+)
+
+
+class open_shm_result(object):
+    """
+    Attributes:
+     - success
+
+    """
+
+    def __init__(self, success=None, ):
+        self.success = success
+
+    def read(self, iprot):
+        if iprot._fast_decode is not None and isinstance(iprot.trans,
+                                                         TTransport.CReadableTransport) and self.thrift_spec is not None:
+            iprot._fast_decode(self, iprot, [self.__class__, self.thrift_spec])
+            return
+        iprot.readStructBegin()
+        while True:
+            (fname, ftype, fid) = iprot.readFieldBegin()
+            if ftype == TType.STOP:
+                break
+            if fid == 0:
+                if ftype == TType.BOOL:
+                    self.success = iprot.readBool()
+                else:
+                    iprot.skip(ftype)
+            else:
+                iprot.skip(ftype)
+            iprot.readFieldEnd()
+        iprot.readStructEnd()
+
+    def write(self, oprot):
+        if oprot._fast_encode is not None and self.thrift_spec is not None:
+            oprot.trans.write(oprot._fast_encode(self, [self.__class__, self.thrift_spec]))
+            return
+        oprot.writeStructBegin('open_shm_result')
+        if self.success is not None:
+            oprot.writeFieldBegin('success', TType.BOOL, 0)
+            oprot.writeBool(self.success)
+            oprot.writeFieldEnd()
+        oprot.writeFieldStop()
+        oprot.writeStructEnd()
+
+    def validate(self):
+        return
+
+    def __repr__(self):
+        L = ['%s=%r' % (key, value)
+             for key, value in self.__dict__.items()]
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(L))
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not (self == other)
+
+
+all_structs.append(open_shm_result)
+open_shm_result.thrift_spec = (
+    (0, TType.BOOL, 'success', None, None,),  # 0
+)
+
+
+class task_oneway_args(object):
+    """
+    Attributes:
+     - func
+     - kwargs
+
+    """
+
+    def __init__(self, func=None, kwargs=None, ):
+        self.func = func
+        self.kwargs = kwargs
+
+    def read(self, iprot):
+        if iprot._fast_decode is not None and isinstance(iprot.trans,
+                                                         TTransport.CReadableTransport) and self.thrift_spec is not None:
+            iprot._fast_decode(self, iprot, [self.__class__, self.thrift_spec])
+            return
+        iprot.readStructBegin()
+        while True:
+            (fname, ftype, fid) = iprot.readFieldBegin()
+            if ftype == TType.STOP:
+                break
+            if fid == 1:
+                if ftype == TType.STRING:
+                    self.func = iprot.readString().decode('utf-8') if sys.version_info[0] == 2 else iprot.readString()
+                else:
+                    iprot.skip(ftype)
+            elif fid == 2:
+                if ftype == TType.MAP:
+                    self.kwargs = {}
+                    (_ktype1, _vtype2, _size0) = iprot.readMapBegin()
+                    for _i4 in range(_size0):
+                        _key5 = iprot.readBinary()
+                        _val6 = iprot.readBinary()
+                        self.kwargs[_key5] = _val6
+                    iprot.readMapEnd()
+                else:
+                    iprot.skip(ftype)
+            else:
+                iprot.skip(ftype)
+            iprot.readFieldEnd()
+        iprot.readStructEnd()
+
+    def write(self, oprot):
+        if oprot._fast_encode is not None and self.thrift_spec is not None:
+            oprot.trans.write(oprot._fast_encode(self, [self.__class__, self.thrift_spec]))
+            return
+        oprot.writeStructBegin('task_oneway_args')
+        if self.func is not None:
+            oprot.writeFieldBegin('func', TType.STRING, 1)
+            oprot.writeString(self.func.encode('utf-8') if sys.version_info[0] == 2 else self.func)
+            oprot.writeFieldEnd()
+        if self.kwargs is not None:
+            oprot.writeFieldBegin('kwargs', TType.MAP, 2)
+            oprot.writeMapBegin(TType.STRING, TType.STRING, len(self.kwargs))
+            for kiter7, viter8 in self.kwargs.items():
+                oprot.writeBinary(kiter7)
+                oprot.writeBinary(viter8)
+            oprot.writeMapEnd()
+            oprot.writeFieldEnd()
+        oprot.writeFieldStop()
+        oprot.writeStructEnd()
+
+    def validate(self):
+        return
+
+    def __repr__(self):
+        L = ['%s=%r' % (key, value)
+             for key, value in self.__dict__.items()]
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(L))
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not (self == other)
+
+
+all_structs.append(task_oneway_args)
+task_oneway_args.thrift_spec = (
+    None,  # 0
+    (1, TType.STRING, 'func', 'UTF8', None,),  # 1
+    (2, TType.MAP, 'kwargs', (TType.STRING, 'BINARY', TType.STRING, 'BINARY', False), None,),  # 2
+)
 fix_spec(all_structs)
 del all_structs
@@ -3,4 +3,6 @@ service tunnel {
     void incr_client_num(),
     void decr_client_num(),
     i64 get_client_num(),
+    bool open_shm(1:string name, 2:i64 pid),
+    oneway void task_oneway(1:string func, 2:map<binary, binary> kwargs),
 }
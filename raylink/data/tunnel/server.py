@@ -1,58 +1,178 @@
 __all__ = ['TunnelServer', 'TunnelInfo']
 
-from .transport import TBufferedTransportFactory
-from thrift.protocol import TBinaryProtocol
-from .rpc.rpc.tunnel import Processor
+from .transport import get_transport, get_transport_factory, \
+    get_protocol, get_protocol_factory
+from .shm_transport import ShmChannel, TShmTransport
+from thrift.Thrift import TType, TMessageType, TApplicationException
+from .executor import TunnelExecutor, TunnelOverloaded
+from thrift.transport.TTransport import TMemoryBuffer, TTransportException
+from .rpc.rpc.tunnel import Processor, task_args, task_result, \
+    task_oneway_args
 from thrift.transport import TSocket
 from collections import namedtuple
 from thrift.server import TServer
 from threading import Thread, Lock
+from .aio import read_message, read_frame, frame, encode_message
 import portpicker
+import itertools
+import marshal
+import functools
+import atexit
+import ipaddress
+import tempfile
+import inspect
+import asyncio
+import logging
 import _thread
+import socket
 import time
 import sys
+import os
 
-from .pickler import Pickler
+from .pickler import Pickler, BATCH_FUNC, BATCH_FUNCS, batch_pack, \
+    batch_unpack, STREAM_KEY, STREAM_END, STREAM_NEXT, STREAM_CLOSE
+from .codec import Codec, REMOTE
+from .stats import TunnelStats, payload_size
+from .cache import VERSIONS, dump_versions
 
-TunnelInfo = namedtuple('TunnelInfo', ['ip', 'port', 'pickler'])
+TunnelInfo = namedtuple('TunnelInfo',
+                        ['ip', 'port', 'pickler', 'unix_path', 'codec',
+                         'framed', 'protocol', 'cache', 'tag'],
+                        defaults=(None, None, False, 'binary', None, 'common'))
+
+
+def _unix_path(port):
+    """Path of the unix socket of the tunnel on `port`.
+
+    Linux has abstract unix sockets, which live in the network namespace
+    instead of the filesystem and are gone with the process. Other
+    platforms use a file in the temporary directory.
+    """
+    name = f'raylink-tunnel-{os.getpid()}-{port}'
+    if sys.platform.startswith('linux'):
+        return '\0' + name
+    return os.path.join(tempfile.gettempdir(), name + '.sock')
+
+
+def _remove_at_exit(path):
+    """Remove the file of a unix socket listened on at exit, abstract
+    sockets have none."""
+    if path.startswith('\0'):
+        return
+
+    def remove():
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    atexit.register(remove)
+
+
+class TServerSocket(TSocket.TServerSocket):
+    """`TServerSocket` which may listen before being served, so a bind
+    error is raised to the caller, and also listens on abstract unix sockets.
+    """
+
+    def listen(self):
+        if self.handle is not None:
+            return
+        if self._unix_socket and self._unix_socket.startswith('\0'):
+            self.handle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.handle.bind(self._unix_socket)
+            self.handle.listen(self._backlog)
+            return
+        super(TServerSocket, self).listen()
+
+
+def _is_local(client):
+    """Whether an accepted `TSocket` is a unix socket or a loopback one."""
+    handle = client.handle
+    if handle.family == socket.AF_UNIX:
+        return True
+    try:
+        return ipaddress.ip_address(handle.getpeername()[0]).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+class TThreadedServer(TServer.TThreadedServer):
+    """`TThreadedServer` serving local clients with a processor which
+    accepts `open_shm`, see `TunnelProcessor`.
+    """
+
+    def handle(self, client):
+        processor = self.processor
+        if _is_local(client):
+            processor = processor.local()
+        itrans = self.inputTransportFactory.getTransport(client)
+        otrans = self.outputTransportFactory.getTransport(client)
+        iprot = self.inputProtocolFactory.getProtocol(itrans)
+        oprot = self.outputProtocolFactory.getProtocol(otrans)
+        try:
+            while True:
+                processor.process(iprot, oprot)
+        except TTransportException:
+            pass
+        except Exception as x:
+            logging.exception(x)
+        itrans.close()
+        otrans.close()
 
 
 class Handler(object):
+    # seconds before an idle stream is closed
+    STREAM_TTL = 600
+
     def __init__(self, server, node):
         self.server = server
         self.node = node
         self.p = server.pickler
+        self.codec = server.codec
         self.debug_mode = server.debug_mode
         if hasattr(node, '_llogger'):
             self.logger = node._llogger
         else:
             self.logger = None
+        self.error_logger = getattr(node, '_logger', self.logger)
         self.client_num = 0
+        self.stats = server.stats
+        self.streams = {}
+        self._stream_used = {}
+        self._last_expire = time.monotonic()
+        self._stream_ids = itertools.count()
 
     def _task(self, func, _kwargs):
+        stats = self.stats.get(func)
+        stats.enter(payload_size(_kwargs))
+        try:
+            if self.debug_mode and self.logger:
+                self.logger.debug(f'enter {func}')
+            t0 = time.perf_counter_ns()
+            args, kwargs = self.p.c2s_loads(func, _kwargs)
+            t1 = time.perf_counter_ns()
+            if self.debug_mode and self.logger:
+                self.logger.debug(f'{func} c2s_loads end in {(t1 - t0) / 1e9}')
+            result = getattr(self.node, func)(*args, **kwargs)
+            t2 = time.perf_counter_ns()
+            if self.debug_mode and self.logger:
+                self.logger.debug(f'{func} server end in {(t2 - t1) / 1e9}, '
+                                  f'{args} {kwargs}')
+            if inspect.isgenerator(result):
+                result = self._open_stream(func, result)
+            else:
+                result = self.p.s2c_dumps(func, result)
+            t3 = time.perf_counter_ns()
+        except BaseException as e:
+            stats.fail()
+            raise e
+        stats.exit(t0, t1, t2, t3, payload_size(result))
         if self.debug_mode and self.logger:
-            self.logger.debug(f'enter {func}')
-        if self.debug_mode and self.logger:
-            st = time.time()
-        args, kwargs = self.p.c2s_loads(func, _kwargs)
-        if self.debug_mode and self.logger:
-            rt = time.time() - st
-            self.logger.debug(f'{func} c2s_loads end in {rt}')
-            st = time.time()
-        result = getattr(self.node, func)(*args, **kwargs)
-        if self.debug_mode and self.logger:
-            rt = time.time() - st
-            self.logger.debug(f'{func} server end in {rt}, {args} {kwargs}')
-            st = time.time()
-        result = self.p.s2c_dumps(func, result)
-        if self.debug_mode and self.logger:
-            rt = time.time() - st
-            self.logger.debug(f'{func} s2c_dumps end in {rt}')
-        if self.debug_mode and self.logger:
+            self.logger.debug(f'{func} s2c_dumps end in {(t3 - t2) / 1e9}')
             self.logger.debug(f'exit {func}')
         return result
 
-    def task(self, func, _kwargs):
+    def _task_with_log(self, func, _kwargs):
         try:
             return self._task(func, _kwargs)
         except Exception as e:
@@ -60,6 +180,128 @@ class Handler(object):
             print(f'Error while running {func}, {args}, {kwargs}', file=sys.stderr)
             raise e
 
+    def _batch(self, _kwargs):
+        """Run the calls of a batch in order, stop at the first error."""
+        funcs, items = batch_unpack(_kwargs)
+        results = [self._task_with_log(func, item)
+                   for func, item in zip(funcs, items)]
+        return batch_pack(funcs, results)
+
+    def _open_stream(self, func, gen):
+        self._expire_streams()
+        sid = next(self._stream_ids)
+        self.streams[sid] = func, gen, Lock()
+        self._stream_used[sid] = time.monotonic()
+        return {STREAM_KEY: str(sid).encode()}
+
+    def _expire_streams(self):
+        """Close the streams not pulled for `STREAM_TTL` seconds, e.g. of a
+        client gone without closing them."""
+        now = time.monotonic()
+        if now - self._last_expire < self.STREAM_TTL / 2:
+            return
+        self._last_expire = now
+        for sid, used in list(self._stream_used.items()):
+            if now - used < self.STREAM_TTL:
+                continue
+            stream = self.streams.get(sid)
+            # a stream being pulled is not idle
+            if stream is None or not stream[2].acquire(False):
+                continue
+            try:
+                self.streams.pop(sid, None)
+                self._stream_used.pop(sid, None)
+                stream[1].close()
+            except Exception:
+                logging.exception(f'Unable to close stream {stream[0]}')
+            finally:
+                stream[2].release()
+
+    def _stream_next(self, _kwargs):
+        """Pickle the next chunk of a stream, or the end of it."""
+        sid = int(_kwargs[STREAM_KEY])
+        stream = self.streams.get(sid)
+        if stream is None:
+            # closed by the client or expired
+            return {STREAM_END: b''}
+        func, gen, lock = stream
+        self._stream_used[sid] = time.monotonic()
+        with lock:
+            try:
+                return self.p.s2c_dumps(func, next(gen))
+            except StopIteration:
+                self.streams.pop(sid, None)
+                self._stream_used.pop(sid, None)
+                return {STREAM_END: b''}
+            except Exception as e:
+                self.streams.pop(sid, None)
+                self._stream_used.pop(sid, None)
+                raise e
+
+    def _stream_close(self, _kwargs):
+        sid = int(_kwargs[STREAM_KEY])
+        self._stream_used.pop(sid, None)
+        stream = self.streams.pop(sid, None)
+        if stream is not None:
+            func, gen, lock = stream
+            with lock:
+                gen.close()
+        return {}
+
+    def task_key(self, func, _kwargs):
+        """Method name of a task for the limits and priorities of the
+        executor: the originating method of a stream frame and the strictest
+        method of a batch, see `TunnelExecutor.strictest`.
+        """
+        try:
+            if func == BATCH_FUNC:
+                data = self.codec.decode({k: v for k, v in _kwargs.items()
+                                          if k.startswith(BATCH_FUNCS)})
+                return self.server.executor.strictest(
+                    marshal.loads(data[BATCH_FUNCS])) or func
+            if func in (STREAM_NEXT, STREAM_CLOSE):
+                data = self.codec.decode({k: v for k, v in _kwargs.items()
+                                          if k.startswith(STREAM_KEY)})
+                stream = self.streams.get(int(data[STREAM_KEY]))
+                if stream is not None:
+                    return stream[0]
+        except (KeyError, ValueError, TypeError, EOFError):
+            pass
+        return func
+
+    def _run(self, func, _kwargs):
+        if func == BATCH_FUNC:
+            return self._batch(_kwargs)
+        if func == STREAM_NEXT:
+            return self._stream_next(_kwargs)
+        if func == STREAM_CLOSE:
+            return self._stream_close(_kwargs)
+        return self._task_with_log(func, _kwargs)
+
+    def task(self, func, _kwargs):
+        # only a client on another host marks its calls as remote
+        remote = _kwargs.pop(REMOTE, None) is not None
+        result = self._run(func, self.codec.decode(_kwargs))
+        # piggyback the versions of the node for the caches of clients
+        versions = getattr(self.node, '_tunnel_versions', None)
+        if versions and not func.startswith('__'):
+            result[VERSIONS] = dump_versions(versions)
+        if remote:
+            return self.codec.encode(result)
+        return result
+
+    def task_oneway(self, func, _kwargs):
+        """Run a task without a response, errors go to the node log."""
+        try:
+            _kwargs.pop(REMOTE, None)
+            self._run(func, self.codec.decode(_kwargs))
+        except Exception as e:
+            if self.error_logger is None:
+                raise e
+            import traceback
+            self.error_logger.error(f'Error while running oneway {func}: '
+                                    f'{traceback.format_exc()}')
+
     def incr_client_num(self):
         self.client_num += 1
         self.logger.debug(f'current client num {self.client_num}')
@@ -71,9 +313,160 @@ class Handler(object):
     def get_client_num(self):
         return self.client_num
 
+    def open_shm(self, name, pid):
+        # a channel needs a thread of its own, not in the async mode
+        if self.server.mode == 'async':
+            return False
+        try:
+            self.server.serve_shm(name)
+        except (ValueError, OSError) as e:
+            if self.logger:
+                self.logger.warning(f'refuse shm channel {name!r}: {e}')
+            return False
+        if self.logger:
+            self.logger.debug(f'open shm channel {name} for {pid}')
+        return True
+
+
+class TunnelProcessor(Processor):
+    """Processor running `task` calls concurrently.
+
+    The connection thread only reads requests. Every `task` is executed in
+    `executor` and its response is written back with the sequence id of the
+    request as soon as it is done, so a client can pipeline many calls on
+    one connection and match the responses out of order. `task_oneway`
+    is executed the same way without a response. `open_shm`, which makes
+    the server attach a shared memory channel, is only accepted from
+    `is_local` connections, from a unix socket or the loopback interface.
+    """
+
+    def __init__(self, handler, executor, is_local=False):
+        super(TunnelProcessor, self).__init__(handler)
+        self._executor = executor
+        self.is_local = is_local
+
+    def local(self):
+        """Processor of a local connection."""
+        return TunnelProcessor(self._handler, self._executor, True)
+
+    @staticmethod
+    def _write_lock(oprot):
+        # only the connection thread reaches here, so no race on creation
+        if not hasattr(oprot, 'write_lock'):
+            oprot.write_lock = Lock()
+        return oprot.write_lock
+
+    def process(self, iprot, oprot):
+        (name, type, seqid) = iprot.readMessageBegin()
+        if self._on_message_begin:
+            self._on_message_begin(name, type, seqid)
+        lock = self._write_lock(oprot)
+        if name == 'task':
+            args = task_args()
+            args.read(iprot)
+            iprot.readMessageEnd()
+            try:
+                self._executor.submit_task(
+                    self._handler.task_key(args.func, args.kwargs),
+                    self._run_task, seqid, args, oprot, lock)
+            except TunnelOverloaded as x:
+                self._reply(oprot, lock, seqid, TMessageType.EXCEPTION, x)
+            return True
+        if name == 'task_oneway':
+            args = task_oneway_args()
+            args.read(iprot)
+            iprot.readMessageEnd()
+            try:
+                self._executor.submit_task(
+                    self._handler.task_key(args.func, args.kwargs),
+                    self._run_oneway, args)
+            except TunnelOverloaded:
+                logging.warning(f'Drop oneway {args.func}, tunnel overloaded')
+            return True
+        with lock:
+            if name not in self._processMap or \
+                    name == 'open_shm' and not self.is_local:
+                iprot.skip(TType.STRUCT)
+                iprot.readMessageEnd()
+                x = TApplicationException(TApplicationException.UNKNOWN_METHOD,
+                                          'Unknown function %s' % (name))
+                oprot.writeMessageBegin(name, TMessageType.EXCEPTION, seqid)
+                x.write(oprot)
+                oprot.writeMessageEnd()
+                oprot.trans.flush()
+                return
+            self._processMap[name](self, seqid, iprot, oprot)
+        return True
+
+    @staticmethod
+    def _reply(oprot, lock, seqid, msg_type, result):
+        with lock:
+            oprot.writeMessageBegin('task', msg_type, seqid)
+            result.write(oprot)
+            oprot.writeMessageEnd()
+            oprot.trans.flush()
+
+    def _run_oneway(self, args):
+        try:
+            self._handler.task_oneway(args.func, args.kwargs)
+        except Exception:
+            logging.exception('Exception in oneway handler')
+
+    def _run_task(self, seqid, args, oprot, lock):
+        result = task_result()
+        try:
+            result.success = self._handler.task(args.func, args.kwargs)
+            msg_type = TMessageType.REPLY
+        except TApplicationException as ex:
+            logging.exception('TApplication exception in handler')
+            msg_type = TMessageType.EXCEPTION
+            result = ex
+        except Exception:
+            logging.exception('Unexpected exception in handler')
+            msg_type = TMessageType.EXCEPTION
+            result = TApplicationException(
+                TApplicationException.INTERNAL_ERROR, 'Internal error')
+        try:
+            self._reply(oprot, lock, seqid, msg_type, result)
+        except Exception:
+            # the client is gone, nobody is waiting for this response
+            logging.exception(f'Unable to reply task {args.func}')
+
 
 class TunnelServer(Thread):
-    def __init__(self, parent, pickler, debug=False):
+    """Tunnel server of a node.
+
+    Two serving modes are available, both speak the same wire format:
+
+    - 'threaded': `TThreadedServer`, one thread per client connection.
+    - 'async': a single asyncio event loop accepts and reads every
+      connection, so a node with thousands of clients doesn't need
+      thousands of threads.
+
+    In both modes `Handler.task` runs in a `TunnelExecutor` of
+    `max_workers` threads, with the per-method `limits` and `priorities`
+    and at most `max_pending` waiting tasks before clients get
+    `TunnelOverloaded`, its threads have the OS niceness `nice`. The
+    `blocking` methods, which may wait for other calls, run in a second
+    pool of `blocking_workers` threads.
+    With `unix` on, the server also listens on a unix socket advertised in
+    `TunnelInfo.unix_path`, which local clients prefer over TCP. `codec`
+    is the spec of the `Codec` compressing calls between hosts. `framed`
+    selects `TFramedTransport` over `TBufferedTransport`, and `protocol`
+    is the thrift protocol, 'binary' or 'compact'. The 'async' mode needs
+    `framed` for the compact protocol.
+    Calls, bytes and phase latencies of every method are kept in `stats`
+    and reported by `get_tunnel_stats` under 'methods'. `cache` declares
+    the idempotent methods cached by proxies, see `TunnelCache`. `tag` is
+    the name tag of the tunnel in its node.
+    """
+    MODES = ('threaded', 'async')
+
+    def __init__(self, parent, pickler, debug=False, max_workers=32,
+                 mode='threaded', unix=True, codec=None, framed=False,
+                 protocol='binary', limits=None, priorities=None,
+                 max_pending=None, nice=None, cache=None, tag='common',
+                 blocking=None, blocking_workers=None):
         super(TunnelServer, self).__init__()
         self.daemon = True
         self.lock = Lock()
@@ -86,20 +479,187 @@ class TunnelServer(Thread):
         self.debug_mode = debug
         self.host = '0.0.0.0'
         self.max_try = 20
+        self.max_workers = max_workers
+        self.limits = limits
+        self.priorities = priorities
+        self.max_pending = max_pending
+        self.nice = nice
+        self.blocking = blocking
+        self.blocking_workers = blocking_workers
+        self.cache_spec = cache
+        self.tag = tag
+        assert mode in self.MODES, f'Unknown tunnel mode {mode}'
+        self.mode = mode
+        self.unix = unix
+        self.unix_path = None
+        self.codec_spec = codec
+        self.codec = Codec(codec)
+        self.stats = TunnelStats()
+        self.framed = framed
+        self.protocol = protocol
+        self._protocol = get_protocol(protocol)
+        assert framed or protocol == 'binary' or mode != 'async', \
+            'The async mode reads unframed messages of the binary protocol only'
         self.handler = None
+        self.executor = None
 
     def start_server(self):
         self.port = portpicker.pick_unused_port()
         self.handler = Handler(self, self.node)
-        processor = Processor(self.handler)
-        transport = TSocket.TServerSocket(self.host, self.port)
-        tfactory = TBufferedTransportFactory()
-        pfactory = TBinaryProtocol.TBinaryProtocolFactory()
-        rpc_server = TServer.TThreadedServer(
-            processor, transport, tfactory, pfactory)
+        if self.executor is None:
+            self.executor = TunnelExecutor(
+                self.max_workers, limits=self.limits,
+                priorities=self.priorities, max_pending=self.max_pending,
+                nice=self.nice, blocking=self.blocking,
+                blocking_workers=self.blocking_workers)
+        if self.mode == 'async':
+            return self._start_async_server()
+        processor = TunnelProcessor(self.handler, self.executor)
+        transport = TServerSocket(self.host, self.port)
+        transport.listen()
+        if self.unix:
+            self._start_unix_server(processor)
+        rpc_server = self._rpc_server(processor, transport)
 
         rpc_server.serve()
 
+    def _rpc_server(self, processor, transport):
+        tfactory = get_transport_factory(self.framed)
+        pfactory = get_protocol_factory(self.protocol)
+        return TThreadedServer(
+            processor, transport, tfactory, pfactory, daemon=True)
+
+    def _start_unix_server(self, processor):
+        path = _unix_path(self.port)
+        transport = TServerSocket(unix_socket=path)
+        try:
+            transport.listen()
+        except Exception as e:
+            logging.warning(f'Unable to listen on unix socket {path!r}: {e}')
+            return
+        _remove_at_exit(path)
+        self.unix_path = path
+        t = Thread(target=self._rpc_server(processor, transport).serve)
+        t.daemon = True
+        t.start()
+
+    def serve_shm(self, name):
+        """Serve a client on the same host through a shared memory channel.
+
+        Args:
+            name (str): Name of the `ShmChannel` created by the client
+        """
+        channel = ShmChannel(name)
+        processor = TunnelProcessor(self.handler, self.executor, True)
+        t = Thread(target=self._serve_shm, args=(processor, channel))
+        t.daemon = True
+        t.start()
+
+    def _serve_shm(self, processor, channel):
+        trans = get_transport(self.framed)(TShmTransport(channel, server=True))
+        prot = self._protocol(trans)
+        try:
+            while True:
+                processor.process(prot, prot)
+        except TTransportException:
+            pass
+        except Exception as x:
+            logging.exception(x)
+        channel.close()
+
+    def _start_async_server(self):
+        processor = Processor(self.handler)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(asyncio.start_server(
+                functools.partial(self._serve_async, processor),
+                self.host, self.port))
+        except Exception as e:
+            loop.close()
+            raise e
+        if self.unix:
+            path = _unix_path(self.port)
+            try:
+                loop.run_until_complete(asyncio.start_unix_server(
+                    functools.partial(self._serve_async, processor), path))
+                _remove_at_exit(path)
+                self.unix_path = path
+            except Exception as e:
+                logging.warning(
+                    f'Unable to listen on unix socket {path!r}: {e}')
+        loop.run_forever()
+
+    def _process(self, processor, data):
+        iprot = self._protocol(TMemoryBuffer(data))
+        otrans = TMemoryBuffer()
+        processor.process(iprot, self._protocol(otrans))
+        out = otrans.getvalue()
+        if self.framed and out:
+            return frame(out)
+        return out
+
+    def _peek(self, data):
+        """Method name, sequence id and the executor key of a task, see
+        `Handler.task_key`."""
+        iprot = self._protocol(TMemoryBuffer(data))
+        name, _, seqid = iprot.readMessageBegin()
+        func = name
+        if name in ('task', 'task_oneway'):
+            iprot.readStructBegin()
+            _, ftype, fid = iprot.readFieldBegin()
+            if fid == 1 and ftype == TType.STRING:
+                func = iprot.readString()
+        if func in (BATCH_FUNC, STREAM_NEXT, STREAM_CLOSE):
+            # the key depends on the arguments, read the whole request
+            iprot = self._protocol(TMemoryBuffer(data))
+            iprot.readMessageBegin()
+            args = task_args() if name == 'task' else task_oneway_args()
+            args.read(iprot)
+            func = self.handler.task_key(func, args.kwargs)
+        return name, seqid, func
+
+    def _submit_async(self, processor, data):
+        name, seqid, func = self._peek(data)
+        try:
+            return asyncio.wrap_future(self.executor.submit_task(
+                func, self._process, processor, data))
+        except TunnelOverloaded as x:
+            if name == 'task_oneway':
+                logging.warning(f'Drop oneway {func}, tunnel overloaded')
+                out = b''
+            else:
+                out = encode_message(name, TMessageType.EXCEPTION, seqid, x,
+                                     self._protocol)
+                out = frame(out) if self.framed else out
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(out)
+            return future
+
+    async def _serve_async(self, processor, reader, writer):
+        drain_lock = asyncio.Lock()
+
+        async def reply(data):
+            try:
+                out = await self._submit_async(processor, data)
+                writer.write(out)
+                async with drain_lock:
+                    await writer.drain()
+            except ConnectionError:
+                pass
+
+        try:
+            while True:
+                if self.framed:
+                    data = await read_frame(reader)
+                else:
+                    data = await read_message(reader)
+                asyncio.ensure_future(reply(data))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
     def get_client_num(self):
         return self.handler.get_client_num()
 
@@ -108,10 +668,19 @@ class TunnelServer(Thread):
         return self._get_tunnel()
 
     def _get_tunnel(self):
-        return TunnelInfo(ip=self.node.ip_(), port=self.port, pickler=self.pickler)
+        return TunnelInfo(ip=self.node.ip_(), port=self.port,
+                          pickler=self.pickler, unix_path=self.unix_path,
+                          codec=self.codec_spec, framed=self.framed,
+                          protocol=self.protocol, cache=self.cache_spec,
+                          tag=self.tag)
 
     def get_tunnel_stats(self):
-        return {'conn_num': self.get_client_num()}
+        stats = {'conn_num': self.get_client_num(),
+                 'stream_num': len(self.handler.streams),
+                 'executor': self.executor.stats()}
+        stats.update(self.codec.stats())
+        stats['methods'] = self.stats.snapshot()
+        return stats
 
     def run(self):
         self.run_flag = False
@@ -0,0 +1,241 @@
+from thrift.transport.TTransport import TTransportException
+from multiprocessing import resource_tracker
+from raylink.data.shm import ShM
+from .transport import TTransportBase
+import _multiprocessing
+import functools
+import secrets
+import weakref
+import re
+import os
+
+# header of a channel: closed flag, pids of the client and the server
+_CHANNEL_HEAD = 64
+_CLOSED, _CLIENT_PID, _SERVER_PID = 0, 1, 2
+# header of a ring: written bytes, read bytes, waiting flags
+_RING_HEAD = 64
+_W, _R, _READER_WAITING, _WRITER_WAITING = 0, 1, 2, 3
+_SEMAPHORE = 1
+_SEM_MAX = _multiprocessing.SemLock.SEM_VALUE_MAX
+# names of channels, so a server only attaches to the shared memory of one
+CHANNEL_PREFIX = 'rlshm_'
+_CHANNEL_NAME = re.compile(CHANNEL_PREFIX + '[0-9a-f]{16}$')
+
+
+def _unlink(shm, sem_names):
+    """Remove the shared memory and semaphores of a channel."""
+    for name in sem_names:
+        try:
+            _multiprocessing.sem_unlink(name)
+        except FileNotFoundError:
+            pass
+        resource_tracker.unregister(name, 'semaphore')
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _check(head, peer):
+    """Raise EOF if the channel is closed or the peer is gone."""
+    if head[_CLOSED] != 0:
+        raise TTransportException(TTransportException.END_OF_FILE,
+                                  'shm channel closed')
+    pid = head[peer]
+    if pid == 0:
+        return
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        raise TTransportException(TTransportException.END_OF_FILE,
+                                  'shm channel peer is gone')
+    except PermissionError:
+        pass
+
+
+class ShmRing(object):
+    """Single-producer single-consumer byte ring in shared memory.
+
+    The ring header holds monotonic counters of written and read bytes.
+    A side that has to wait raises its waiting flag and blocks on a named
+    POSIX semaphore (futex based on Linux), which the other side posts
+    after it moves its counter. Waits time out periodically so a closed
+    channel or a dead peer is noticed.
+    """
+    WAIT_TIMEOUT = 0.05
+
+    def __init__(self, buf, capacity, data_sem, space_sem, check):
+        self._head = buf[:_RING_HEAD].cast('Q')
+        self._data = buf[_RING_HEAD:_RING_HEAD + capacity]
+        self.capacity = capacity
+        self._data_sem = data_sem
+        self._space_sem = space_sem
+        self._check = check
+
+    def release(self):
+        self._head.release()
+        self._data.release()
+
+    def _notify(self, flag, sem):
+        if self._head[flag]:
+            self._head[flag] = 0
+            sem.release()
+
+    def _wait(self, flag, sem, ready):
+        self._head[flag] = 1
+        while not ready():
+            self._check()
+            sem.acquire(True, self.WAIT_TIMEOUT)
+            self._head[flag] = 1
+        self._head[flag] = 0
+
+    def _free(self):
+        return self.capacity - (self._head[_W] - self._head[_R])
+
+    def _available(self):
+        return self._head[_W] - self._head[_R]
+
+    def write(self, buf):
+        buf = memoryview(buf).cast('B')
+        n, off = len(buf), 0
+        while off < n:
+            if self._free() == 0:
+                self._wait(_WRITER_WAITING, self._space_sem,
+                           lambda: self._free() > 0)
+            w = self._head[_W]
+            pos = w % self.capacity
+            k = min(self._free(), n - off, self.capacity - pos)
+            self._data[pos:pos + k] = buf[off:off + k]
+            off += k
+            self._head[_W] = w + k
+            self._notify(_READER_WAITING, self._data_sem)
+
+    def read(self, sz):
+        if self._available() == 0:
+            self._wait(_READER_WAITING, self._data_sem,
+                       lambda: self._available() > 0)
+        r = self._head[_R]
+        pos = r % self.capacity
+        k = min(self._available(), sz, self.capacity - pos)
+        ret = bytes(self._data[pos:pos + k])
+        self._head[_R] = r + k
+        self._notify(_WRITER_WAITING, self._space_sem)
+        return ret
+
+    def read_into(self, view):
+        """Read into a writable `view` without an intermediate copy."""
+        if self._available() == 0:
+            self._wait(_READER_WAITING, self._data_sem,
+                       lambda: self._available() > 0)
+        r = self._head[_R]
+        pos = r % self.capacity
+        k = min(self._available(), len(view), self.capacity - pos)
+        view[:k] = self._data[pos:pos + k]
+        self._head[_R] = r + k
+        self._notify(_WRITER_WAITING, self._space_sem)
+        return k
+
+
+class ShmChannel(object):
+    """A pair of `ShmRing` between a client and a server on the same host.
+
+    The client creates the channel and owns its shared memory and
+    semaphores, the server attaches to it by `name`. Ring 0 carries
+    requests and ring 1 carries responses. The owner removes them on
+    `close`, or at exit if the channel is never closed.
+    """
+    DEFAULT_SIZE = 1 << 22
+
+    def __init__(self, name=None, size=DEFAULT_SIZE):
+        self.owner = name is None
+        if self.owner:
+            nbytes = _CHANNEL_HEAD + 2 * (_RING_HEAD + size)
+            name = CHANNEL_PREFIX + secrets.token_hex(8)
+            self.shm = ShM(name=name, create=True, size=nbytes)
+        else:
+            if not isinstance(name, str) or not _CHANNEL_NAME.match(name):
+                raise ValueError(f'Invalid shm channel name {name!r}')
+            self.shm = ShM(name=name)
+        self.name = self.shm.name
+        self.size = (self.shm.size - _CHANNEL_HEAD) // 2 - _RING_HEAD
+        self._head = self.shm.buf[:_CHANNEL_HEAD].cast('Q')
+        if self.owner:
+            self._head[_CLOSED] = 0
+            self._head[_CLIENT_PID] = os.getpid()
+            self._peer = _SERVER_PID
+        else:
+            self._head[_SERVER_PID] = os.getpid()
+            self._peer = _CLIENT_PID
+        self._is_closed = False
+        self._sem_names = [f'/{self.name.lstrip("/")}-{i}' for i in range(4)]
+        self._sems = [self._semaphore(n) for n in self._sem_names]
+        self._finalizer = weakref.finalize(
+            self, _unlink, self.shm, self._sem_names) if self.owner else None
+        self.rings = []
+        for i in range(2):
+            start = _CHANNEL_HEAD + i * (_RING_HEAD + self.size)
+            buf = self.shm.buf[start:start + _RING_HEAD + self.size]
+            self.rings.append(ShmRing(
+                buf, self.size, self._sems[2 * i], self._sems[2 * i + 1],
+                functools.partial(_check, self._head, self._peer)))
+
+    def _semaphore(self, name):
+        if self.owner:
+            sem = _multiprocessing.SemLock(_SEMAPHORE, 0, _SEM_MAX, name, False)
+            resource_tracker.register(name, 'semaphore')
+            return sem
+        return _multiprocessing.SemLock._rebuild(0, _SEMAPHORE, _SEM_MAX, name)
+
+    @property
+    def closed(self):
+        return self._is_closed or self._head[_CLOSED] != 0
+
+    def close(self):
+        if self._is_closed:
+            return
+        self._is_closed = True
+        self._head[_CLOSED] = 1
+        # wake up both sides
+        for sem in self._sems:
+            sem.release()
+        if self.owner:
+            self._finalizer()
+
+    def __del__(self):
+        # the mapping can only be closed without exported views
+        for ring in getattr(self, 'rings', ()):
+            ring.release()
+        if hasattr(self, '_head'):
+            self._head.release()
+        if hasattr(self, 'shm'):
+            self.shm.close()
+
+
+class TShmTransport(TTransportBase):
+    """Thrift transport over a `ShmChannel`.
+
+    The client side writes requests to ring 0 and reads responses from
+    ring 1, the server side does the opposite. Wrap it with
+    `TBufferedTransport` so the protocol doesn't touch the rings for
+    every small field.
+    """
+
+    def __init__(self, channel, server=False):
+        self.channel = channel
+        self._rring, self._wring = channel.rings[::-1] if not server \
+            else channel.rings
+
+    def isOpen(self):
+        return not self.channel.closed
+
+    def read(self, sz):
+        return self._rring.read(sz)
+
+    def read_into(self, view):
+        return self._rring.read_into(view)
+
+    def write(self, buf):
+        self._wring.write(buf)
+
+    def close(self):
+        self.channel.close()
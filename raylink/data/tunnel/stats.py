@@ -0,0 +1,144 @@
+__all__ = ['Histogram', 'MethodStats', 'TunnelStats']
+
+from threading import Lock
+
+# sub-buckets per power of 2 are 2 ** (SUB_BITS - 1), about 3% precision
+SUB_BITS = 6
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+# values up to 2 ** MAX_BITS
+MAX_BITS = 48
+BUCKETS = SUB_COUNT + (MAX_BITS - SUB_BITS) * HALF_COUNT
+
+
+def _index(v):
+    if v < SUB_COUNT:
+        return v
+    v = min(v, (1 << MAX_BITS) - 1)
+    m = v.bit_length() - SUB_BITS
+    return SUB_COUNT + (m - 1) * HALF_COUNT + ((v >> m) - HALF_COUNT)
+
+
+def _lowest(i):
+    if i < SUB_COUNT:
+        return i
+    m, sub = divmod(i - SUB_COUNT, HALF_COUNT)
+    return (sub + HALF_COUNT) << (m + 1)
+
+
+class Histogram(object):
+    """HDR-style histogram of non-negative integers, e.g. latencies in us.
+
+    Values below `2 ** SUB_BITS` are counted exactly, larger ones in
+    log-linear buckets, so recording is O(1) with a bounded relative
+    error and a fixed memory size.
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, v):
+        self.counts[_index(v)] += 1
+        self.count += 1
+        self.total += v
+        if v > self.max:
+            self.max = v
+
+    def percentile(self, q):
+        """Lowest value of the bucket holding the `q` percentile."""
+        if self.count == 0:
+            return 0
+        rank = max(1, int(self.count * q / 100 + 0.5))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(_lowest(i), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max,
+        }
+
+
+class MethodStats(object):
+    """Counters and latency histograms (us) of the calls of one method."""
+    PHASES = ('deserialize', 'execute', 'serialize')
+
+    def __init__(self):
+        self._lock = Lock()
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.hists = {p: Histogram() for p in self.PHASES}
+
+    def enter(self, request_bytes):
+        with self._lock:
+            self.in_flight += 1
+            self.request_bytes += request_bytes
+
+    def exit(self, t0, t1, t2, t3, response_bytes):
+        """Record a finished call from `perf_counter_ns` timestamps taken
+        before deserializing, executing, serializing and after it.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self.calls += 1
+            self.response_bytes += response_bytes
+            self.hists['deserialize'].record((t1 - t0) // 1000)
+            self.hists['execute'].record((t2 - t1) // 1000)
+            self.hists['serialize'].record((t3 - t2) // 1000)
+
+    def fail(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = {
+                'calls': self.calls,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes,
+            }
+            for p, h in self.hists.items():
+                stats[p + '_us'] = h.snapshot()
+        return stats
+
+
+def payload_size(data):
+    """Bytes of a `map<binary, binary>` payload."""
+    return sum(len(k) + (v.nbytes if isinstance(v, memoryview) else len(v))
+               for k, v in data.items())
+
+
+class TunnelStats(object):
+    """`MethodStats` of every method of a tunnel server."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.methods = {}
+
+    def get(self, func):
+        stats = self.methods.get(func)
+        if stats is None:
+            with self._lock:
+                stats = self.methods.setdefault(func, MethodStats())
+        return stats
+
+    def snapshot(self):
+        return {func: s.snapshot() for func, s in list(self.methods.items())}
@@ -1,4 +1,7 @@
-from thrift.transport.TTransport import CReadableTransport, BufferIO
+from thrift.transport.TTransport import CReadableTransport, BufferIO, \
+    TTransportException
+from thrift.protocol import TBinaryProtocol, TCompactProtocol
+import struct
 import io
 
 
@@ -112,3 +115,156 @@ class TBufferedTransportFactory(object):
     def getTransport(self, trans):
         buffered = TBufferedTransport(trans)
         return buffered
+
+
+class TFramedTransport(TTransportBase):
+    """Class that sends every flush as a length-prefixed frame.
+
+    A frame is received with `recv_into` (or `read_into` of the wrapped
+    transport) in one piece. Frames up to `REUSE_LIMIT` bytes reuse the
+    same receive buffer and reads return bytes. Larger frames get their
+    own buffer, and reads of at least `VIEW_MIN` bytes return memoryviews
+    of it instead of copies, e.g. the out-of-band buffers of a pickle.
+    Writes of at least `VIEW_MIN` bytes are not copied either, they are
+    sent as is on flush.
+    """
+    REUSE_LIMIT = 1 << 20
+    VIEW_MIN = 1 << 16
+
+    def __init__(self, trans):
+        self.__trans = trans
+        self._head = bytearray(4)
+        self._rbuf = bytearray(self.VIEW_MIN)
+        self._frame = memoryview(b'')
+        self._pos = 0
+        self._shared = True
+        self._recv_into = None
+        self._wchunks = [bytearray(4)]
+
+    def isOpen(self):
+        return self.__trans.isOpen()
+
+    def open(self):
+        return self.__trans.open()
+
+    def close(self):
+        return self.__trans.close()
+
+    def _get_recv_into(self):
+        trans = self.__trans
+        if hasattr(trans, 'read_into'):
+            return trans.read_into
+        if getattr(trans, 'handle', None) is not None:
+            return trans.handle.recv_into
+
+        def read_into(view):
+            data = trans.read(len(view))
+            view[:len(data)] = data
+            return len(data)
+
+        return read_into
+
+    def _fill(self, view):
+        if self._recv_into is None:
+            self._recv_into = self._get_recv_into()
+        n, pos = len(view), 0
+        while pos < n:
+            try:
+                k = self._recv_into(view[pos:])
+            except OSError as e:
+                raise TTransportException(TTransportException.UNKNOWN, str(e))
+            if k == 0:
+                raise TTransportException(TTransportException.END_OF_FILE,
+                                          'TFramedTransport read 0 bytes')
+            pos += k
+
+    def _read_frame(self):
+        self._fill(memoryview(self._head))
+        size = struct.unpack('!i', self._head)[0]
+        self._shared = size <= self.REUSE_LIMIT
+        if not self._shared:
+            buf = bytearray(size)
+        else:
+            if len(self._rbuf) < size:
+                self._rbuf = bytearray(size)
+            buf = self._rbuf
+        self._frame = memoryview(buf)[:size]
+        self._pos = 0
+        self._fill(self._frame)
+
+    def _slice(self, sz):
+        view = self._frame[self._pos:self._pos + sz]
+        self._pos += len(view)
+        if self._shared or len(view) < self.VIEW_MIN:
+            return bytes(view)
+        return view
+
+    def read(self, sz):
+        if self._pos == len(self._frame):
+            self._read_frame()
+        return self._slice(sz)
+
+    def readAll(self, sz):
+        if self._pos == len(self._frame):
+            self._read_frame()
+        if len(self._frame) - self._pos >= sz:
+            return self._slice(sz)
+        chunks, have = [], 0
+        while have < sz:
+            chunk = self.read(sz - have)
+            have += len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def write(self, buf):
+        if memoryview(buf).nbytes >= self.VIEW_MIN:
+            self._wchunks.append(buf)
+            self._wchunks.append(bytearray())
+        else:
+            self._wchunks[-1] += buf
+
+    def flush(self):
+        chunks, self._wchunks = self._wchunks, [bytearray(4)]
+        size = sum(memoryview(c).nbytes for c in chunks) - 4
+        struct.pack_into('!i', chunks[0], 0, size)
+        for chunk in chunks:
+            if len(chunk):
+                self.__trans.write(chunk)
+        self.__trans.flush()
+
+
+class TFramedTransportFactory(object):
+    """Factory transport that builds framed transports"""
+
+    def getTransport(self, trans):
+        return TFramedTransport(trans)
+
+
+def get_transport(framed):
+    """Class of the transport wrapping sockets and shm channels."""
+    return TFramedTransport if framed else TBufferedTransport
+
+
+def get_transport_factory(framed):
+    if framed:
+        return TFramedTransportFactory()
+    return TBufferedTransportFactory()
+
+
+PROTOCOLS = {
+    'binary': (TBinaryProtocol.TBinaryProtocol,
+               TBinaryProtocol.TBinaryProtocolFactory),
+    'compact': (TCompactProtocol.TCompactProtocol,
+                TCompactProtocol.TCompactProtocolFactory),
+}
+
+
+def get_protocol(name):
+    """Class of the thrift protocol `name`, 'binary' or 'compact'."""
+    assert name in PROTOCOLS, f'Unknown protocol {name}'
+    return PROTOCOLS[name][0]
+
+
+def get_protocol_factory(name):
+    assert name in PROTOCOLS, f'Unknown protocol {name}'
+    return PROTOCOLS[name][1]()
@@ -10,6 +10,39 @@ __all__ = ['OutlineNode']
 
 class OutlineNode(SelfAwareNode):
     TYPE = 'outline'
+    # serving mode of tunnel servers, see `TunnelServer`
+    _tunnel_mode = 'threaded'
+    # pickler of tunnel servers, `raylink.data.tunnel.pickler.Pickler` if None,
+    # made by `ArrayDictPickler.of` if the node has `array_dict` methods
+    _pickler = None
+    # codec of tunnel calls between hosts, see `raylink.data.tunnel.codec`
+    _tunnel_codec = None
+    # per-method running caps and priorities of tunnel calls, and the max
+    # number of waiting calls, see `raylink.data.tunnel.executor`
+    _tunnel_limits = None
+    _tunnel_priorities = None
+    _tunnel_max_pending = None
+    # methods which may block on other tunnel calls, e.g. a `get` waiting
+    # for a `put`, run in a pool of `_tunnel_blocking_workers` threads
+    # (`max_workers` if None) so they can not starve the executor
+    _tunnel_blocking = None
+    _tunnel_blocking_workers = None
+    # lanes of tunnel calls, e.g. `{'control': {'methods': ['get_id'],
+    # 'max_workers': 4}}`, a lane is a tunnel tagged by its name with its
+    # own `TunnelServer` arguments (e.g. `max_workers`, `max_pending`,
+    # `nice`), `methods` are routed to it, see `TunnelLaneProxy`
+    _tunnel_lanes = None
+    # results of idempotent methods cached by proxies, method name to a dict
+    # of `ttl` (seconds) and `version` (a key of `bump_tunnel_version`),
+    # see `raylink.data.tunnel.cache.TunnelCache`
+    _tunnel_cache = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # methods declared by `raylink.data.tunnel.pickler.array_dict`
+        if any(hasattr(v, '_array_spec') for v in vars(cls).values()):
+            from raylink.data.tunnel.pickler import ArrayDictPickler
+            cls._pickler = ArrayDictPickler.of(cls)
 
     def __init__(self, info, parent, node_cfg):
         SelfAwareNode.__init__(self, node_cfg)
@@ -21,7 +54,7 @@ class OutlineNode(SelfAwareNode):
         self._path = info['path']
         self._parent_path = os.path.dirname(self._path)
         self._tunnels = {}
-        self._pickler = None
+        self._tunnel_versions = {}
         self.__lock = threading.Lock()
         self.__set_global()
         self._setup_tunnel()
@@ -133,7 +166,16 @@ class OutlineNode(SelfAwareNode):
 
     def _setup_tunnel(self, tag='common', debug=False):
         from ..data import TunnelServer
-        ts = TunnelServer(self, self._pickler, debug)
+        kwargs = {'mode': self._tunnel_mode, 'codec': self._tunnel_codec,
+                  'limits': self._tunnel_limits,
+                  'priorities': self._tunnel_priorities,
+                  'max_pending': self._tunnel_max_pending,
+                  'blocking': self._tunnel_blocking,
+                  'blocking_workers': self._tunnel_blocking_workers,
+                  'cache': self._tunnel_cache, 'tag': tag}
+        lane = (self._tunnel_lanes or {}).get(tag, {})
+        kwargs.update({k: v for k, v in lane.items() if k != 'methods'})
+        ts = TunnelServer(self, self._pickler, debug, **kwargs)
         ts.start()
         time.sleep(0.1)
         conn_flag = False
@@ -158,28 +200,46 @@ class OutlineNode(SelfAwareNode):
     def get_tunnel(self, tag='common', debug=False):
         """Get or create a tunnel by its name tag.
 
+        With `_tunnel_lanes`, the 'common' tunnel comes with the tunnels of
+        the lanes in a `TunnelLaneProxy`, which routes calls by method.
 
         Args:
             tag (str): Tag of the tunnel
             debug (bool): Enable debug mode
 
         Returns:
-            TunnelInfo: Info of the tag tunnel
+            TunnelProxy: Proxy of the tag tunnel, or `TunnelLaneProxy`
         """
         self._lock()
+        try:
+            tunnel_info = self._get_or_setup_tunnel(tag, debug)
+            if not tunnel_info:
+                return
+            if tag != 'common' or not self._tunnel_lanes:
+                return self._get_tunnel_proxy(tunnel_info)
+            from ..data import TunnelLaneProxy
+            proxies = {tag: self._get_tunnel_proxy(tunnel_info)}
+            routes = {}
+            for lane, spec in self._tunnel_lanes.items():
+                lane_info = self._get_or_setup_tunnel(lane, debug)
+                if not lane_info:
+                    continue
+                proxies[lane] = self._get_tunnel_proxy(lane_info)
+                routes.update({m: lane for m in spec.get('methods', ())})
+            return TunnelLaneProxy(proxies, routes)
+        finally:
+            self._unlock()
+
+    def _get_or_setup_tunnel(self, tag, debug):
         if tag in self._tunnels:
-            tunnel_info = self._tunnels[tag].get_tunnel()
             self._llogger.debug(f'use exist tunnel for {tag}')
-            self._unlock()
-            return self._get_tunnel_proxy(tunnel_info)
+            return self._tunnels[tag].get_tunnel()
         tunnel_info = self._setup_tunnel(tag, debug)
         if not tunnel_info:
             self._llogger.debug(f'setup tunnel failed for {tag}')
-            self._unlock()
             return
         self._llogger.debug(f'setup tunnel for {tag}')
-        self._unlock()
-        return self._get_tunnel_proxy(tunnel_info)
+        return tunnel_info
 
     def _get_tunnel_proxy(self, tunnel_info, local=True, debug=False):
         from ..data import TunnelProxy
@@ -203,6 +263,19 @@ class OutlineNode(SelfAwareNode):
             tag (str): Name tag of the tunnel
 
         Returns:
-            dict: The corresponding tunnel statistics (e.g., `conn_num`) with respect to the tag
+            dict: The corresponding tunnel statistics (e.g., `conn_num`) with respect to the tag,
+                and under 'methods' the calls, in-flight calls, request and response bytes and
+                the deserialize/execute/serialize latency percentiles (us) of every method
         """
         return self._tunnels[tag].get_tunnel_stats()
+
+    def bump_tunnel_version(self, key):
+        """Invalidate the results cached by proxies under a version key.
+
+        The new version reaches a proxy with its next response, see
+        `raylink.data.tunnel.cache.TunnelCache`.
+
+        Args:
+            key (str): Version key of `_tunnel_cache`
+        """
+        self._tunnel_versions[key] = self._tunnel_versions.get(key, 0) + 1
@@ -47,6 +47,13 @@ def wrap_class(cls):
 
         return method
 
+    def wrapper_method_t_oneway(n):
+        @functools.wraps(n)
+        def method(self, *args, **kwargs):
+            return getattr(_get_proxy(self.obj), n + '_oneway')(*args, **kwargs)
+
+        return method
+
     new_class_dict = {'__init__': constructor}
     methods = inspect.getmembers(cls, predicate=inspect.isfunction)
     methods = [(n, f) for n, f in methods if n != '__init__']
@@ -61,6 +68,14 @@ def wrap_class(cls):
     wrapper_methods_t_async = {n + '_t_async': wrapper_method_t_async(n)
                                for n, _ in methods}
     new_class_dict.update(wrapper_methods_t_async)
+    wrapper_methods_t_oneway = {n + '_t_oneway': wrapper_method_t_oneway(n)
+                                for n, _ in methods}
+    new_class_dict.update(wrapper_methods_t_oneway)
+
+    def coalesce_t(self, **kwargs):
+        return _get_proxy(self.obj).coalesce(**kwargs)
+
+    new_class_dict['coalesce_t'] = coalesce_t
     new_class = type(cls.__name__ + '_', (object,), new_class_dict)
     return new_class
 
@@ -0,0 +1,280 @@
+from unittest import TestCase
+from raylink.data.replay.pool import ReadHeadPool
+from raylink.data.replay.shm_replay import ShmReplay, CursorBlock
+from raylink.data.replay.interval import IntervalSet
+from raylink.data.tunnel.client import TunnelProxy
+from tests.test_tunnel import FakeNode, fakelogger, start_server
+from easydict import EasyDict
+from threading import Lock
+import numpy as np
+import time
+
+
+class FakeReplay(ShmReplay):
+    """Replay without heads, which are actors."""
+
+    def create_head(self):
+        self.read_heads_path = self.write_heads_path = []
+
+
+def make_replay(capacity):
+    replay = FakeReplay.__new__(FakeReplay)
+    replay._OutlineNode__lock = Lock()
+    replay._logger = replay._llogger = fakelogger
+    replay._index, replay._ip, replay._node_cfg = 0, '127.0.0.1', {}
+    replay.setup(EasyDict(capacity=capacity,
+                          structure={'x': ((), np.int64, None)}))
+    return replay
+
+
+class FakeReadHead(FakeNode):
+    def __init__(self, delay=0.):
+        super(FakeReadHead, self).__init__()
+        self.delay = delay
+        self.array = np.arange(100) * 10
+        self.counts = np.zeros(100, np.int64)
+
+    def read(self, keys, cursors, count=False):
+        time.sleep(self.delay)
+        if count:
+            np.add.at(self.counts, cursors[keys[0]], 1)
+        return {key: self.array[cursors[key]] for key in keys}
+
+
+class Head(object):
+    """Read head wrapper of a tunnel proxy."""
+
+    def __init__(self, node):
+        self.node = node
+        self.proxy = TunnelProxy(start_server(node).get_tunnel(),
+                                 local=True, logger=fakelogger)
+
+    def read_t_async(self, *args, **kwargs):
+        return self.proxy.read_async(*args, **kwargs)
+
+
+class TestReadHeadPool(TestCase):
+    def test_least_outstanding(self):
+        heads = [Head(FakeReadHead(0.2)) for _ in range(3)]
+        pool = ReadHeadPool(heads)
+        futures = [pool.read_async(['x'], {'x': [i]}) for i in range(3)]
+        self.assertEqual(pool.outstanding, [1, 1, 1])
+        self.assertEqual([f.result()['x'].tolist() for f in futures],
+                         [[0], [10], [20]])
+        time.sleep(0.05)
+        self.assertEqual(pool.outstanding, [0, 0, 0])
+        self.assertEqual(pool.read(['x'], {'x': [1, 2]}, count=True)['x']
+                         .tolist(), [10, 20])
+        self.assertEqual(sum(h.node.counts[1] for h in heads), 1)
+
+    def test_hedge(self):
+        slow, fast = FakeReadHead(), FakeReadHead()
+        pool = ReadHeadPool([Head(slow), Head(fast)], hedge=90,
+                            min_samples=10)
+        for i in range(10):
+            pool.read(['x'], {'x': [i]})
+        self.assertEqual(pool.hedged, 0)
+        self.assertIsNotNone(pool.hedge_delay())
+        slow.delay = 1.
+        st = time.time()
+        for i in range(2):
+            self.assertEqual(
+                pool.read(['x'], {'x': [i]}, count=True)['x'].tolist(),
+                [i * 10])
+        self.assertLess(time.time() - st, 1.)
+        self.assertEqual(pool.hedged, 1)
+        time.sleep(1.)
+        # counted once, by the first read
+        self.assertEqual(slow.counts[0] + fast.counts[0], 1)
+        self.assertEqual(slow.counts[1] + fast.counts[1], 1)
+
+    def test_read_split(self):
+        heads = [Head(FakeReadHead()) for _ in range(3)]
+        pool = ReadHeadPool(heads)
+        cursors = np.arange(99, 29, -1)
+        batch = pool.read_split(['x'], {'x': cursors}, count=True)
+        self.assertEqual(batch['x'].tolist(), (cursors * 10).tolist())
+        self.assertTrue(all(h.node.counts.any() for h in heads))
+        self.assertEqual(sum(h.node.counts for h in heads).sum(), 70)
+        batch = pool.read_split(['x'], {'x': cursors[:5]}, min_size=10)
+        self.assertEqual(batch['x'].tolist(), (cursors[:5] * 10).tolist())
+
+
+class TestIntervalSet(TestCase):
+    def test_interval_set(self):
+        s = IntervalSet([5, 0, 3, 9], [6, 2, 3, 8])
+        self.assertEqual(s.intervals(), [(0, 3), (5, 6)])
+        self.assertEqual(len(s), 6)
+        self.assertIn(3, s)
+        self.assertNotIn(4, s)
+        self.assertEqual(s.contains([-1, 0, 4, 6, 7]).tolist(),
+                         [False, True, False, True, False])
+        self.assertEqual(s.to_indices().tolist(), [0, 1, 2, 3, 5, 6])
+        s.add_area(4, 4)
+        self.assertEqual(s.intervals(), [(0, 6)])
+        self.assertEqual((s - IntervalSet([2], [3])).intervals(),
+                         [(0, 1), (4, 6)])
+        self.assertEqual((s | IntervalSet([8, 7], [9, 7])).intervals(),
+                         [(0, 9)])
+        self.assertEqual((s & IntervalSet([5], [20])).intervals(), [(5, 6)])
+        self.assertEqual(len(IntervalSet() - s), 0)
+        draws = s.sample(1000, np.random.default_rng(0))
+        self.assertTrue(s.contains(draws).all())
+        self.assertEqual(len(set(draws.tolist())), 7)
+        self.assertEqual(len(IntervalSet().sample(0)), 0)
+        with self.assertRaises(ValueError):
+            IntervalSet().sample(1)
+
+    def test_ring_order(self):
+        # a full ring of 10 slots with the oldest at 4
+        s = IntervalSet([4, 0], [9, 3], origin=4)
+        self.assertEqual(s.intervals(), [(4, 9), (0, 3)])
+        self.assertEqual(s.to_indices().tolist(),
+                         [4, 5, 6, 7, 8, 9, 0, 1, 2, 3])
+        last = s.get_last(7)
+        self.assertEqual(last.intervals(), [(7, 9), (0, 3)])
+        self.assertEqual(last.to_indices().tolist(), [7, 8, 9, 0, 1, 2, 3])
+        self.assertEqual(s.get_last(2).intervals(), [(2, 3)])
+        self.assertIsNone(s.get_last(11))
+        self.assertEqual(len(s.get_last(0)), 0)
+
+
+class TestShmReplay(TestCase):
+    def setUp(self):
+        self.replay = make_replay(10)
+
+    def tearDown(self):
+        for shm in self.replay._shms.values():
+            shm.shm.unlink()
+        self.replay._cursor_block.shm.shm.unlink()
+
+    def test_reserve_cursors(self):
+        replay = self.replay
+        res, cid, cursors = replay.reserve_cursors(4)
+        self.assertEqual((res, cursors.tolist()), (0, [0, 1, 2, 3]))
+        res, cid2, cursors = replay.reserve_cursors(3)
+        self.assertEqual(cursors.tolist(), [4, 5, 6])
+        replay.unregister_cursor(cid)
+        # written but still in flight
+        self.assertEqual(list(replay.acquire_safe_area('n', 1, [])[0]), [3])
+        replay.release_safe_area('n')
+        replay.unregister_cursor([cid2])
+        self.assertEqual(list(replay.acquire_safe_area('n', 7, [])[0]),
+                         list(range(7)))
+        # wraps around, but not into the safe area being read
+        self.assertEqual(replay.reserve_cursors(4)[0], -1)
+        replay.release_safe_area('n')
+        res, cid, cursors = replay.reserve_cursors(4)
+        self.assertEqual(cursors.tolist(), [7, 8, 9, 0])
+        self.assertEqual(replay.loop_num(), 1)
+        # not over the oldest write in flight
+        self.assertEqual(replay.reserve_cursors(7)[0], -1)
+        self.assertEqual(list(replay.acquire_safe_area('n', 6, [])[0]),
+                         list(range(1, 7)))
+        replay.release_safe_area('n')
+        res, cid2, cursors = replay.reserve_cursors(6)
+        self.assertEqual(cursors.tolist(), list(range(1, 7)))
+        self.assertEqual(list(replay.acquire_safe_area('n', 1, [])[0]), [])
+        replay.unregister_cursor([cid, cid2])
+        self.assertEqual(replay.reserve_cursors(11)[0], -1)
+        self.assertEqual(replay.register_cursor(2)[2].tolist(), [7, 8])
+
+    def test_cursor_block(self):
+        import multiprocessing as mp
+        import pickle
+        replay = self.replay
+        # a write head attaching the block of the replay
+        block = pickle.loads(pickle.dumps(replay._cursor_block))
+        block.attach()
+        res, cid, cursors = block.reserve(3)
+        self.assertEqual(cursors.tolist(), [0, 1, 2])
+        self.assertEqual(replay.cursor(), 3)
+        self.assertEqual(list(replay.acquire_safe_area('n', 1, [])[0]), [])
+        block.release(cid)
+        self.assertEqual(list(replay.acquire_safe_area('n', 3, [])[0]),
+                         [0, 1, 2])
+        self.assertFalse(replay.validate_cursor(8))
+        self.assertEqual(block.reserve(8)[0], -1)
+        self.assertEqual(block.reserve(7)[2].tolist(), list(range(3, 10)))
+        replay.release_safe_area('n')
+        # not over the write in flight
+        self.assertEqual(block.reserve(4)[0], -1)
+        self.assertEqual(block.reserve(3)[2].tolist(), [0, 1, 2])
+
+        def write(block, n, queue):
+            block.attach()
+            cids = []
+            for _ in range(n):
+                res, cid, cursors = block.reserve(1)
+                block.release(cid)
+                cids.append(cid)
+            queue.put(cids)
+
+        block = CursorBlock(10000)
+        ctx = mp.get_context('fork')
+        queue = ctx.Queue()
+        procs = [ctx.Process(target=write, args=(block, 500, queue))
+                 for _ in range(4)]
+        [p.start() for p in procs]
+        cids = sum([queue.get() for _ in procs], [])
+        [p.join() for p in procs]
+        self.assertEqual(sorted(cids), list(range(2000)))
+        self.assertEqual(block.num, 2000)
+        self.assertIsNone(block.writes())
+        block.shm.shm.unlink()
+
+        # a full table is an error, not a dropped write
+        block = CursorBlock(10, max_writes=1)
+        block.reserve(1)
+        with self.assertRaises(RuntimeError):
+            block.reserve(1)
+        block.shm.shm.unlink()
+
+    def test_write_head(self):
+        import pickle
+        from raylink.data.replay.shm_replay import WriteHead
+        replay = self.replay
+        head = WriteHead.__new__(WriteHead)
+        head._llogger = fakelogger
+        head.setup(pickle.loads(pickle.dumps(replay._shms)),
+                   pickle.loads(pickle.dumps(replay._cursor_block)))
+        self.assertEqual(head.write_inc({'x': 5}).tolist(), [0])
+        self.assertEqual(head.write_multi_inc({'x': [6, 7]}).tolist(), [1, 2])
+        self.assertEqual(replay._shms['x'].array[:3].tolist(), [5, 6, 7])
+        # the slots are released if a write fails
+        with self.assertRaises(Exception):
+            head.write_inc({'y': 1})
+        self.assertIsNone(replay._cursor_block.writes())
+
+    def test_sample(self):
+        import pickle
+        from raylink.data.replay.shm_replay import ReadHead
+        replay = self.replay
+        self.assertEqual(replay.sample(1, ['x']), ([], None))
+        res, cid, cursors = replay.reserve_cursors(10)
+        replay._shms['x'].array[cursors] = cursors * 10
+        replay.unregister_cursor(cid)
+        # 0, 1, 2 are being written
+        res, cid, _ = replay.reserve_cursors(3)
+        draws = [replay.sample(7, ['x'], rng_seed=i) for i in range(50)]
+        indices = np.concatenate([d[0] for d in draws])
+        self.assertEqual(sorted(set(indices.tolist())), list(range(3, 10)))
+        for indices, batch in draws:
+            self.assertEqual(batch['x'].tolist(), (indices * 10).tolist())
+        self.assertEqual(replay.sample(7, ['x'], rng_seed=0)[0].tolist(),
+                         draws[0][0].tolist())
+        # with replacement, more draws than valid slots
+        indices, batch = replay.sample(8, ['x'])
+        self.assertTrue((indices >= 3).all())
+        self.assertEqual(batch['x'].tolist(), (indices * 10).tolist())
+        # the draws are no longer held
+        self.assertFalse((replay._cursor_block._areas[:, 0] >= 0).any())
+
+        head = ReadHead.__new__(ReadHead)
+        head.setup(pickle.loads(pickle.dumps(replay._shms)),
+                   pickle.loads(pickle.dumps(replay._cursor_block)))
+        indices, batch = head.sample(5, ['x'], count=True)
+        self.assertEqual(batch['x'].tolist(), (indices * 10).tolist())
+        self.assertEqual(replay._shms['access_count'].array.sum(), 5)
+        replay.unregister_cursor(cid)
+        self.assertEqual(len(head.sample(10, ['x'])[0]), 10)
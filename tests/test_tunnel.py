@@ -4,6 +4,51 @@ from raylink.data.tunnel.client import TunnelProxy
 import time
 
 
+class fakelogger(object):
+    @staticmethod
+    def debug(sth):
+        pass
+
+    @staticmethod
+    def warning(sth):
+        print(sth)
+
+    @staticmethod
+    def info(sth):
+        print(sth)
+
+    @staticmethod
+    def error(sth):
+        print(sth)
+
+
+class FakeNode(object):
+    def __init__(self):
+        self._ip = '127.0.0.1'
+        self._logger = fakelogger()
+        self._llogger = fakelogger()
+
+    def echo(self, a):
+        return a
+
+    def sleep(self, t):
+        time.sleep(t)
+        return t
+
+    def ip_(self):
+        return self._ip
+
+
+def start_server(node, pickler=None, debug=False, **kwargs):
+    server = TunnelServer(node, pickler, debug, **kwargs)
+    server.start()
+    # wait for server
+    time.sleep(0.1)
+    # usually unlocked by `OutlineNode._setup_tunnel`
+    server._unlock()
+    return server
+
+
 class TestTunnel(TestCase):
     def setUp(self) -> None:
         import numpy as np
@@ -11,36 +56,749 @@ class TestTunnel(TestCase):
         self.arr = np.arange(length)
 
     def test_tunnel_speed(self):
-        class fakelogger(object):
-            @staticmethod
-            def warning(sth):
-                print(sth)
+        server = start_server(FakeNode(), debug=True)
+        proxy = TunnelProxy(server.get_tunnel(), local=True, logger=fakelogger)
+
+        st = time.time()
+        proxy.echo(self.arr)
+        print(time.time() - st)
+
+    def test_pickler_out_of_band(self):
+        from raylink.data.tunnel.pickler import Pickler
+        import numpy as np
+        data = Pickler.c2s_dumps('echo', self.arr, small=np.arange(3))
+        self.assertIn(b'args#0', data)
+        self.assertNotIn(b'kwargs#0', data)
+        data = {k: bytes(v) for k, v in data.items()}
+        args, kwargs = Pickler.c2s_loads('echo', data)
+        self.assertTrue((args[0] == self.arr).all())
+        self.assertTrue((kwargs['small'] == np.arange(3)).all())
+        returns = Pickler.s2c_dumps('echo', {'a': self.arr})
+        returns = {k: bytes(v) for k, v in returns.items()}
+        self.assertTrue((Pickler.s2c_loads('echo', returns)['a'] == self.arr).all())
+        # writable unless it is turned off to save a copy
+        self.assertTrue(args[0].flags.writeable)
+
+        class ReadOnlyPickler(Pickler):
+            writable = False
+
+        array = ReadOnlyPickler.s2c_loads('echo', returns)['a']
+        self.assertFalse(array.flags.writeable)
+
+    def test_pipelining(self):
+        server = start_server(FakeNode())
+        proxy = TunnelProxy(server.get_tunnel(), local=True, logger=fakelogger,
+                            pool_size=1)
+        self.assertEqual(proxy.echo(1), 1)
+        st = time.time()
+        futures = [proxy.sleep_async(0.5 - i * 0.05) for i in range(8)]
+        results = [f.result() for f in futures]
+        self.assertEqual(results, [0.5 - i * 0.05 for i in range(8)])
+        # all calls are in flight on the same connection
+        self.assertLess(time.time() - st, 1.5)
+        self.assertEqual(proxy.get_client_num(), 1)
+
+    def test_connection_pool(self):
+        import pickle
+        server = start_server(FakeNode())
+        proxy = TunnelProxy(server.get_tunnel(), local=True, logger=fakelogger,
+                            pool_size=3)
+        self.assertEqual(proxy.echo(1), 1)
+        self.assertEqual(len(proxy._conns), 1)
+        futures = [proxy.sleep_async(0.3) for _ in range(6)]
+        [f.result() for f in futures]
+        self.assertEqual(len(proxy._conns), 3)
+        self.assertEqual(server.get_client_num(), 3)
+        proxy = pickle.loads(pickle.dumps(proxy))
+        self.assertEqual(proxy.pool_size, 3)
+        self.assertEqual(proxy.echo(2), 2)
+        proxy = pickle.loads(pickle.dumps(proxy))
+        self.assertEqual(proxy.echo(3), 3)
+        # retries are bounded
+        import portpicker
+        info = server.get_tunnel()._replace(
+            port=portpicker.pick_unused_port(), unix_path=None)
+        proxy = TunnelProxy(info, local=True, logger=fakelogger)
+        proxy.CONNECT_RETRIES = 1
+        with self.assertRaises(Exception):
+            proxy.echo(1)
+
+    def test_async_proxy(self):
+        import asyncio
+        import numpy as np
+        from raylink.data.tunnel.aio import AsyncTunnelProxy
+        from raylink.data.tunnel.pickler import ArrayDictPickler, array_dict
+
+        class ReadNode(FakeNode):
+            @array_dict(returns=True)
+            def read(self, n):
+                return {'a': np.arange(n), 'b': np.ones((n, 2))}
+
+        server = start_server(ReadNode(), pickler=ArrayDictPickler.of(ReadNode))
+
+        async def run():
+            proxy = AsyncTunnelProxy(server.get_tunnel(), logger=fakelogger)
+            self.assertEqual(await proxy.echo(1), 1)
+            st = time.time()
+            results = await asyncio.gather(
+                *[proxy.sleep(0.2) for _ in range(64)])
+            self.assertEqual(results, [0.2] * 64)
+            self.assertLess(time.time() - st, 2)
+            batch = await proxy.read(5)
+            self.assertTrue((batch['b'] == np.ones((5, 2))).all())
+            self.assertEqual(await proxy.get_client_num(), 1)
+            await proxy.close()
+
+        asyncio.run(run())
+
+    def test_async_server(self):
+        import numpy as np
+        server = start_server(FakeNode(), mode='async')
+        proxies = [TunnelProxy(server.get_tunnel(), local=True,
+                               logger=fakelogger, pool_size=1, shared=False)
+                   for _ in range(4)]
+        self.assertTrue((proxies[0].echo(self.arr) == self.arr).all())
+        self.assertEqual(server.get_client_num(), 1)
+        st = time.time()
+        futures = [p.sleep_async(0.3) for p in proxies for _ in range(4)]
+        self.assertEqual([f.result() for f in futures], [0.3] * 16)
+        self.assertLess(time.time() - st, 1.5)
+        self.assertEqual(server.get_client_num(), 4)
+        self.assertEqual(proxies[1].echo({'a': np.ones(3)})['a'].sum(), 3)
+
+    def test_shm_channel(self):
+        import os
+        from raylink.data.tunnel.shm_transport import TShmTransport
+        for mode in TunnelServer.MODES:
+            server = start_server(FakeNode(), mode=mode)
+            proxy = TunnelProxy(server.get_tunnel(), local=True,
+                                logger=fakelogger, pool_size=2, shm=True)
+            self.assertTrue((proxy.echo(self.arr) == self.arr).all())
+            conn = proxy._conns.get()
+            trans = conn.transport._TBufferedTransport__trans
+            # channels need a thread each, the async server keeps sockets
+            self.assertEqual(isinstance(trans, TShmTransport),
+                             mode == 'threaded')
+            futures = [proxy.sleep_async(0.3) for _ in range(4)]
+            self.assertEqual([f.result() for f in futures], [0.3] * 4)
+            self.assertEqual(server.get_client_num(), 2)
+            self.assertFalse(conn.call('open_shm', 'psm_0123', os.getpid()))
+            proxy._conns.close()
+            time.sleep(0.2)
+            self.assertEqual(server.get_client_num(), 0)
+            if mode == 'threaded':
+                # removed with the connection
+                self.assertFalse(os.path.exists(
+                    '/dev/shm/' + trans.channel.name))
+
+    def test_unix_socket(self):
+        # latencies of the transports are compared by `benchmark`
+        import socket
+        for mode in TunnelServer.MODES:
+            server = start_server(FakeNode(), mode=mode)
+            info = server.get_tunnel()
+            self.assertIsNotNone(info.unix_path)
+            for unix in (True, False):
+                proxy = TunnelProxy(info, local=True, logger=fakelogger,
+                                    pool_size=1, shm=False, unix=unix)
+                proxy.echo(0)
+                tsocket = proxy._conns.get().transport._TBufferedTransport__trans
+                family = socket.AF_UNIX if unix else socket.AF_INET
+                self.assertEqual(tsocket.handle.family, family)
+                futures = [proxy.echo_async(i) for i in range(50)]
+                self.assertEqual([f.result() for f in futures],
+                                 list(range(50)))
+                self.assertTrue((proxy.echo(self.arr) == self.arr).all())
+                proxy._conns.close()
+
+    def test_batch(self):
+        import numpy as np
+
+        class WriteNode(FakeNode):
+            def __init__(self):
+                super(WriteNode, self).__init__()
+                self.written = []
+
+            def write_inc(self, samples):
+                self.written.append(samples['a'].copy())
+                return len(self.written)
+
+        node = WriteNode()
+        server = start_server(node)
+        proxy = TunnelProxy(server.get_tunnel(), local=True, logger=fakelogger)
+        calls = [('write_inc', ({'a': np.full(3, i)},), {})
+                 for i in range(100)]
+        calls.append(('echo', (self.arr,), {}))
+        results = proxy.call_many(calls)
+        self.assertEqual(results[:-1], list(range(1, 101)))
+        self.assertTrue((results[-1] == self.arr).all())
+        self.assertEqual([a[0] for a in node.written], list(range(100)))
+        self.assertEqual(proxy.call_many_async(calls[:2]).result(), [101, 102])
+        with proxy.batch() as batch:
+            futures = [batch.echo(i) for i in range(10)]
+            self.assertEqual(len(batch), 10)
+        self.assertEqual([f.result() for f in futures], list(range(10)))
+        with self.assertRaises(Exception):
+            proxy.call_many([('echo', (1,), {}), ('sleep', (), {})])
+
+    def test_coalescer(self):
+        import numpy as np
+        from raylink.data.replay.pickler import WriteHeadPickler
+        from raylink.data.tunnel.pickler import array_dict
+
+        class WriteNode(FakeNode):
+            def __init__(self):
+                super(WriteNode, self).__init__()
+                self.calls = []
+
+            @array_dict('samples')
+            def write_inc(self, samples):
+                self.calls.append(('write_inc', 1))
+
+            @array_dict('samples')
+            def write_multi_inc(self, samples):
+                self.calls.append(('write_multi_inc', len(samples['s'])))
+                self.last = samples
+
+        node = WriteNode()
+        server = start_server(node, pickler=WriteHeadPickler.of(WriteNode))
+        proxy = TunnelProxy(server.get_tunnel(), local=True, logger=fakelogger)
+        writer = proxy.coalesce(max_calls=10, max_delay=60)
+        for i in range(25):
+            writer.write_inc({'s': np.full(4, i), 'r': float(i)})
+        # two batches are sent, five calls are still buffered
+        self.assertEqual(len(writer), 5)
+        writer.flush()
+        self.assertEqual(node.calls, [('write_multi_inc', 10)] * 2 +
+                         [('write_multi_inc', 5)])
+        self.assertEqual(node.last['s'].shape, (5, 4))
+        self.assertEqual(list(node.last['r']), [20., 21., 22., 23., 24.])
+        # arrays are copied when buffered
+        s = np.zeros(4)
+        writer.write_inc({'s': s})
+        s[:] = 1
+        writer.flush()
+        self.assertEqual(node.last['s'].tolist(), [[0.] * 4])
+        # time window
+        writer = proxy.coalesce(max_delay=0.05)
+        writer.TIMER_IDLE = 0.2
+        writer.echo(1)
+        writer.write_inc({'s': np.zeros(4)})
+        time.sleep(0.1)
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(node.calls[-1], ('write_multi_inc', 1))
+        # the timer stops when idle and starts again with calls
+        time.sleep(0.3)
+        self.assertIsNone(writer._timer)
+        writer.write_inc({'s': np.zeros(4)})
+        time.sleep(0.1)
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(len(node.calls), 6)
+        # errors are raised by the next flush
+        writer.sleep()
+        with self.assertRaises(Exception):
+            writer.flush()
+        writer.close()
+
+    def test_oneway(self):
+        import asyncio
+        from raylink.data.tunnel.aio import AsyncTunnelProxy
 
-            @staticmethod
-            def info(sth):
-                print(sth)
+        class Logger(fakelogger):
+            def __init__(self):
+                self.errors = []
+
+            def error(self, sth):
+                self.errors.append(sth)
+
+        class PutNode(FakeNode):
+            def __init__(self):
+                super(PutNode, self).__init__()
+                self._logger = Logger()
+                self.items = []
+
+            def put(self, x):
+                self.items.append(x)
+
+        for mode in TunnelServer.MODES:
+            node = PutNode()
+            server = start_server(node, mode=mode)
+            proxy = TunnelProxy(server.get_tunnel(), local=True,
+                                logger=fakelogger, pool_size=1)
+            st = time.time()
+            self.assertIsNone(proxy.sleep_oneway(0.5))
+            self.assertLess(time.time() - st, 0.3)
+            for i in range(100):
+                proxy.put_oneway(i)
+            proxy.put_oneway()
+            # a call with a response on the same connection still works
+            self.assertEqual(proxy.echo(1), 1)
+            time.sleep(0.2)
+            self.assertEqual(sorted(node.items), list(range(100)))
+            self.assertEqual(len(node._logger.errors), 1)
+            self.assertIn('put', node._logger.errors[0])
+
+            async def run():
+                aproxy = AsyncTunnelProxy(server.get_tunnel(), logger=fakelogger)
+                await aproxy.put_oneway(100)
+                self.assertEqual(await aproxy.echo(2), 2)
+                await aproxy.close()
 
-            @staticmethod
-            def error(sth):
-                print(sth)
+            asyncio.run(run())
+            time.sleep(0.1)
+            self.assertIn(100, node.items)
 
-        class FakeNode(object):
+    def test_codec(self):
+        import zlib
+        import numpy as np
+        from raylink.util.util import get_ip
+        from raylink.data.tunnel.codec import Codec
+
+        codec = Codec('zlib')
+        data = codec.encode({b'a': np.zeros(10000).data.cast('B'),
+                             b'b': b'small'})
+        self.assertEqual(set(data), {b'a@', b'b'})
+        self.assertGreater(codec.saved, 70000)
+        self.assertEqual(codec.decode(data)[b'a'], bytes(80000))
+
+        arr = np.zeros((100, 84, 84), np.uint8)
+        for spec in ('zlib', (zlib.compress, zlib.decompress)):
+            node = FakeNode()
+            server = start_server(node, codec=spec)
+            self.assertEqual(server.get_tunnel().codec, spec)
+            # the node ip differs from the ip of this host
+            proxy = TunnelProxy(server.get_tunnel(), local=True,
+                                logger=fakelogger)
+            self.assertTrue((proxy.echo(arr) == arr).all())
+            self.assertEqual(proxy.call_many([('echo', (arr,), {})])[0].sum(), 0)
+            stats = server.get_tunnel_stats()
+            self.assertGreater(stats['codec_bytes_saved'], arr.nbytes * 0.9)
+            self.assertGreater(proxy.codec.saved, arr.nbytes * 1.8)
+            # no compression on the same host
+            node._ip = get_ip()
+            proxy = TunnelProxy(server.get_tunnel(), local=True,
+                                logger=fakelogger)
+            self.assertTrue((proxy.echo(arr) == arr).all())
+            self.assertEqual(server.get_tunnel_stats()['codec_bytes_saved'],
+                             stats['codec_bytes_saved'])
+
+    def test_stream(self):
+        import numpy as np
+        from raylink.data.tunnel.client import TunnelStream
+        from raylink.data.tunnel.server import Handler
+        from raylink.data.tunnel.pickler import ArrayDictPickler, array_dict
+
+        class StreamNode(FakeNode):
             def __init__(self):
-                self._ip = '127.0.0.1'
-                self._logger = fakelogger()
+                super(StreamNode, self).__init__()
+                self.produced = 0
 
-            def echo(self, a):
-                return a
+            @array_dict(returns=True)
+            def read_iter(self, n, size):
+                for i in range(n):
+                    self.produced += 1
+                    yield {'a': np.full(size, i)}
 
-            def ip_(self):
-                return self._ip
+            def fail(self):
+                yield 1
+                raise ValueError()
 
-        server = TunnelServer(FakeNode(), None, True)
-        server.start()
-        # wait for server
+        node = StreamNode()
+        server = start_server(node, pickler=ArrayDictPickler.of(StreamNode))
+        proxy = TunnelProxy(server.get_tunnel(), local=True, logger=fakelogger)
+        stream = proxy.read_iter(5, 1000)
+        self.assertIsInstance(stream, TunnelStream)
+        self.assertEqual(node.produced, 0)
+        self.assertEqual([c['a'][0] for c in stream], list(range(5)))
+        self.assertEqual(server.get_tunnel_stats()['stream_num'], 0)
+        # consumed one by one with one chunk prefetched
+        stream = proxy.read_iter_async(100, 10).result()
+        self.assertEqual(next(stream)['a'][0], 0)
         time.sleep(0.1)
+        self.assertEqual(node.produced, 5 + 2)
+        self.assertEqual(server.get_tunnel_stats()['stream_num'], 1)
+        stream.close()
+        time.sleep(0.1)
+        self.assertEqual(server.get_tunnel_stats()['stream_num'], 0)
+        stream = proxy.call_many([('read_iter', (2, 3), {})])[0]
+        self.assertEqual(len(list(stream)), 2)
+        stream = proxy.fail()
+        self.assertEqual(next(stream), 1)
+        with self.assertRaises(Exception):
+            next(stream)
+        self.assertEqual(list(stream), [])
+        self.assertEqual(server.get_tunnel_stats()['stream_num'], 0)
+        # streams left open by a client expire
+        server.handler.STREAM_TTL = 0.1
+        stream = proxy.read_iter(100, 10)
+        next(stream)
+        time.sleep(0.2)
+        other = proxy.read_iter(100, 10)
+        self.assertEqual(server.get_tunnel_stats()['stream_num'], 1)
+        self.assertLessEqual(len(list(stream)), 1)
+        other.close()
+        server.handler.STREAM_TTL = Handler.STREAM_TTL
+
+        async def run():
+            from raylink.data.tunnel.aio import AsyncTunnelProxy
+            aproxy = AsyncTunnelProxy(server.get_tunnel(), logger=fakelogger)
+            chunks = [c['a'][0] async for c in await aproxy.read_iter(4, 10)]
+            self.assertEqual(chunks, list(range(4)))
+            stream = await aproxy.read_iter(4, 10)
+            await stream.__anext__()
+            await stream.close()
+            await aproxy.close()
+
+        import asyncio
+        asyncio.run(run())
+        self.assertEqual(server.get_tunnel_stats()['stream_num'], 0)
+
+    def test_framed_transport(self):
+        import numpy as np
+        from raylink.data.tunnel.transport import TFramedTransport
+        for mode in TunnelServer.MODES:
+            for protocol in ('binary', 'compact'):
+                server = start_server(FakeNode(), mode=mode, framed=True,
+                                      protocol=protocol)
+                for shm in (True, False):
+                    proxy = TunnelProxy(server.get_tunnel(), local=True,
+                                        logger=fakelogger, shm=shm)
+                    self.assertEqual(proxy.echo(1), 1)
+                    self.assertIsInstance(proxy._conns.get().transport,
+                                          TFramedTransport)
+                    self.assertTrue((proxy.echo(self.arr) == self.arr).all())
+                    self.assertEqual(proxy.call_many(
+                        [('echo', (np.ones(100000),), {})])[0].sum(), 100000)
+                    futures = [proxy.sleep_async(0.2) for _ in range(4)]
+                    self.assertEqual([f.result() for f in futures], [0.2] * 4)
+                    proxy._conns.close()
+
+    def test_executor(self):
+        from raylink.data.tunnel.executor import TunnelExecutor, \
+            TunnelOverloaded
+        executor = TunnelExecutor(2, limits={'write': 1},
+                                  priorities={'read': 0})
+        order = []
+
+        def run(name, t):
+            time.sleep(t)
+            order.append(name)
+
+        futures = [executor.submit_task('write', run, 'write', 0.1)
+                   for _ in range(3)]
+        futures.append(executor.submit_task('other', run, 'other', 0.05))
+        futures += [executor.submit_task('read', run, 'read', 0)
+                    for _ in range(2)]
+        [f.result() for f in futures]
+        # writes run one by one, reads are not blocked by them
+        self.assertEqual(order[:3], ['read', 'read', 'other'])
+        self.assertEqual(order[3:], ['write'] * 3)
+        self.assertEqual(executor.submit(lambda: 1).result(), 1)
+
+        for mode in TunnelServer.MODES:
+            server = start_server(FakeNode(), mode=mode, max_workers=2,
+                                  limits={'sleep': 1}, max_pending=2)
+            proxy = TunnelProxy(server.get_tunnel(), local=True,
+                                logger=fakelogger, pool_size=1)
+            futures = [proxy.sleep_async(0.3) for _ in range(2)]
+            time.sleep(0.1)
+            st = time.time()
+            self.assertEqual(proxy.echo(1), 1)
+            self.assertLess(time.time() - st, 0.1)
+            # the worker of `echo` is done shortly after its reply
+            time.sleep(0.05)
+            self.assertEqual(server.get_tunnel_stats()['executor'],
+                             {'pending': 1, 'running': {'sleep': 1},
+                              'deferred': {'sleep': 1}})
+            futures += [proxy.sleep_async(0.3) for _ in range(2)]
+            errors = []
+            for f in futures:
+                try:
+                    self.assertEqual(f.result(), 0.3)
+                except TunnelOverloaded as e:
+                    errors.append(e)
+            self.assertEqual(len(errors), 1)
+
+    def test_executor_keys(self):
+        import marshal
+        from raylink.data.tunnel.executor import TunnelExecutor
+        executor = TunnelExecutor(1, limits={'a': 2, 'b': 1},
+                                  priorities={'c': 2}, blocking=('d',))
+        self.assertEqual(executor.strictest(['a', 'b', 'c']), 'b')
+        self.assertEqual(executor.strictest(['c', 'e']), 'c')
+        self.assertEqual(executor.strictest(['a', 'd']), 'd')
+        for mode in TunnelServer.MODES:
+            server = start_server(FakeNode(), mode=mode, max_workers=2,
+                                  limits={'sleep': 1})
+            proxy = TunnelProxy(server.get_tunnel(), local=True,
+                                logger=fakelogger, pool_size=1)
+            st = time.time()
+            # batches are limited by the methods they call
+            futures = [proxy.call_many_async([('sleep', (0.2,), {})])
+                       for _ in range(2)]
+            self.assertEqual([f.result() for f in futures], [[0.2]] * 2)
+            self.assertGreater(time.time() - st, 0.4)
+            handler = server.handler
+            self.assertEqual(handler.task_key(
+                '__batch__', {b'__funcs__': marshal.dumps(['echo', 'sleep'])}),
+                'sleep')
+            handler.streams[-1] = 'read_iter', None, None
+            self.assertEqual(handler.task_key(
+                '__stream_next__', {b'__stream__': b'-1'}), 'read_iter')
+            handler.streams.pop(-1)
+
+    def test_blocking_methods(self):
+        import queue
+
+        class QueueNode(FakeNode):
+            def __init__(self):
+                super(QueueNode, self).__init__()
+                self.queue = queue.Queue()
+
+            def put(self, x):
+                self.queue.put(x)
+
+            def get(self):
+                return self.queue.get()
+
+        for mode in TunnelServer.MODES:
+            server = start_server(QueueNode(), mode=mode, max_workers=2,
+                                  blocking=('get',))
+            proxy = TunnelProxy(server.get_tunnel(), local=True,
+                                logger=fakelogger, pool_size=1)
+            # more waiting gets than workers do not hold back the puts
+            gets = [proxy.get_async() for _ in range(4)]
+            time.sleep(0.1)
+            puts = [proxy.put_async(i) for i in range(4)]
+            [f.result(timeout=5) for f in puts]
+            self.assertEqual(sorted(f.result(timeout=5) for f in gets),
+                             [0, 1, 2, 3])
+
+        from raylink.data.tunnel.executor import TunnelExecutor, \
+            TunnelOverloaded
+        executor = TunnelExecutor(1, max_pending=1, blocking=('get',),
+                                  blocking_workers=2)
+        q = queue.Queue()
+        # the blocking pool is bounded, the gets beyond it wait as pending
+        gets = []
+        for _ in range(3):
+            gets.append(executor.submit_task('get', q.get))
+            time.sleep(0.05)
+        self.assertEqual(executor.stats()['pending'], 1)
+        self.assertEqual(executor.stats()['running'], {'get': 2})
+        with self.assertRaises(TunnelOverloaded):
+            executor.submit_task('get', q.get)
+        for i in range(3):
+            q.put(i)
+        self.assertEqual(sorted(f.result(timeout=5) for f in gets), [0, 1, 2])
+        executor.shutdown()
+
+    def test_stats(self):
+        from raylink.data.tunnel.stats import Histogram
+        hist = Histogram()
+        for v in range(1, 10001):
+            hist.record(v)
+        snap = hist.snapshot()
+        self.assertEqual(snap['count'], 10000)
+        self.assertEqual(snap['max'], 10000)
+        self.assertAlmostEqual(snap['p50'], 5000, delta=5000 * 0.04)
+        self.assertAlmostEqual(snap['p99'], 9900, delta=9900 * 0.04)
+
+        server = start_server(FakeNode())
+        proxy = TunnelProxy(server.get_tunnel(), local=True,
+                            logger=fakelogger)
+        for _ in range(10):
+            proxy.sleep(0.01)
+        with self.assertRaises(Exception):
+            proxy.sleep('x')
+        stats = server.get_tunnel_stats()['methods']['sleep']
+        self.assertEqual(stats['calls'], 10)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertGreater(stats['request_bytes'], 0)
+        self.assertGreater(stats['response_bytes'], 0)
+        self.assertEqual(stats['execute_us']['count'], 10)
+        self.assertGreaterEqual(stats['execute_us']['p50'], 9000)
+        self.assertLess(stats['deserialize_us']['p50'], 9000)
+
+    def test_array_dict_pickler(self):
+        import numpy as np
+        from raylink.data.tunnel.pickler import ArrayDictPickler, \
+            array_dict, _parse_header
+
+        class ArrayNode(FakeNode):
+            @array_dict('samples')
+            def put(self, samples, timeout=1):
+                self.samples = samples
+                return timeout
+
+            @array_dict('a', 'b', returns=True)
+            def add(self, a, b):
+                return a[0] + b[0], {'sum': a[1] + b[1]}
+
+            @array_dict(returns=True)
+            def get(self, n):
+                return {'obs': np.ones((n, 3), np.float32), 'step': n,
+                        'tags': np.array(['a', 'b'])}
+
+        pickler = ArrayDictPickler.of(ArrayNode)
+        self.assertEqual(sorted(pickler.funcs), ['add', 'get', 'put'])
+        samples = {'s': np.arange(12).reshape(3, 4)[:, ::2], 'r': 1.0}
+        data = pickler.c2s_dumps('put', samples)
+        self.assertEqual(set(data), {b'h', b'0', b'p'})
+        args, kwargs = pickler.c2s_loads('put', data)
+        self.assertTrue((args[0]['s'] == samples['s']).all())
+        self.assertEqual(args[0]['r'], 1.0)
+        # only the schema is cached, not the arrays
+        hits = _parse_header.cache_info().hits
+        args, kwargs = pickler.c2s_loads('put', pickler.c2s_dumps(
+            'put', timeout=2, samples={'s': samples['s'] + 1, 'r': 2.0}))
+        self.assertEqual(_parse_header.cache_info().hits, hits + 1)
+        self.assertEqual(kwargs['timeout'], 2)
+        self.assertTrue((kwargs['samples']['s'] == samples['s'] + 1).all())
+        args, _ = pickler.c2s_loads('put', {k: bytes(v) for k, v in data.items()})
+        self.assertTrue(args[0]['s'].flags.writeable)
+
+        node = ArrayNode()
+        server = start_server(node, pickler=pickler)
         proxy = TunnelProxy(server.get_tunnel(), local=True, logger=fakelogger)
+        self.assertEqual(proxy.put({'s': self.arr}, 3), 3)
+        self.assertTrue((node.samples['s'] == self.arr).all())
+        a, b = (np.zeros(2), np.ones((0, 2))), [np.ones(2), np.zeros((0, 2))]
+        x, y = proxy.add(a, b)
+        self.assertTrue((x == 1).all())
+        self.assertEqual(y['sum'].shape, (0, 2))
+        batch = proxy.get(4)
+        self.assertEqual(batch['obs'].dtype, np.float32)
+        self.assertEqual(batch['step'], 4)
+        self.assertEqual(list(batch['tags']), ['a', 'b'])
+        self.assertEqual(proxy.echo({'a': self.arr[:3]})['a'].tolist(),
+                         [0, 1, 2])
 
+    def test_benchmark(self):
+        import json
+        from raylink.data.tunnel.benchmark import run_benchmark
+        results = list(run_benchmark(
+            sizes=[100, 10000], concurrency=[2], transports=['unix', 'tcp'],
+            calls=20))
+        self.assertEqual(len(results), 2 * 2 * 2 * 2)
+        for result in results:
+            self.assertEqual(json.loads(json.dumps(result)), result)
+            self.assertGreater(result['calls_per_s'], 0)
+            self.assertLessEqual(result['p50_us'], result['p99_us'])
+
+    def test_lanes(self):
+        import os
+        import pickle
+        from raylink.data.tunnel.lane import TunnelLaneProxy
+
+        class LaneNode(FakeNode):
+            def nice(self):
+                return os.getpriority(os.PRIO_PROCESS, 0)
+
+        node = LaneNode()
+        common = start_server(node, max_workers=1)
+        control = start_server(node, max_workers=1, nice=5)
+        proxy = TunnelLaneProxy(
+            {'common': TunnelProxy(common.get_tunnel(), logger=fakelogger),
+             'control': TunnelProxy(control.get_tunnel(), logger=fakelogger)},
+            {'echo': 'control', 'nice': 'control'})
+        self.assertIs(proxy.route('echo_async'), proxy.lane('control'))
+        self.assertIs(proxy.route('sleep'), proxy.lane())
+        # control calls are not queued behind the busy common lane
+        future = proxy.sleep_async(0.5)
+        time.sleep(0.1)
         st = time.time()
-        proxy.echo(self.arr)
-        print(time.time() - st)
+        self.assertEqual(proxy.echo(1), 1)
+        self.assertEqual(proxy.echo_async(2).result(), 2)
+        self.assertLess(time.time() - st, 0.3)
+        self.assertEqual(future.result(), 0.5)
+        # niceness is capped at 19
+        self.assertEqual(proxy.nice(),
+                         min(os.getpriority(os.PRIO_PROCESS, 0) + 5, 19))
+        self.assertEqual(proxy.call_many([('echo', (3,), {})]), [3])
+        self.assertEqual(
+            control.get_tunnel_stats()['methods']['echo']['calls'], 3)
+        proxy = pickle.loads(pickle.dumps(proxy))
+        self.assertEqual(proxy.echo(4), 4)
+        self.assertGreaterEqual(proxy.get_client_num(), 1)
+        self.assertEqual(proxy.cache_stats(),
+                         {'hits': 0, 'misses': 0, 'size': 0})
+
+    def test_cache(self):
+        class CacheNode(FakeNode):
+            def __init__(self):
+                super(CacheNode, self).__init__()
+                self.calls = 0
+                self._tunnel_versions = {}
+
+            def count(self, *args):
+                self.calls += 1
+                return self.calls
+
+            def bump(self):
+                self._tunnel_versions['v'] = \
+                    self._tunnel_versions.get('v', 0) + 1
+
+        node = CacheNode()
+        server = start_server(node, cache={'count': {'ttl': 0.3},
+                                           'echo': {'version': 'v',
+                                                    'check': 0.3}})
+        proxy = TunnelProxy(server.get_tunnel(), local=True,
+                            logger=fakelogger)
+        self.assertEqual(proxy.count(), 1)
+        self.assertEqual(proxy.count(), 1)
+        self.assertEqual(proxy.count_async().result(), 1)
+        # keyed by the arguments
+        self.assertEqual(proxy.count([1]), 2)
+        self.assertEqual(proxy.count([1]), 2)
+        self.assertEqual(proxy.count(_bypass_cache=True), 3)
+        self.assertEqual(proxy.count(), 3)
+        time.sleep(0.3)
+        self.assertEqual(proxy.count(), 4)
+        self.assertEqual(proxy.cache_stats(),
+                         {'hits': 4, 'misses': 3, 'size': 2})
+
+        result = proxy.echo([1])
+        self.assertIs(proxy.echo([1]), result)
+        proxy.bump()
+        # the new version comes with the response of `bump`
+        self.assertIsNot(proxy.echo([1]), result)
+        self.assertEqual(proxy.echo_async([1]).result(), [1])
+        self.assertEqual(proxy.cache_stats()['hits'], 6)
+        # a version bumped without a call is seen after `check` seconds
+        result = proxy.echo([1])
+        node.bump()
+        self.assertIs(proxy.echo([1]), result)
+        time.sleep(0.3)
+        self.assertIsNot(proxy.echo([1]), result)
+        self.assertEqual(proxy.call_many([('count', (), {'_bypass_cache': 1})]),
+                         [5])
+
+    def test_registry(self):
+        import gc
+        import pickle
+        server = start_server(FakeNode())
+        proxy = TunnelProxy(server.get_tunnel(), local=True,
+                            logger=fakelogger, pool_size=2)
+        self.assertEqual(proxy.echo(1), 1)
+        key = proxy._key
+        self.assertEqual(key[:3], ('127.0.0.1', server.port, 'common'))
+        copies = [pickle.loads(pickle.dumps(proxy)) for _ in range(10)]
+        self.assertEqual([p.echo(i) for i, p in enumerate(copies)],
+                         list(range(10)))
+        futures = [p.sleep_async(0.1) for p in copies]
+        [f.result() for f in futures]
+        # one pool of at most two connections for all the proxies
+        self.assertEqual(TunnelProxy.registry.refs(key), 11)
+        self.assertIs(copies[0]._conns, proxy._conns)
+        self.assertEqual(server.get_client_num(), 2)
+        del copies, futures
+        gc.collect()
+        self.assertEqual(TunnelProxy.registry.refs(key), 1)
+        self.assertEqual(proxy.echo(2), 2)
+        del proxy
+        gc.collect()
+        self.assertEqual(TunnelProxy.registry.refs(key), 0)
+        time.sleep(0.2)
+        self.assertEqual(server.get_client_num(), 0)